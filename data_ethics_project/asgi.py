@@ -14,3 +14,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "data_ethics_project.settings")
 
 application = get_asgi_application()
+
+# Warm up (URL resolvers, templates, catalogs, the IP range index...) before
+# a preloading server forks its workers, so they share the pages instead of
+# each building a copy. Opt-in: runserver and other tools import this module
+# too, and have nothing to fork.
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_ON_IMPORT:
+    from ethics_app.warmup import prefork
+
+    prefork()
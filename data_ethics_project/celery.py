@@ -1,7 +1,10 @@
 
+import importlib.util
 import os
 from celery import Celery
+from celery.signals import worker_init
 from celery.schedules import crontab
+from kombu import Queue
 
 # Set default Django settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'data_ethics_project.settings')
@@ -10,14 +13,63 @@ app = Celery('data_ethics_project')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+# Queues: interactive work (data subject requests, breach notices) must not
+# wait behind bulk jobs, so each queue gets its own workers, e.g.
+#   celery -A data_ethics_project worker -Q interactive -c 4 -n interactive@%h
+#   celery -A data_ethics_project worker -Q bulk -c 1 -n bulk@%h
+# Within a queue, lower priorities are taken first (Redis ordering).
+app.conf.task_queues = [Queue('interactive'), Queue('bulk')]
+app.conf.task_default_queue = 'interactive'
+app.conf.task_routes = {
+    'ethics_app.tasks.process_data_subject_request': {'queue': 'interactive', 'priority': 0},
+    'ethics_app.tasks.relay_outboxes': {'queue': 'interactive', 'priority': 1},
+    'ethics_app.tasks.relay_outbox': {'queue': 'interactive', 'priority': 1},
+    'ethics_app.tasks.sync_read_replicas': {'queue': 'interactive', 'priority': 1},
+    'ethics_app.tasks.notify_breach_subjects': {'queue': 'interactive', 'priority': 2},
+    'ethics_app.tasks.send_breach_notification_chunk': {'queue': 'interactive', 'priority': 3},
+    'ethics_app.tasks.reconcile_policy_consents': {'queue': 'bulk', 'priority': 5},
+    'ethics_app.tasks.refresh_consent_snapshot': {'queue': 'bulk', 'priority': 6},
+    'ethics_app.tasks.compact_orphaned_consents': {'queue': 'bulk', 'priority': 7},
+    'ethics_app.tasks.cleanup_expired_data': {'queue': 'bulk', 'priority': 8},
+    'ethics_app.tasks.generate_monthly_compliance_report': {'queue': 'bulk', 'priority': 9},
+}
+
+
+
+@worker_init.connect
+def warm_up_worker(**kwargs):
+    # In the parent, before the prefork pool forks its child processes
+    from ethics_app.warmup import prefork
+    prefork()
+
+
 # Periodic tasks
 app.conf.beat_schedule = {
+    'relay-outboxes': {
+        'task': 'ethics_app.tasks.relay_outboxes',
+        'schedule': 1.0,  # Every second; relays still running are skipped
+    },
+    'sync-read-replicas': {
+        'task': 'ethics_app.tasks.sync_read_replicas',
+        'schedule': 60.0,  # Every minute; clients that wrote read from the primary until then
+    },
     'cleanup-expired-data': {
         'task': 'ethics_app.tasks.cleanup_expired_data',
         'schedule': crontab(hour=2, minute=0),  # Daily at 2 AM
     },
+    'compact-orphaned-consents': {
+        'task': 'ethics_app.tasks.compact_orphaned_consents',
+        'schedule': crontab(minute=30),  # Hourly
+    },
     'monthly-compliance-report': {
         'task': 'ethics_app.tasks.generate_monthly_compliance_report',
         'schedule': crontab(day_of_month=1, hour=3, minute=0),  # Monthly
     },
 }
+
+# The analytics snapshot needs numpy, an optional dependency
+if importlib.util.find_spec('numpy'):
+    app.conf.beat_schedule['refresh-consent-snapshot'] = {
+        'task': 'ethics_app.tasks.refresh_consent_snapshot',
+        'schedule': crontab(minute='*/15'),  # Every 15 minutes
+    }
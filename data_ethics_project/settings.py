@@ -40,6 +40,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ethics_app.middleware.RateLimitMiddleware',
+    'ethics_app.middleware.QueryProfilerMiddleware',
+    'ethics_app.middleware.ReplicaMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     'django.middleware.locale.LocaleMiddleware',
@@ -81,6 +84,39 @@ DATABASES = {
     }
 }
 
+# Consent sharding: ConsentRecord rows are spread over these aliases by a hash
+# of the user ID or session key (see ethics_app.sharding). Empty keeps them on
+# default. Locally each shard is its own SQLite file; the count must not change
+# once consents have been written.
+CONSENT_SHARD_COUNT = int(os.environ.get('CONSENT_SHARD_COUNT', 0))
+CONSENT_SHARDS = [f'consent_{i}' for i in range(CONSENT_SHARD_COUNT)]
+for _alias in CONSENT_SHARDS:
+    DATABASES[_alias] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"{_alias}.sqlite3",
+    }
+
+# Read replicas: primary alias -> read-only copy (see ethics_app.replicas).
+# Reports, exports and safe requests read from the copy. READ_REPLICA_DIR gives
+# every database a SQLite replica in that directory, refreshed from its primary
+# every minute by Celery beat, or with `manage.py sync_replica`.
+READ_REPLICA_DIR = os.environ.get('READ_REPLICA_DIR')
+DATABASE_REPLICAS = {}
+if READ_REPLICA_DIR:
+    for _alias in list(DATABASES):
+        DATABASES[f'{_alias}_replica'] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": Path(READ_REPLICA_DIR) / f"{_alias}.sqlite3",
+            "TEST": {"MIRROR": _alias},
+        }
+        DATABASE_REPLICAS[_alias] = f'{_alias}_replica'
+REPLICA_PIN_SECONDS = 120  # longest a client reads from the primary after its own write; shorter once the replicas catch up
+
+DATABASE_ROUTERS = [
+    'ethics_app.sharding.ConsentShardRouter',
+    'ethics_app.replicas.ReplicaRouter',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -120,6 +156,18 @@ LOCALE_PATHS = [
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / 'static']
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic minifies our CSS/JS, hashes every filename and writes .gz/.br
+# variants; ethics_app.assets.serve hands them out with far-future caching.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'ethics_app.assets.CompressedManifestStorage',
+    },
+}
 
 # Crispy Forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
@@ -151,14 +199,77 @@ CSRF_COOKIE_HTTPONLY = True
 # Celery for async tasks
 CELERY_BROKER_URL = 'redis://localhost:6379'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379'
+# Queues and routes are in data_ethics_project/celery.py. Redis orders each
+# queue by priority (0 first); tasks without a route priority sit in the middle.
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority', 'priority_steps': list(range(10))}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # a worker busy with a long task holds no queued ones back
+TASK_IDEMPOTENCY_LEASE = 600  # seconds before an unfinished task's idempotency key may be taken over
 
 # Data Retention Settings
 DATA_RETENTION_DAYS = 365
 CONSENT_EXPIRY_DAYS = 365
+POLICY_CACHE_SECONDS = 60  # how long a process may go on using a superseded policy version
+
+# Request Profiling (opt-in; the middleware is dropped when disabled)
+PROFILER_ENABLED = False
+PROFILER_SAMPLE_RATE = 0.1  # fraction of requests to profile
+PROFILER_TOP_N = 50  # slowest requests kept for /profiler/
+
+# Jurisdiction Resolution (IP ranges CSV, .mmdb or precompiled .idx; None disables)
+GEOIP_RANGES_FILE = None
+GEOIP_CACHE_SIZE = 65536  # distinct client IPs kept in the LRU cache
+
+# Data Subject Request Search (FTS5 on SQLite, tsvector on PostgreSQL; a dotted path overrides)
+REQUEST_SEARCH_BACKEND = None
+REQUEST_SEARCH_CANDIDATES = 1000  # newest matches ranked per search
+REQUEST_SEARCH_ADMIN_LIMIT = 1000  # best matches the admin changelist filters to
+
+# Subject Identity Index (identifier lookups cached per process)
+SUBJECT_CACHE_SIZE = 65536
+SUBJECT_CACHE_SECONDS = 300  # how long a process may miss a merge made by another
+
+# Consent Change Outbox (events relayed downstream; see ethics_app.outbox)
+OUTBOX_SINK = 'ethics_app.outbox.FileSink'  # or RedisStreamSink, WebhookSink, a dotted path of your own
+OUTBOX_SINK_OPTIONS = {'path': BASE_DIR / 'consent_events.jsonl'}
+OUTBOX_BATCH_SIZE = 500  # events per publish
+OUTBOX_RELAY_SECONDS = 30  # longest a relay task runs before the next one takes over
+OUTBOX_RELAY_LEASE = 60  # seconds before a relay lost with its worker stops holding up its shard
+
+# Privacy Policy Changes (see ethics_app.policy_history)
+POLICY_DIFF_CACHE = 'default'  # cache alias for rendered version diffs
+POLICY_DIFF_CACHE_SECONDS = 7 * 24 * 3600  # keys carry the content hashes, so edits never serve stale diffs
+
+# Consent Analytics (columnar snapshot of the consents; see ethics_app.analytics, requires numpy)
+CONSENT_SNAPSHOT_DIR = BASE_DIR / 'analytics'  # published snapshots; rebuilt every 15 minutes by Celery beat
+
+# Data Access Packages (zip files answering access and portability requests; see ethics_app.dsar)
+DSAR_PACKAGE_DIR = BASE_DIR / 'dsar_packages'  # stored by SHA-256, so unchanged data is stored once
+DSAR_PACKAGE_DAYS = 30  # how long a package and its download link last
+DSAR_CHUNK_SIZE = 2000  # rows read per query while a package is written
+DSAR_SENDFILE_HEADER = None  # 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache) hands downloads to the web server
+DSAR_SENDFILE_PREFIX = '/protected/dsar-packages/'  # internal nginx location aliased to DSAR_PACKAGE_DIR
+
+# Worker Warm-up (Celery workers always warm up before forking)
+WARMUP_ON_IMPORT = os.environ.get('WARMUP_ON_IMPORT') == '1'  # warm up when wsgi.py/asgi.py are imported, for gunicorn --preload
+WARMUP_ON_READY = False  # also warm up in AppConfig.ready(), for other entry points
+
+# Rate Limiting (token buckets per client IP and session cookie; {} removes the middleware)
+RATE_LIMITS = {
+    # path: {scope: (requests per second, burst)}
+    '/api/cookie-consent/': {'session': (1, 10), 'ip': (20, 200)},
+}
+NUM_PROXIES = 0  # reverse proxies in front appending to X-Forwarded-For; 0 uses REMOTE_ADDR
+RATE_LIMIT_CACHE = None  # cache alias shared by all workers (e.g. Redis); None limits each process alone
+RATE_LIMIT_WINDOW = 10  # seconds per shared counter
+RATE_LIMIT_MAX_KEYS = 100_000  # clients tracked per process and scope
+RATE_LIMIT_TOP_N = 20  # most throttled clients kept for /rate-limits/
+CONSENT_API_MAX_BODY = 4096  # bytes; larger consent API requests are refused unread
 
 # Email Configuration (for development)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DEFAULT_FROM_EMAIL = 'Data Ethics Portal <noreply@dataethics.local>'
+SITE_URL = 'http://localhost:8000'
 
 # For production, use SMTP:
 # EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
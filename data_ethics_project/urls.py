@@ -1,13 +1,16 @@
+import re
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
+from ethics_app import assets
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('i18n/', include('django.conf.urls.i18n')),
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    # collected assets are served in production too, precompressed and cacheable; see assets.serve
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), assets.serve),
+]
 
 urlpatterns += i18n_patterns(
     path('', include('ethics_app.urls')),
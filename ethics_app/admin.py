@@ -1,3 +1,45 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.db.models import Case, IntegerField, Value, When
 
-# Register your models here.
+from .models import DataSubjectRequest
+from .search import search_requests
+
+# annotation holding each search result's position, best match first
+SEARCH_ORDER = 'search_order'
+
+
+class SearchRankChangeList(ChangeList):
+    """Lists search results best match first, unless a column is sorted on."""
+
+    def get_ordering(self, request, queryset):
+        if SEARCH_ORDER in queryset.query.annotations and ORDER_VAR not in self.params:
+            return self._get_deterministic_ordering([SEARCH_ORDER])
+        return super().get_ordering(request, queryset)
+
+
+@admin.register(DataSubjectRequest)
+class DataSubjectRequestAdmin(admin.ModelAdmin):
+    list_display = ('full_name', 'email', 'request_type', 'status', 'created_at')
+    list_filter = ('status', 'request_type')
+    date_hierarchy = 'created_at'
+    search_fields = ('full_name', 'email', 'description')
+    search_help_text = 'Words match the start of words in the name, email or description'
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return SearchRankChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # the full-text index instead of icontains over every row, keeping
+        # its ranking as the position of each match
+        if not search_term.strip():
+            return queryset, False
+        matches = search_requests(search_term, limit=getattr(settings, 'REQUEST_SEARCH_ADMIN_LIMIT', 1000))
+        if not matches:
+            return queryset.none(), False
+        position = Case(
+            *[When(pk=dsr.pk, then=Value(i)) for i, dsr in enumerate(matches)], output_field=IntegerField()
+        )
+        return queryset.filter(pk__in=[dsr.pk for dsr in matches]).annotate(**{SEARCH_ORDER: position}), False
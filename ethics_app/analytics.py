@@ -0,0 +1,431 @@
+"""
+Consent analytics over a columnar snapshot.
+
+Dashboards slice consent rates by type, day and language, and asking the
+OLTP database for that on every page view means scanning every consent
+shard each time. Instead ``build_snapshot`` copies the consents, from the
+read replicas, into one typed NumPy array per column: creation and expiry
+times (seconds since 1970), consent type and language codes, and the
+granted flag, about 11 bytes a record. Records are sorted by creation time,
+so a date range is a slice found by binary search. The language is that of
+the policy a consent was given under.
+
+Snapshots are written to a fresh directory under ``CONSENT_SNAPSHOT_DIR``
+and published by replacing the ``CURRENT`` pointer file, so readers never
+see one half written. ``current_snapshot`` memory-maps the published
+snapshot: the arrays are paged in from the file cache on demand and shared
+by every worker on the host. It notices a newer snapshot on its next call.
+Celery beat rebuilds the snapshot every 15 minutes (``manage.py
+build_consent_snapshot`` does it by hand), so the figures lag the database
+by that much.
+
+``grant_rates``, ``time_series`` and ``cohort_retention`` compute with
+vectorized operations only. Each one counts the selected range into a small
+histogram over (type, language, granted) and the period, in blocks so that
+temporary arrays stay small. Type and language filters then select from that
+histogram, so they cost nothing extra.
+
+Requires the optional ``numpy`` package.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Case, Func, IntegerField, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import ConsentRecord, PrivacyPolicy
+from .replicas import replica_for, replica_reads
+from .sharding import consents_on, fan_out
+
+# column: dtype
+COLUMNS = {
+    'created': 'uint32',
+    'expires': 'uint32',
+    'type': 'uint8',
+    'language': 'uint8',
+    'given': 'bool',
+}
+TYPES = [code for code, _ in ConsentRecord.CONSENT_TYPES]
+UNKNOWN_LANGUAGE = 'unknown'
+DAY = 86400
+BLOCK_ROWS = 1 << 22
+POINTER = 'CURRENT'
+
+
+class SnapshotUnavailable(Exception):
+    """No snapshot has been built yet, or NumPy is not installed."""
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('Consent analytics requires the numpy package')
+    return numpy
+
+
+def snapshot_dir():
+    return Path(getattr(settings, 'CONSENT_SNAPSHOT_DIR', Path(settings.BASE_DIR) / 'analytics'))
+
+
+def languages():
+    """Language labels by code; the last is for consents without a policy."""
+    return [code for code, _ in settings.LANGUAGES] + [UNKNOWN_LANGUAGE]
+
+
+class Epoch(Func):
+    """Whole seconds since 1970 of a UTC datetime column, computed in the database."""
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400) AS INTEGER)',
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='EXTRACT(EPOCH FROM %(expressions)s)::bigint', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def _shard_rows(alias, batch_size):
+    """A shard's consents as (created, expires, type, policy, given) int64 arrays of up to ``batch_size`` rows."""
+    np = _numpy()
+    rows = (
+        consents_on(replica_for(alias))
+        .order_by()
+        .values_list(
+            Epoch('timestamp'),
+            Epoch('expiry_date'),
+            Case(*[When(consent_type=code, then=Value(n)) for n, code in enumerate(TYPES)],
+                 default=Value(len(TYPES)), output_field=IntegerField()),
+            Coalesce('policy_id', -1),
+            'consent_given',
+        )
+        .iterator(chunk_size=batch_size)
+    )
+    batches, batch = [], []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            batches.append(np.array(batch, dtype=np.int64))
+            batch = []
+    if batch:
+        batches.append(np.array(batch, dtype=np.int64))
+    return batches
+
+
+def build_columns(batch_size=50_000):
+    """Read every shard (from its replica) into the snapshot columns, sorted by creation time."""
+    np = _numpy()
+    labels = languages()
+    policies = dict(PrivacyPolicy.objects.using(replica_for('default')).values_list('pk', 'language'))
+    # policy ID + 1 -> language code; index 0 is "no policy"
+    language_of = np.full(max(policies, default=0) + 2, len(labels) - 1, dtype=np.uint8)
+    for pk, language in policies.items():
+        if language in labels:
+            language_of[pk + 1] = labels.index(language)
+
+    with replica_reads():
+        batches = [b for shard in fan_out(lambda alias: _shard_rows(alias, batch_size)) for b in shard]
+    rows = np.concatenate(batches) if batches else np.empty((0, 5), dtype=np.int64)
+    order = np.argsort(rows[:, 0], kind='stable')
+    rows = rows[order]
+    policy = rows[:, 3] + 1
+    return {
+        'created': rows[:, 0].astype(np.uint32),
+        'expires': np.clip(rows[:, 1], 0, np.iinfo(np.uint32).max).astype(np.uint32),
+        'type': rows[:, 2].astype(np.uint8),
+        'language': np.where(policy < len(language_of), language_of[np.clip(policy, 0, len(language_of) - 1)],
+                             len(labels) - 1).astype(np.uint8),
+        'given': rows[:, 4].astype(bool),
+    }
+
+
+def write_snapshot(columns, directory=None, keep=2):
+    """
+    Write ``columns`` as a new snapshot under ``directory`` and publish it.
+    Older snapshots beyond the ``keep`` most recent are removed; processes
+    that still map one keep reading it until they move on.
+    """
+    np = _numpy()
+    directory = Path(directory or snapshot_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    rows = len(columns['created'])
+    name = f'snapshot-{time.time_ns()}'
+    staging = directory / f'.{name}'
+    staging.mkdir()
+    for column, dtype in COLUMNS.items():
+        np.save(staging / f'{column}.npy', np.ascontiguousarray(columns[column], dtype=dtype))
+    with open(staging / 'meta.json', 'w') as f:
+        json.dump({
+            'built_at': int(time.time()),
+            'rows': rows,
+            'types': TYPES,
+            'languages': languages(),
+        }, f)
+    os.rename(staging, directory / name)
+
+    pointer = directory / f'.{POINTER}.tmp'
+    pointer.write_text(name)
+    os.replace(pointer, directory / POINTER)
+
+    snapshots = sorted(p for p in directory.glob('snapshot-*') if p.is_dir())
+    for old in snapshots[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+    return directory / name
+
+
+def build_snapshot(directory=None, batch_size=50_000):
+    """Build a snapshot from the database and publish it. Returns ``(path, rows)``."""
+    columns = build_columns(batch_size)
+    return write_snapshot(columns, directory), len(columns['created'])
+
+
+def synthetic_columns(rows, days=365, seed=0, now=None):
+    """``rows`` random consents over the last ``days`` days, for sizing and benchmarks."""
+    np = _numpy()
+    rng = np.random.default_rng(seed)
+    now = int(now or time.time())
+    created = np.sort(rng.integers(now - days * DAY, now, rows, dtype=np.uint32))
+    lifetime = rng.choice(np.array([30, 180, 365], dtype=np.uint32) * DAY, rows, p=[0.2, 0.3, 0.5])
+    return {
+        'created': created,
+        'expires': created + lifetime,
+        'type': rng.choice(len(TYPES), rows, p=[0.4, 0.25, 0.2, 0.15]).astype(np.uint8),
+        'language': rng.choice(len(languages()), rows).astype(np.uint8),
+        'given': rng.random(rows, dtype=np.float32) < 0.6,
+    }
+
+
+class Snapshot:
+    """A published snapshot, memory-mapped read-only."""
+
+    def __init__(self, path):
+        np = _numpy()
+        self.path = Path(path)
+        with open(self.path / 'meta.json') as f:
+            self.meta = json.load(f)
+        self.columns = {name: np.load(self.path / f'{name}.npy', mmap_mode='r') for name in COLUMNS}
+        self.types = self.meta['types']
+        self.languages = self.meta['languages']
+
+    def __len__(self):
+        return self.meta['rows']
+
+    @property
+    def built_at(self):
+        return datetime.fromtimestamp(self.meta['built_at'], dt_timezone.utc)
+
+    def bounds(self, start=None, end=None):
+        """Rows created from ``start`` (inclusive) to ``end`` (exclusive) dates, as a slice."""
+        created = self.columns['created']
+        lo = int(created.searchsorted(_epoch(start), 'left')) if start else 0
+        hi = int(created.searchsorted(_epoch(end), 'left')) if end else len(created)
+        return lo, max(lo, hi)
+
+    def first_day(self, lo=0):
+        return _day(int(self.columns['created'][lo])) if len(self) > lo else None
+
+
+_lock = threading.Lock()
+_current = (None, None)  # (pointer contents, Snapshot)
+
+
+def current_snapshot(directory=None):
+    """
+    The latest published snapshot, loaded once per process and reloaded
+    after a newer one is published.
+    """
+    global _current
+    directory = Path(directory or snapshot_dir())
+    try:
+        name = (directory / POINTER).read_text().strip()
+    except FileNotFoundError:
+        raise SnapshotUnavailable(f'No consent snapshot in {directory}; run manage.py build_consent_snapshot')
+    with _lock:
+        loaded_name, snapshot = _current
+        if loaded_name != (directory, name):
+            snapshot = Snapshot(directory / name)
+            _current = ((directory, name), snapshot)
+        return snapshot
+
+
+def _epoch(day):
+    return int(datetime.combine(day, datetime.min.time(), dt_timezone.utc).timestamp())
+
+
+def _day(epoch):
+    return date(1970, 1, 1) + timedelta(days=epoch // DAY)
+
+
+def _codes(labels, wanted):
+    if not wanted:
+        return list(range(len(labels)))
+    unknown = set(wanted) - set(labels)
+    if unknown:
+        raise ValueError(f"Unknown value(s): {', '.join(sorted(unknown))}")
+    return [labels.index(value) for value in wanted]
+
+
+def _histogram(snapshot, lo, hi, period_of=None, periods=1, extra=None, extra_size=1):
+    """
+    Count rows ``lo:hi`` by (period, extra, type, language, granted).
+    ``period_of(created)`` maps a block's creation times to uint32 period
+    indexes below ``periods``; ``extra(columns, block, period)`` optionally
+    gives each row of the block a further uint32 index below ``extra_size``.
+    The per-row arithmetic stays in the narrowest unsigned type that holds
+    it, which is most of the cost.
+    """
+    np = _numpy()
+    nt, nl = len(snapshot.types) + 1, len(snapshot.languages)
+    cells = nt * nl * 2
+    shape = (periods, extra_size, nt, nl, 2)
+    counts = np.zeros(periods * extra_size * cells, dtype=np.int64)
+    columns = snapshot.columns
+    for offset in range(lo, hi, BLOCK_ROWS):
+        block = slice(offset, min(offset + BLOCK_ROWS, hi))
+        cell = np.minimum(columns['type'][block], nt - 1).astype(np.min_scalar_type(cells))
+        cell *= nl
+        cell += columns['language'][block]
+        cell *= 2
+        cell += columns['given'][block]
+        key = cell
+        if period_of is not None:
+            period = period_of(columns['created'][block])
+            key = period * np.uint32(extra_size)
+            if extra is not None:
+                key += extra(columns, block, period)
+            key *= np.uint32(cells)
+            key += cell
+        counts += np.bincount(key, minlength=counts.size)
+    return counts.reshape(shape)
+
+
+def _select(counts, snapshot, types, langs, by):
+    """Keep the wanted types and languages and sum away the axes not in ``by``."""
+    counts = counts[:, :, _codes(snapshot.types, types)][:, :, :, _codes(snapshot.languages, langs)]
+    if 'type' not in by:
+        counts = counts.sum(axis=2, keepdims=True)
+    if 'language' not in by:
+        counts = counts.sum(axis=3, keepdims=True)
+    return counts
+
+
+def _labels(snapshot, types, langs, by):
+    type_labels = (types or snapshot.types) if 'type' in by else [None]
+    language_labels = (langs or snapshot.languages) if 'language' in by else [None]
+    return type_labels, language_labels
+
+
+def _rate_rows(counts, type_labels, language_labels, by, **fields):
+    rows = []
+    for t, type_label in enumerate(type_labels):
+        for l, language_label in enumerate(language_labels):
+            denied, granted = (int(n) for n in counts[t, l])
+            total = denied + granted
+            if not total:
+                continue
+            row = dict(fields)
+            if 'type' in by:
+                row['type'] = type_label
+            if 'language' in by:
+                row['language'] = language_label
+            row.update(total=total, granted=granted, rate=round(granted / total, 4))
+            rows.append(row)
+    return rows
+
+
+def grant_rates(snapshot, start=None, end=None, types=None, langs=None, by=('type', 'language')):
+    """Consents and the share granted, per type and/or language."""
+    lo, hi = snapshot.bounds(start, end)
+    counts = _select(_histogram(snapshot, lo, hi), snapshot, types, langs, by)[0, 0]
+    return _rate_rows(counts, *_labels(snapshot, types, langs, by), by)
+
+
+def time_series(snapshot, start=None, end=None, types=None, langs=None, by=('type',), days=1):
+    """Consents and the share granted per period of ``days`` days, per type and/or language."""
+    np = _numpy()
+    lo, hi = snapshot.bounds(start, end)
+    first = start or snapshot.first_day(lo)
+    if first is None or lo == hi:
+        return []
+    origin = _epoch(first)
+    last = _day(int(snapshot.columns['created'][hi - 1]))
+    periods = (last - first).days // days + 1
+    counts = _histogram(snapshot, lo, hi, lambda created: (created - np.uint32(origin)) // np.uint32(days * DAY), periods)
+    counts = _select(counts, snapshot, types, langs, by)[:, 0]
+    type_labels, language_labels = _labels(snapshot, types, langs, by)
+    rows = []
+    for period in range(periods):
+        day = (first + timedelta(days=period * days)).isoformat()
+        rows.extend(_rate_rows(counts[period], type_labels, language_labels, by, day=day))
+    return rows
+
+
+def cohort_retention(snapshot, start=None, end=None, types=None, langs=None, days=7, ages=12):
+    """
+    Consents grouped into cohorts of ``days`` days by creation, and for each
+    cohort the share still granted and unexpired at the end of each of the
+    following ``ages`` periods that have ended. The snapshot holds each
+    consent's current state only, so a withdrawn consent counts as lost from
+    the start.
+    """
+    np = _numpy()
+    lo, hi = snapshot.bounds(start, end)
+    first = start or snapshot.first_day(lo)
+    if first is None or lo == hi:
+        return []
+    origin = _epoch(first)
+    period = days * DAY
+    last = _day(int(snapshot.columns['created'][hi - 1]))
+    cohorts = (last - first).days // days + 1
+
+    def lasted(columns, block, cohort):
+        # whole periods from the cohort's start until expiry: 0 means lost in
+        # the first period, ages + 1 still there after the last one reported
+        cohort_start = cohort * np.uint32(period) + np.uint32(origin)
+        held = np.maximum(columns['expires'][block], cohort_start)
+        held -= cohort_start
+        held //= np.uint32(period)
+        np.minimum(held, ages + 1, out=held)
+        held *= columns['given'][block]
+        return held
+
+    counts = _histogram(
+        snapshot, lo, hi, lambda created: (created - np.uint32(origin)) // np.uint32(period), cohorts,
+        extra=lasted, extra_size=ages + 2,
+    )
+    counts = _select(counts, snapshot, types, langs, by=()).sum(axis=(2, 3, 4))
+    # still held at the end of age k: lasted more than k periods
+    held = counts[:, ::-1].cumsum(axis=1)[:, ::-1]
+    now = snapshot.meta['built_at']
+    rows = []
+    for cohort in range(cohorts):
+        size = int(counts[cohort].sum())
+        if not size:
+            continue
+        cohort_start = origin + cohort * period
+        ended = min(ages, max(0, (now - cohort_start) // period))
+        rows.append({
+            'cohort': (first + timedelta(days=cohort * days)).isoformat(),
+            'size': size,
+            'retention': [round(int(held[cohort, age + 1]) / size, 4) for age in range(ended)],
+        })
+    return rows
+
+
+METRICS = {
+    'rates': grant_rates,
+    'series': time_series,
+    'cohorts': cohort_retention,
+}
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EthicsAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ethics_app"
+
+    def ready(self):
+        # register the signal handlers that keep the current policy cache
+        # fresh, stand in for the consent foreign keys' on_delete, keep the
+        # subject identity index current and repack policy version chains
+        from . import identity, policies, policy_history, sharding  # noqa: F401
+
+        if getattr(settings, 'WARMUP_ON_READY', False):
+            from .warmup import prefork
+            prefork()
@@ -0,0 +1,147 @@
+"""
+Static asset pipeline.
+
+``CompressedManifestStorage`` extends Django's manifest storage so that
+``collectstatic`` minifies our own CSS and JavaScript, writes content-hashed
+copies of every file and stores gzip and brotli variants next to them.
+``serve`` hands those files out with the best encoding the client accepts and
+far-future cache headers for hashed names, so a deployment without a
+dedicated static file server still gets cacheable, precompressed assets.
+"""
+import gzip
+import mimetypes
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.ttf', '.otf', '.eot'}
+
+# ManifestStaticFilesStorage inserts a 12 character MD5 prefix before the extension
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+LONG_CACHE = 'public, max-age=31536000, immutable'
+SHORT_CACHE = 'public, max-age=300'
+
+
+def minify(name, content):
+    """Minify CSS/JS source unless it already is (``*.min.*``) or no minifier is installed."""
+    if '.min.' in posixpath.basename(name):
+        return content
+    if name.endswith('.css') and rcssmin is not None:
+        return rcssmin.cssmin(content, keep_bang_comments=True)
+    if name.endswith('.js') and rjsmin is not None:
+        return rjsmin.jsmin(content, keep_bang_comments=True)
+    return content
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """Manifest storage that minifies on collect and precompresses on post-process."""
+
+    def _save(self, name, content):
+        if name.endswith(('.css', '.js')):
+            # hashing may have left the file positioned at its end
+            content.seek(0)
+            original = content.read()
+            minified = minify(name, original.decode('utf-8')).encode('utf-8')
+            if minified != original:
+                content = ContentFile(minified)
+            else:
+                content.seek(0)
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(self.hashed_files) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if posixpath.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS and self.exists(name):
+                self._compress(name)
+
+    def _compress(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data, quality=11)))
+        for suffix, compressed in variants:
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            # only worth serving when it actually saves bytes
+            if len(compressed) < len(data) * 0.95:
+                self._save(name + suffix, ContentFile(compressed))
+
+    def stored_name(self, name):
+        # Before collectstatic has written a manifest (development, tests),
+        # fall back to the plain name instead of failing on every {% static %}.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+def _accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def serve(request, path):
+    """Serve a collected file from STATIC_ROOT, preferring a precompressed variant."""
+    if not settings.STATIC_ROOT:
+        raise Http404('STATIC_ROOT is not configured')
+    path = posixpath.normpath(path).lstrip('/')
+    fullpath = Path(safe_join(settings.STATIC_ROOT, path))
+    if not fullpath.is_file():
+        raise Http404(f'"{path}" does not exist')
+
+    statobj = fullpath.stat()
+    cache_control = LONG_CACHE if HASHED_NAME.search(path) else SHORT_CACHE
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), statobj.st_mtime):
+        response = HttpResponseNotModified()
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    content_type = mimetypes.guess_type(str(fullpath))[0] or 'application/octet-stream'
+    accepted = _accepted_encodings(request)
+    encoding = None
+    for coding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        variant = fullpath.with_name(fullpath.name + suffix)
+        if coding in accepted and variant.is_file():
+            fullpath, encoding = variant, coding
+            break
+
+    response = FileResponse(fullpath.open('rb'), content_type=content_type)
+    response.headers['Last-Modified'] = http_date(statobj.st_mtime)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,554 @@
+"""
+Benchmark harness for the ethics_app hot paths.
+
+The seeding module fills a scratch database at a fixed scale, each benchmark
+case times one hot path, and results are emitted in the same JSON layout
+as pytest-benchmark so runs can be compared against a stored baseline.
+"""
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager, redirect_stdout
+from datetime import timedelta
+
+import django
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+from celery.signals import task_prerun
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core import mail
+from django.core.management import call_command
+from django.db import connections
+from django.test import Client, RequestFactory, override_settings
+from django.utils import timezone
+
+from . import analytics, dsar, identity, outbox, policy_history
+from .middleware import ConsentMiddleware
+from .models import ConsentRecord, DataSubjectRequest, OutboxEvent, PrivacyPolicy
+from .replicas import replica_reads, replicas, sync_replicas
+from .reporting import PrivacyReport
+from .search import search_requests
+from .seeding import Seeder, user_email
+from .sharding import bulk_create_consents, consents_on, fan_out, shard_aliases
+from .tasks import generate_monthly_compliance_report, process_data_subject_request
+
+SCALES = {
+    '10k': 10_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+CONSENT_TYPES = ['functional', 'analytics', 'marketing']
+BENCH_EMAIL = 'bench-user@example.com'
+
+
+@contextmanager
+def scratch_database(db_file=None, keepdb=False):
+    """
+    Run against a throwaway test database with production-like settings:
+    no debug cursor, no template instrumentation, outgoing mail kept in
+    memory and data packages in a temporary directory. Consent shards and read replicas get a scratch database
+    each, next to ``db_file`` when one is given; replicas are separate
+    copies rather than test mirrors, so that reading them takes no locks on
+    the primary.
+    """
+    aliases = list(dict.fromkeys(['default', *shard_aliases(), *replicas().values()]))
+    old_names = {}
+    for alias in aliases:
+        connection = connections[alias]
+        connection.settings_dict['TEST']['MIRROR'] = None
+        if db_file:
+            root, ext = os.path.splitext(db_file)
+            connection.settings_dict['TEST']['NAME'] = db_file if alias == 'default' else f'{root}_{alias}{ext}'
+        old_names[alias] = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb
+        )
+    try:
+        with tempfile.TemporaryDirectory() as packages, override_settings(
+            DEBUG=False,
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'],
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            PROFILER_ENABLED=False,
+            DSAR_PACKAGE_DIR=packages,
+        ):
+            yield
+    finally:
+        for alias, old_name in old_names.items():
+            connections[alias].creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def seed_dataset(rows, seed=0, stdout=None):
+    """
+    Seed ``rows`` consent records with proportional users, sessions, requests
+    and breaches, plus two privacy policy versions per language, the second
+    one active.
+    """
+    clauses = [f'<p>Clause {n}. ' + 'Synthetic privacy policy. ' * 10 + '</p>\n' for n in range(20)]
+    earlier = clauses[:11] + clauses[12:]
+    earlier[3] = earlier[3].replace('Synthetic privacy', 'Earlier privacy', 4)
+    for code, _ in settings.LANGUAGES:
+        PrivacyPolicy.objects.create(
+            version='0.9',
+            language=code,
+            content=''.join(earlier),
+            effective_date=timezone.now() - timedelta(days=180),
+        )
+        PrivacyPolicy.objects.create(
+            version='1.0',
+            language=code,
+            content=''.join(clauses),
+            effective_date=timezone.now(),
+            is_active=True,
+        )
+    # the policies first, so consents are seeded under the active versions
+    seeder = Seeder(seed=seed, fast=True, stdout=stdout)
+    counts = seeder.run(rows)
+
+    first_ids = fan_out(lambda alias: consents_on(alias).filter(user__isnull=False).order_by('user_id').values_list(
+        'user_id', flat=True
+    ).first())
+    bench_user = User.objects.get(pk=min(pk for pk in first_ids if pk is not None))
+    bench_user.email = BENCH_EMAIL
+    bench_user.save(update_fields=['email'])
+    return counts
+
+
+def _expired_consents(count, rng):
+    expired = timezone.now() - timedelta(days=1)
+    for _ in range(count):
+        yield ConsentRecord(
+            session_key='%032x' % rng.getrandbits(128),
+            ip_address='10.0.0.1',
+            consent_type=rng.choice(CONSENT_TYPES),
+            consent_given=True,
+            expiry_date=expired,
+        )
+
+
+class Benchmark:
+    """One timed hot path. ``setup`` runs untimed before every round."""
+
+    def __init__(self, name, group, func, setup=None, iterations=1, teardown=None):
+        self.name = name
+        self.group = group
+        self.func = func
+        self.setup = setup
+        self.teardown = teardown
+        self.iterations = iterations
+
+    def run(self, rounds):
+        timings = []
+        for _ in range(rounds):
+            if self.setup is not None:
+                self.setup()
+            try:
+                start = time.perf_counter()
+                for _ in range(self.iterations):
+                    self.func()
+                timings.append((time.perf_counter() - start) / self.iterations)
+            finally:
+                if self.teardown is not None:
+                    self.teardown()
+        return timings
+
+
+class BackgroundReport:
+    """
+    Recompute the 365-day privacy report in a forked process until stopped,
+    reading from the replicas when they are configured, to time writes
+    against a long-running report. Needs file-backed scratch databases.
+    """
+
+    def __init__(self):
+        context = multiprocessing.get_context('fork')
+        self._context = context
+        self._stop = context.Event()
+        self._process = None
+
+    def start(self):
+        self._stop.clear()
+        connections.close_all()
+        self._process = self._context.Process(target=self._run, daemon=True)
+        self._process.start()
+
+    def stop(self):
+        self._stop.set()
+        self._process.join()
+
+    def _run(self):
+        end = timezone.now()
+        with replica_reads():
+            while not self._stop.is_set():
+                report = PrivacyReport(end - timedelta(days=365), end)
+                report.summaries()
+                for _, rows in report.series():
+                    for _ in rows:
+                        if self._stop.is_set():
+                            return
+
+
+@contextmanager
+def memory_broker():
+    """
+    Make current a Celery app with the project's queues and routes on the
+    in-memory broker, so that task benchmarks need no Redis.
+    """
+    from data_ethics_project.celery import app as project_app
+
+    app = Celery('benchmarks', set_as_current=False)
+    app.conf.update(
+        broker_url='memory://',
+        broker_transport_options={'polling_interval': 0.005},
+        result_backend='cache+memory://',
+        task_queues=project_app.conf.task_queues,
+        task_default_queue=project_app.conf.task_default_queue,
+        task_routes=project_app.conf.task_routes,
+        worker_prefetch_multiplier=1,
+    )
+    app.set_current()
+    try:
+        yield app
+    finally:
+        project_app.set_current()
+        project_app.set_default()
+
+
+# task ID -> event set when a worker starts that task
+_task_started = {}
+
+
+@task_prerun.connect
+def _on_task_prerun(task_id=None, **kwargs):
+    event = _task_started.get(task_id)
+    if event is not None:
+        event.set()
+
+
+class TaskWorkers:
+    """
+    Celery workers in threads on the in-memory broker, one per group of
+    queues. With ``queue`` set, every task is sent there instead of along its
+    route, as it was when all tasks shared one queue.
+    """
+
+    def __init__(self, *queue_groups, queue=None):
+        self.queue_groups = queue_groups
+        self.queue = queue
+        self._stack = None
+
+    def start(self):
+        self._stack = ExitStack()
+        self.app = self._stack.enter_context(memory_broker())
+        # report tasks print to stdout
+        self._stack.enter_context(redirect_stdout(io.StringIO()))
+        for queues in self.queue_groups:
+            self._stack.enter_context(start_worker(
+                self.app, queues=queues, perform_ping_check=False, shutdown_timeout=60,
+            ))
+
+    def stop(self):
+        self.app.control.purge()
+        self._stack.close()
+
+    def send(self, task, *args, **options):
+        if self.queue:
+            options['queue'] = self.queue
+        return task.apply_async(args, **options)
+
+    def wait_for_start(self, task, *args, timeout=60):
+        """Send ``task`` and block until a worker starts it."""
+        task_id = str(uuid.uuid4())
+        event = _task_started[task_id] = threading.Event()
+        try:
+            self.send(task, *args, task_id=task_id)
+            if not event.wait(timeout):
+                raise RuntimeError(f'{task.name} did not start within {timeout}s')
+        finally:
+            del _task_started[task_id]
+
+
+def _session_client():
+    client = Client()
+    client.session  # creates and stores a session cookie
+    return client
+
+
+def _consent_request(session_key=None, user=None):
+    request = RequestFactory().get('/')
+    request.session = SessionStore(session_key)
+    request.user = user or AnonymousUser()
+    return request
+
+
+def _anonymous_session_key():
+    for alias in shard_aliases():
+        session_key = consents_on(alias).filter(
+            session_key__isnull=False, consent_type='functional'
+        ).values_list('session_key', flat=True).first()
+        if session_key is not None:
+            return session_key
+
+
+def build_benchmarks(rows):
+    """
+    Return the benchmark cases, bound to a database seeded with ``rows``.
+    Read replicas are refreshed from it first.
+    """
+    sync_replicas()
+    middleware = ConsentMiddleware(lambda request: None)
+    anonymous_request = _consent_request(session_key=_anonymous_session_key())
+    user_request = _consent_request(user=identity.resolve(email=BENCH_EMAIL).user)
+    consent_client = _session_client()
+    api_client = _session_client()
+    page_client = Client()
+    expired_batch = max(rows // 100, 1)
+    requester_email = user_email(User.objects.order_by('-pk').values_list('pk', flat=True)[0])
+    rng = random.Random(1)
+
+    def post_consent():
+        consent_client.post('/consent/', {
+            'functional_cookies': 'on',
+            'analytics_cookies': rng.choice(['on', '']),
+        })
+
+    def post_consent_api():
+        api_client.post(
+            '/api/cookie-consent/',
+            data=json.dumps({'type': rng.choice(CONSENT_TYPES), 'consent': True}),
+            content_type='application/json',
+        )
+
+    def seed_expired():
+        bulk_create_consents(_expired_consents(expired_batch, rng), 10_000)
+
+    def reset_outbox():
+        mail.outbox = []
+
+    def search(backend=None):
+        """Look up a requester's earlier requests by email, through ``backend`` if given."""
+        def run():
+            with override_settings(REQUEST_SEARCH_BACKEND=backend):
+                search_requests(requester_email)
+        return run
+
+    def outbox_relay(events=10_000):
+        """Relay ``events`` consent changes from the shards' outboxes into a JSON lines file."""
+        directory = tempfile.TemporaryDirectory()
+        sink = outbox.FileSink(os.path.join(directory.name, 'events.jsonl'))
+
+        def setup():
+            for n, alias in enumerate(shard_aliases()):
+                OutboxEvent.objects.using(alias).bulk_create([
+                    OutboxEvent(subject=f'user:{i}', consent_type=rng.choice(CONSENT_TYPES),
+                                consent_given=rng.random() < 0.6, policy_id=1)
+                    for i in range(n, events, len(shard_aliases()))
+                ], batch_size=5000)
+
+        def relay():
+            for alias in shard_aliases():
+                outbox.relay(alias, sink)
+
+        def teardown():
+            # also keeps the directory alive as long as the case
+            open(os.path.join(directory.name, 'events.jsonl'), 'w').close()
+
+        return {'func': relay, 'setup': setup, 'teardown': teardown}
+
+    def consent_analytics():
+        """Build the columnar consent snapshot, then slice it as the analytics API does."""
+        directory = tempfile.TemporaryDirectory()
+
+        def build():
+            analytics.build_snapshot(directory.name)
+
+        def built():
+            if not os.path.exists(os.path.join(directory.name, analytics.POINTER)):
+                build()
+
+        def query(metric, **options):
+            return {
+                'func': lambda: analytics.METRICS[metric](analytics.current_snapshot(directory.name), **options),
+                'setup': built,
+                'iterations': 20,
+            }
+
+        return [
+            Benchmark('consent_snapshot_build', 'analytics', build),
+            Benchmark('consent_analytics_rates', 'analytics', **query('rates')),
+            Benchmark('consent_analytics_series', 'analytics', **query('series', by=['type', 'language'])),
+            Benchmark('consent_analytics_cohorts', 'analytics', **query('cohorts')),
+        ]
+
+    def clear_policy_texts():
+        policy_history._rebuilt.cache_clear()
+
+    def policy_diff():
+        """Rebuild the earlier English version from its delta and compare it with the current one."""
+        old, new, _ = policy_history.pair('en')
+        policy_history.compare(old.content, new.content)
+
+    def data_package():
+        """Build the bench user's access package, then download it through its signed link."""
+        packages = []
+
+        def build():
+            request = DataSubjectRequest.objects.create(
+                request_type='access', email=BENCH_EMAIL, full_name='Bench User', description='Benchmark',
+            )
+            packages.append(dsar.build(request))
+
+        def built():
+            if not packages:
+                build()
+
+        def download():
+            url = dsar.download_url(packages[-1]).removeprefix(settings.SITE_URL.rstrip('/'))
+            response = page_client.get(url)
+            b''.join(response.streaming_content)
+            response.close()
+
+        return [
+            Benchmark('dsar_package_build', 'dsar', build, iterations=5),
+            Benchmark('dsar_package_download', 'dsar', download, setup=built, iterations=20),
+        ]
+
+    def command(name, *args):
+        return lambda: call_command(name, *args, stdout=io.StringIO())
+
+    def task_wait_during_bulk(workers, backlog=20):
+        """Time from queueing a data subject request until a worker starts it, behind a bulk backlog."""
+        requests = []
+
+        def setup():
+            workers.start()
+            for _ in range(backlog):
+                workers.send(generate_monthly_compliance_report)
+            # not an access request: this times the queue, dsar_package_build times the package
+            requests.append(DataSubjectRequest.objects.create(
+                request_type='rectification', email=BENCH_EMAIL, full_name='Bench User', description='Benchmark',
+            ))
+
+        def wait():
+            workers.wait_for_start(process_data_subject_request, str(requests.pop().pk))
+
+        return {'func': wait, 'setup': setup, 'teardown': workers.stop}
+
+    cases = [
+        Benchmark('consent_check_anonymous', 'middleware',
+                  lambda: middleware.process_request(anonymous_request), iterations=200),
+        Benchmark('consent_check_authenticated', 'middleware',
+                  lambda: middleware.process_request(user_request), iterations=200),
+        Benchmark('consent_form_post', 'consent', post_consent, iterations=20),
+        Benchmark('cookie_consent_api', 'consent', post_consent_api, iterations=50),
+        Benchmark('privacy_policy_render', 'pages',
+                  lambda: page_client.get('/privacy-policy/'), iterations=20),
+        Benchmark('policy_changes_render', 'pages',
+                  lambda: page_client.get('/privacy-policy/changes/'), iterations=20),
+        Benchmark('policy_diff_uncached', 'pages', policy_diff, setup=clear_policy_texts),
+        Benchmark('generate_privacy_report', 'commands',
+                  command('generate_privacy_report', '--format=json')),
+        Benchmark('clean_expired_data', 'commands',
+                  command('clean_expired_data'), setup=seed_expired),
+        Benchmark('export_user_data', 'commands',
+                  command('export_user_data', BENCH_EMAIL)),
+        Benchmark('notify_consent_expiry', 'commands',
+                  command('notify_consent_expiry'), setup=reset_outbox),
+        Benchmark('request_search', 'search', search(), iterations=50),
+        Benchmark('request_search_scan', 'search', search('ethics_app.search.ScanBackend'), iterations=5),
+        Benchmark('outbox_relay_10k', 'outbox', **outbox_relay()),
+        Benchmark('dsr_task_wait_during_bulk', 'tasks',
+                  **task_wait_during_bulk(TaskWorkers(['interactive'], ['bulk']))),
+        Benchmark('dsr_task_wait_during_bulk_one_queue', 'tasks',
+                  **task_wait_during_bulk(TaskWorkers(['celery'], queue='celery'))),
+        *data_package(),
+    ]
+    if importlib.util.find_spec('numpy'):
+        cases.extend(consent_analytics())
+    if not connections['default'].is_in_memory_db():
+        background_report = BackgroundReport()
+        cases.append(Benchmark('cookie_consent_api_during_report', 'consent', post_consent_api, iterations=50,
+                               setup=background_report.start, teardown=background_report.stop))
+    return cases
+
+
+def compute_stats(timings, iterations):
+    ordered = sorted(timings)
+    quartiles = statistics.quantiles(ordered, n=4) if len(ordered) > 1 else [ordered[0]] * 3
+    mean = statistics.fmean(ordered)
+    return {
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': mean,
+        'stddev': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'median': statistics.median(ordered),
+        'iqr': quartiles[2] - quartiles[0],
+        'q1': quartiles[0],
+        'q3': quartiles[2],
+        'rounds': len(ordered),
+        'iterations': iterations,
+        'ops': 1 / mean if mean else 0.0,
+        'total': sum(ordered) * iterations,
+        'data': timings,
+    }
+
+
+def machine_info():
+    return {
+        'node': platform.node(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python_implementation': platform.python_implementation(),
+        'python_version': platform.python_version(),
+        'system': platform.system(),
+        'release': platform.release(),
+        'django_version': django.get_version(),
+        'database': settings.DATABASES['default']['ENGINE'],
+    }
+
+
+def run_benchmarks(benchmarks, rounds, extra_info=None):
+    """Run every case and return a pytest-benchmark compatible report."""
+    results = []
+    for benchmark in benchmarks:
+        timings = benchmark.run(rounds)
+        results.append({
+            'group': benchmark.group,
+            'name': benchmark.name,
+            'fullname': f'ethics_app::{benchmark.group}::{benchmark.name}',
+            'params': None,
+            'stats': compute_stats(timings, benchmark.iterations),
+            'extra_info': extra_info or {},
+        })
+    return {
+        'machine_info': machine_info(),
+        'commit_info': {},
+        'benchmarks': results,
+        'datetime': timezone.now().isoformat(),
+        'version': '4.0.0',
+    }
+
+
+def compare_to_baseline(report, baseline, threshold):
+    """
+    Yield ``(name, baseline_mean, current_mean, change_pct, regressed)`` for
+    every benchmark present in both reports.
+    """
+    previous = {bench['name']: bench['stats']['mean'] for bench in baseline['benchmarks']}
+    for bench in report['benchmarks']:
+        if bench['name'] not in previous:
+            continue
+        old = previous[bench['name']]
+        new = bench['stats']['mean']
+        change = (new - old) / old * 100 if old else 0.0
+        yield bench['name'], old, new, change, change > threshold
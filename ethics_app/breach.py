@@ -0,0 +1,294 @@
+"""
+Breach notification engine.
+
+Affected subjects are resolved from a user query or an uploaded list and
+stored as ``BreachSubject`` rows in batches, so the set can run to millions
+without being held in memory. Notification messages are rendered once per
+language and personalised by string substitution. Pending subjects are split
+into ID-range chunks that Celery workers (or the ``notify_breach`` command)
+send over one mail connection per chunk, checkpointing ``notified_at`` as
+they go so a retried or redelivered chunk only sends what is left.
+"""
+import csv
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.template.loader import select_template
+from django.utils import timezone, translation
+
+from .models import BreachSubject, DataBreach
+from .sharding import consents_on, shard_for
+
+# GDPR Art. 33: notify within 72 hours of becoming aware of the breach
+NOTIFICATION_DEADLINE = timedelta(hours=72)
+
+LANGUAGE_BY_COUNTRY = {
+    **dict.fromkeys(['FR', 'BE', 'LU', 'MC', 'SN', 'CI', 'CM', 'ML', 'BF', 'NE', 'MG', 'HT'], 'fr'),
+    **dict.fromkeys(['TR', 'CY'], 'tr'),
+    **dict.fromkeys([
+        'AE', 'BH', 'DZ', 'EG', 'IQ', 'JO', 'KW', 'LB', 'LY', 'MA', 'OM', 'PS', 'QA',
+        'SA', 'SD', 'SY', 'TN', 'YE',
+    ], 'ar'),
+}
+
+# Stands in for the recipient's name while a language's message is rendered
+NAME_PLACEHOLDER = '\x00name\x00'
+
+
+def _languages():
+    return {code for code, _ in settings.LANGUAGES}
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _user_rows(users):
+    """Subject rows for ``(id, email, first_name, last_name)`` tuples, one query per batch for languages."""
+    users = list(users)
+    by_shard = {}
+    for user in users:
+        by_shard.setdefault(shard_for(user_id=user[0]), []).append(user[0])
+    countries = {}
+    for alias, user_ids in by_shard.items():
+        countries.update(
+            consents_on(alias).filter(user_id__in=user_ids)
+            .exclude(country='')
+            .order_by('timestamp')
+            .values_list('user_id', 'country')
+        )
+    for user_id, email, first_name, last_name in users:
+        if email:
+            yield {
+                'user_id': user_id,
+                'email': email,
+                'name': f'{first_name} {last_name}'.strip(),
+                'language': LANGUAGE_BY_COUNTRY.get(countries.get(user_id), settings.LANGUAGE_CODE),
+            }
+
+
+def subjects_from_users(queryset, batch_size=5000):
+    """Yield subject rows for every user in ``queryset``."""
+    users = queryset.order_by('id').values_list('id', 'email', 'first_name', 'last_name')
+    for batch in _batched(users.iterator(chunk_size=batch_size), batch_size):
+        yield from _user_rows(batch)
+
+
+def subjects_from_file(path, batch_size=5000):
+    """
+    Yield subject rows from an uploaded list: either a CSV with a header naming
+    ``user_id`` and/or ``email`` (plus optional ``name`` and ``language``
+    columns), or one user ID or email address per line.
+    """
+    languages = _languages()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        first = f.readline()
+        f.seek(0)
+        header = [column.strip().lower() for column in next(csv.reader([first]), [])]
+        if 'user_id' in header or 'email' in header:
+            rows = csv.DictReader(f, fieldnames=header)
+            next(rows)
+        else:
+            rows = ({'value': line.strip()} for line in f if line.strip())
+
+        for batch in _batched(rows, batch_size):
+            by_id = {}
+            for row in batch:
+                value = (row.get('user_id') or row.get('value') or '').strip()
+                if value.isdigit():
+                    by_id[int(value)] = row
+                else:
+                    email = (row.get('email') or value).strip()
+                    if '@' not in email:
+                        continue
+                    language = (row.get('language') or '').strip()
+                    yield {
+                        'user_id': None,
+                        'email': email,
+                        'name': (row.get('name') or '').strip(),
+                        'language': language if language in languages else settings.LANGUAGE_CODE,
+                    }
+            if by_id:
+                users = User.objects.filter(id__in=by_id).values_list('id', 'email', 'first_name', 'last_name')
+                for subject in _user_rows(users):
+                    language = (by_id[subject['user_id']].get('language') or '').strip()
+                    if language in languages:
+                        subject['language'] = language
+                    yield subject
+
+
+def add_subjects(breach, rows, batch_size=5000):
+    """Store subject rows for ``breach`` in batches; duplicates are skipped. Returns the number added."""
+    before = breach.subjects.count()
+    for batch in _batched(rows, batch_size):
+        BreachSubject.objects.bulk_create(
+            [BreachSubject(breach=breach, **row) for row in batch],
+            ignore_conflicts=True,
+        )
+    return breach.subjects.count() - before
+
+
+def pending_subjects(breach_id):
+    return BreachSubject.objects.filter(breach_id=breach_id, notified_at__isnull=True, error='')
+
+
+def plan_chunks(breach_id, chunk_size=500):
+    """Yield ``(first_id, last_id)`` ranges covering ``chunk_size`` pending subjects each."""
+    last_id = 0
+    while True:
+        ids = list(
+            pending_subjects(breach_id).filter(id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        last_id = ids[-1]
+
+
+def render_messages(breach, languages):
+    """Render ``{language: (subject, body)}`` once per language."""
+    messages = {}
+    for language in languages:
+        template = select_template([
+            f'ethics_app/email/breach_notification.{language}.txt',
+            f'ethics_app/email/breach_notification.{settings.LANGUAGE_CODE}.txt',
+        ])
+        with translation.override(language):
+            text = template.render({
+                'breach': breach,
+                'name': NAME_PLACEHOLDER,
+                'site_url': settings.SITE_URL,
+                'contact_email': settings.DEFAULT_FROM_EMAIL,
+            })
+        subject, _, body = text.strip().partition('\n')
+        messages[language] = (subject.strip(), body.strip() + '\n')
+    return messages
+
+
+def start_notification(breach_id):
+    DataBreach.objects.filter(id=breach_id, notification_started_at__isnull=True).update(
+        notification_started_at=timezone.now()
+    )
+
+
+def send_chunk(breach_id, first_id, last_id, checkpoint_every=100):
+    """
+    Send notifications to the pending subjects in ``[first_id, last_id]`` over
+    one mail connection. Returns ``(sent, failed)``.
+    """
+    breach = DataBreach.objects.get(id=breach_id)
+    subjects = list(
+        pending_subjects(breach_id).filter(id__gte=first_id, id__lte=last_id)
+        .order_by('id').values_list('id', 'email', 'name', 'language')
+    )
+    if not subjects:
+        return 0, 0
+    rendered = render_messages(breach, {subject[3] for subject in subjects})
+
+    sent, failed = [], []
+
+    def checkpoint():
+        now = timezone.now()
+        if sent:
+            BreachSubject.objects.filter(id__in=sent).update(notified_at=now)
+        for subject_id, error in failed:
+            BreachSubject.objects.filter(id=subject_id).update(error=error[:200])
+        DataBreach.objects.filter(id=breach_id).update(
+            notifications_sent=F('notifications_sent') + len(sent),
+            notifications_failed=F('notifications_failed') + len(failed),
+        )
+        counts = len(sent), len(failed)
+        sent.clear()
+        failed.clear()
+        return counts
+
+    totals = [0, 0]
+    with get_connection() as connection:
+        for subject_id, email, name, language in subjects:
+            subject, body = rendered[language]
+            message = EmailMessage(
+                subject=subject,
+                body=body.replace(NAME_PLACEHOLDER, name or email),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[email],
+                connection=connection,
+            )
+            try:
+                message.send()
+                sent.append(subject_id)
+            except Exception as e:
+                failed.append((subject_id, f'{type(e).__name__}: {e}'))
+            if len(sent) + len(failed) >= checkpoint_every:
+                totals = [a + b for a, b in zip(totals, checkpoint())]
+    totals = [a + b for a, b in zip(totals, checkpoint())]
+    return tuple(totals)
+
+
+def complete_if_done(breach_id):
+    """
+    Mark the breach's subjects notified once every one of them has been.
+    Subjects whose sending failed keep it incomplete until ``retry_failed``
+    and a successful send. Returns True if complete.
+    """
+    if BreachSubject.objects.filter(breach_id=breach_id, notified_at__isnull=True).exists():
+        return False
+    DataBreach.objects.filter(id=breach_id, notification_completed_at__isnull=True).update(
+        notification_completed_at=timezone.now(),
+        subjects_notified=True,
+    )
+    return True
+
+
+def retry_failed(breach_id):
+    """
+    Clear the send errors of subjects not notified, so the next run sends to
+    them again, and withdraw any completion recorded with them outstanding.
+    Returns the number of subjects to retry.
+    """
+    cleared = BreachSubject.objects.filter(breach_id=breach_id, notified_at__isnull=True).exclude(error='').update(error='')
+    if cleared:
+        DataBreach.objects.filter(id=breach_id).update(notification_completed_at=None, subjects_notified=False)
+    return cleared
+
+
+def progress(breach):
+    """Counts, throughput and ETA for a breach's notification run."""
+    breach.refresh_from_db()
+    total = breach.subjects.count()
+    notified = breach.subjects.filter(notified_at__isnull=False).count()
+    failed = breach.subjects.exclude(error='').count()
+    remaining = total - notified - failed
+    now = timezone.now()
+
+    rate = None
+    if breach.notification_started_at:
+        end = breach.notification_completed_at or now
+        elapsed = (end - breach.notification_started_at).total_seconds()
+        if elapsed > 0 and breach.notifications_sent:
+            rate = breach.notifications_sent / elapsed
+
+    deadline = breach.detection_date + NOTIFICATION_DEADLINE
+    eta = now + timedelta(seconds=remaining / rate) if rate and remaining else None
+    return {
+        'total': total,
+        'notified': notified,
+        'failed': failed,
+        'remaining': remaining,
+        'per_second': rate,
+        'eta': eta,
+        'deadline': deadline,
+        'on_track': (breach.notification_completed_at or eta or now) <= deadline,
+        'started_at': breach.notification_started_at,
+        'completed_at': breach.notification_completed_at,
+    }
@@ -0,0 +1,219 @@
+"""
+Compaction of orphaned anonymous consents.
+
+Anonymous ``ConsentRecord`` rows are keyed by ``session_key``, and sessions
+last an hour, while the records stay until their ``expiry_date`` a year
+later. Once the session is gone, nobody can be matched to the record any
+more, so it only inflates the table and its indexes. ``compact_orphans``
+walks anonymous records in ``(timestamp, id)`` order from a persisted
+watermark. For each chunk it anti-joins against ``django_session`` (a
+``NOT EXISTS`` on the session primary key) to find the records whose session
+has ended. Those records are folded into anonymous ``ConsentTally`` counts
+per day, consent type, decision, country and policy, so compliance reports
+still count them, and are then deleted. Every chunk commits together with
+the advanced watermark, so an interrupted run resumes where it stopped.
+Records whose session was still alive when the watermark passed them stay
+until the retention sweep removes them.
+
+With consent shards, each shard is compacted in turn from its own watermark.
+Sessions, tallies and watermarks stay on ``default``, so there the anti-join
+becomes a second query for the chunk's live session keys.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connections, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import ConsentRecord, ConsentTally, JobWatermark
+from .reporting import day_trunc
+from .sharding import is_sharded, shard_aliases
+
+WATERMARK = 'consent_compaction'
+
+CompactionResult = namedtuple('CompactionResult', ['scanned', 'compacted', 'tallies', 'reclaimed_bytes', 'watermark'])
+
+
+def _watermark_name(alias):
+    return f'{WATERMARK}:{alias}' if is_sharded() else WATERMARK
+
+
+def get_watermark(alias='default', using='default'):
+    watermark, _ = JobWatermark.objects.using(using).get_or_create(name=_watermark_name(alias))
+    return watermark
+
+
+def reset_watermark(using='default'):
+    JobWatermark.objects.using(using).filter(name__startswith=WATERMARK).delete()
+
+
+def anonymous_consents(using='default'):
+    return ConsentRecord.objects.using(using).filter(user__isnull=True, session_key__isnull=False)
+
+
+def orphaned(queryset, now, using='default', session_keys=None):
+    """
+    Restrict ``queryset`` to records whose session no longer exists or has
+    expired. Sessions on another database than the records are looked up
+    by ``session_keys`` instead of with a subquery.
+    """
+    if queryset.db == using:
+        live = Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gt=now)
+        return queryset.filter(~Exists(live))
+    live = Session.objects.using(using).filter(session_key__in=session_keys, expire_date__gt=now)
+    return queryset.exclude(session_key__in=list(live.values_list('session_key', flat=True)))
+
+
+def _after(watermark):
+    if watermark.timestamp is None:
+        return Q()
+    return Q(timestamp__gt=watermark.timestamp) | Q(timestamp=watermark.timestamp, id__gt=watermark.last_id)
+
+
+def _add_tallies(rows, using):
+    """Add ``{(day, type, given, country, policy_id): count}`` to the stored tallies."""
+    days = {key[0] for key in rows}
+    existing = {
+        (tally.day, tally.consent_type, tally.consent_given, tally.country.code or '', tally.policy_id): tally
+        for tally in ConsentTally.objects.using(using).filter(day__in=days)
+    }
+    changed, created = [], []
+    for key, count in rows.items():
+        tally = existing.get(key)
+        if tally is None:
+            day, consent_type, consent_given, country, policy_id = key
+            created.append(ConsentTally(
+                day=day, consent_type=consent_type, consent_given=consent_given,
+                country=country, policy_id=policy_id, count=count,
+            ))
+        else:
+            tally.count += count
+            changed.append(tally)
+    if changed:
+        ConsentTally.objects.using(using).bulk_update(changed, ['count'])
+    if created:
+        ConsentTally.objects.using(using).bulk_create(created)
+    return len(created)
+
+
+def compact_chunk(watermark, now, cutoff, chunk_size=5000, dry_run=False, using='default', alias=None):
+    """
+    Compact the orphans among the next ``chunk_size`` anonymous records on
+    ``alias`` (default: ``using``) older than ``cutoff``. Returns ``(scanned,
+    compacted, new tallies)``; ``scanned`` is 0 once the watermark has caught
+    up with ``cutoff``.
+    """
+    alias = alias or using
+    candidates = list(
+        anonymous_consents(alias).filter(_after(watermark), timestamp__lt=cutoff)
+        .order_by('timestamp', 'id').values_list('id', 'timestamp', 'session_key')[:chunk_size]
+    )
+    if not candidates:
+        return 0, 0, 0
+
+    # Tallies and the watermark (on ``using``) commit before the deletions on
+    # a separate shard database: a failure in between leaves records to be
+    # removed by retention rather than counts that were never recorded.
+    with transaction.atomic(using=alias), transaction.atomic(using=using):
+        chunk = orphaned(
+            anonymous_consents(alias).filter(id__in=[pk for pk, _, _ in candidates]),
+            now, using, {session_key for _, _, session_key in candidates},
+        )
+        rows = {}
+        grouped = (
+            chunk.annotate(day=day_trunc('timestamp', using))
+            .values_list('day', 'consent_type', 'consent_given', 'country', 'policy_id')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for day, consent_type, consent_given, country, policy_id, count in grouped:
+            if isinstance(day, str):
+                day = date.fromisoformat(day)
+            rows[(day, consent_type, consent_given, country or '', policy_id)] = count
+
+        compacted = sum(rows.values())
+        tallies = 0
+        if not dry_run:
+            tallies = _add_tallies(rows, using)
+            if compacted:
+                ConsentRecord.objects.using(alias).filter(
+                    id__in=list(chunk.values_list('id', flat=True))
+                ).delete()
+        watermark.last_id, watermark.timestamp = str(candidates[-1][0]), candidates[-1][1]
+        if not dry_run:
+            watermark.save(using=using)
+    return len(candidates), compacted, tallies
+
+
+def _sqlite_free_bytes(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA freelist_count')
+        free_pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return free_pages * cursor.fetchone()[0]
+
+
+def _postgres_table_bytes(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_total_relation_size(%s)', [ConsentRecord._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def compact_orphans(chunk_size=5000, max_chunks=None, grace=None, dry_run=False, using='default', progress=None):
+    """
+    Compact orphaned anonymous consents on every consent shard from its
+    stored watermark onwards; ``max_chunks`` applies per shard.
+
+    Records younger than ``grace`` (default: ``SESSION_COOKIE_AGE`` plus a
+    day) are left alone, since their session may yet be saved again. Reclaimed
+    space is measured from the SQLite freelist, which holds the pages the
+    deleted rows and index entries occupied until they are reused, and
+    estimated from the table's share of ``pg_total_relation_size`` on
+    PostgreSQL, where VACUUM makes it reusable. Other backends report None.
+    The returned watermark is the oldest of the shards'.
+    """
+    now = timezone.now()
+    if grace is None:
+        grace = timedelta(seconds=settings.SESSION_COOKIE_AGE) + timedelta(days=1)
+    cutoff = now - grace
+
+    scanned = compacted = tallies = 0
+    reclaimed = 0 if dry_run else None
+    watermarks = []
+    aliases = shard_aliases() if is_sharded() else [using]
+    for alias in aliases:
+        connection = connections[alias]
+        free_before = table_bytes = table_rows = None
+        if connection.vendor == 'sqlite':
+            free_before = _sqlite_free_bytes(connection)
+        elif connection.vendor == 'postgresql':
+            table_bytes = _postgres_table_bytes(connection)
+            table_rows = ConsentRecord.objects.using(alias).count()
+
+        watermark = get_watermark(alias, using)
+        shard_compacted = chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            seen, removed, added = compact_chunk(watermark, now, cutoff, chunk_size, dry_run, using, alias)
+            if not seen:
+                break
+            scanned += seen
+            shard_compacted += removed
+            tallies += added
+            chunks += 1
+            if progress:
+                progress(scanned, compacted + shard_compacted, watermark)
+        compacted += shard_compacted
+        watermarks.append(watermark.timestamp)
+
+        if dry_run:
+            continue
+        if free_before is not None:
+            reclaimed = (reclaimed or 0) + max(_sqlite_free_bytes(connection) - free_before, 0)
+        elif table_bytes is not None and table_rows:
+            reclaimed = (reclaimed or 0) + table_bytes * shard_compacted // table_rows
+
+    oldest = None if None in watermarks else min(watermarks)
+    return CompactionResult(scanned, compacted, tallies, reclaimed, oldest)
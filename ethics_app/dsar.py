@@ -0,0 +1,372 @@
+"""
+Data access packages.
+
+Access and portability requests are answered with a zip file of what we hold
+about the subject: ``account.json``, their consent records and their other
+data subject requests as ``.json`` and ``.csv``, and ``index.html``, a
+readable summary. ``write_package`` writes it entry by entry, reading each
+table in chunks of ``DSAR_CHUNK_SIZE`` rows (from the read replicas), so a
+subject with many consents never sits in memory.
+
+Packages are content-addressed. Entries carry a fixed date and rows a fixed
+order, so the same data always makes the same bytes, and ``build`` stores the
+file under ``DSAR_PACKAGE_DIR`` by its SHA-256. A re-request whose data has
+not changed finds its file already there and shares it. Access and
+portability requests themselves are left out of the package: they are what
+it answers, and listing them would make every package differ from the last.
+
+Each request's ``DataPackage`` expires after ``DSAR_PACKAGE_DAYS``; ``purge``
+deletes expired packages and the files no package refers to any more. The
+requester downloads through a signed link (``download_url``).
+``package_response`` answers single byte ranges, so broken downloads resume,
+and hands whole files to the server to send without copying: to the WSGI
+``wsgi.file_wrapper`` (gunicorn uses ``sendfile()``), or with
+``DSAR_SENDFILE_HEADER`` to the web server in front.
+"""
+import csv
+import hashlib
+import heapq
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse, HttpResponseGone
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext as _
+
+from . import identity
+from .models import DataPackage, PrivacyPolicy
+from .replicas import on_replica, replica_reads
+
+# request types answered with a package, and so not listed in one
+PACKAGE_TYPES = ('access', 'portability')
+# the zip epoch, for every entry: the same data makes the same bytes
+ENTRY_DATE = (1980, 1, 1, 0, 0, 0)
+TOKEN_SALT = 'ethics_app.dsar'
+
+ACCOUNT_FIELDS = ['username', 'email', 'first_name', 'last_name', 'date_joined', 'last_login', 'is_active']
+CONSENT_FIELDS = [
+    'consent_type', 'consent_given', 'timestamp', 'expiry_date', 'legal_basis', 'country',
+    'ip_address', 'policy_version', 'policy_language',
+]
+REQUEST_FIELDS = ['request_type', 'status', 'created_at', 'processed_at', 'description', 'response']
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def package_dir():
+    return Path(getattr(settings, 'DSAR_PACKAGE_DIR', Path(settings.BASE_DIR) / 'dsar_packages'))
+
+
+def path_for(digest):
+    return package_dir() / digest[:2] / f'{digest}.zip'
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _entry(archive, name):
+    info = zipfile.ZipInfo(name, date_time=ENTRY_DATE)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    return io.TextIOWrapper(archive.open(info, 'w', force_zip64=True), encoding='utf-8', newline='')
+
+
+def _write_table(archive, name, fields, rows):
+    """
+    Write ``rows`` to ``name``.json and ``name``.csv in one pass, spooling
+    the CSV meanwhile; yields each row as a dict on the way.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=1 << 20, mode='w+', encoding='utf-8', newline='') as spool:
+        writer = csv.writer(spool)
+        writer.writerow(fields)
+        count = 0
+        with _entry(archive, f'{name}.json') as out:
+            out.write('[')
+            for row in rows:
+                row = [_plain(value) for value in row]
+                writer.writerow(row)
+                record = dict(zip(fields, row))
+                out.write(',\n  ' if count else '\n  ')
+                json.dump(record, out, ensure_ascii=False)
+                count += 1
+                yield record
+            out.write('\n]\n' if count else ']\n')
+        spool.seek(0)
+        with _entry(archive, f'{name}.csv') as out:
+            shutil.copyfileobj(spool, out)
+
+
+def _consent_rows(subject, chunk_size):
+    """The subject's consents across their shards, oldest first."""
+    policies = {pk: (version, language) for pk, version, language in
+                PrivacyPolicy.objects.values_list('pk', 'version', 'language')}
+    columns = CONSENT_FIELDS[:-2] + ['policy_id', 'pk']
+    shards = [
+        on_replica(queryset).order_by('timestamp', 'pk').values_list(*columns).iterator(chunk_size=chunk_size)
+        for queryset in identity.subject_consents(subject)
+    ]
+    for row in heapq.merge(*shards, key=lambda row: (row[2], row[-1])):
+        yield row[:-2] + policies.get(row[-2], (None, None))
+
+
+def _request_rows(subject, chunk_size):
+    """The subject's data subject requests, oldest first, but for those a package answers."""
+    return (
+        on_replica(subject.requests.exclude(request_type__in=PACKAGE_TYPES))
+        .order_by('created_at', 'pk').values_list(*REQUEST_FIELDS).iterator(chunk_size=chunk_size)
+    )
+
+
+def write_package(subject, out, chunk_size=None):
+    """
+    Write the zip of ``subject``'s data (``None`` for nobody known) to the
+    binary file ``out``. Returns the number of rows in each table.
+    """
+    chunk_size = chunk_size or getattr(settings, 'DSAR_CHUNK_SIZE', 2000)
+    user = subject.user if subject is not None else None
+    account = {field: _plain(getattr(user, field)) for field in ACCOUNT_FIELDS} if user else None
+
+    latest, consents = {}, 0
+    with zipfile.ZipFile(out, 'w') as archive:
+        with _entry(archive, 'account.json') as entry:
+            json.dump(account, entry, ensure_ascii=False, indent=2)
+            entry.write('\n')
+        rows = _consent_rows(subject, chunk_size) if subject is not None else ()
+        for consent in _write_table(archive, 'consents', CONSENT_FIELDS, rows):
+            latest[consent['consent_type']] = consent
+            consents += 1
+        rows = _request_rows(subject, chunk_size) if subject is not None else ()
+        requests = list(_write_table(archive, 'requests', REQUEST_FIELDS, rows))
+        with _entry(archive, 'index.html') as entry:
+            entry.write(render_to_string('ethics_app/data_package.html', {
+                'account': account,
+                'consents': consents,
+                'latest': [latest[key] for key in sorted(latest)],
+                'requests': requests,
+            }))
+    return {'consents': consents, 'requests': len(requests)}
+
+
+def _digest(file):
+    file.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(1 << 20), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def build(request, days=None):
+    """
+    Write the package answering ``request`` and store it, unless the same
+    file is stored already. Returns its ``DataPackage``, which expires after
+    ``days`` (by default ``DSAR_PACKAGE_DAYS``).
+    """
+    days = days or getattr(settings, 'DSAR_PACKAGE_DAYS', 30)
+    staging = package_dir() / 'staging'
+    staging.mkdir(parents=True, exist_ok=True)
+    fd, temp = tempfile.mkstemp(suffix='.zip', dir=staging)
+    try:
+        with os.fdopen(fd, 'w+b') as out:
+            with replica_reads():
+                subject = request.subject or identity.resolve(email=request.email)
+                write_package(subject, out)
+            size = out.seek(0, os.SEEK_END)
+            digest = _digest(out)
+        path = path_for(digest)
+        if path.exists():
+            # unchanged data: keep the stored copy, and keep purge off it until recorded
+            os.utime(path)
+            os.unlink(temp)
+        else:
+            path.parent.mkdir(exist_ok=True)
+            os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+    package, _created = DataPackage.objects.update_or_create(
+        request=request,
+        defaults={'digest': digest, 'size': size, 'expires_at': timezone.now() + timedelta(days=days)},
+    )
+    return package
+
+
+def _unlink_unused(digests):
+    """Delete the files of ``digests`` that no package refers to; returns how many."""
+    digests = list(digests)
+    used = set(DataPackage.objects.filter(digest__in=digests).values_list('digest', flat=True))
+    removed = 0
+    for digest in set(digests) - used:
+        try:
+            path_for(digest).unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def discard(packages):
+    """Delete ``packages`` (a queryset) and the files only they used; returns how many packages."""
+    digests = set(packages.values_list('digest', flat=True))
+    deleted, _deleted = packages.delete()
+    _unlink_unused(digests)
+    return deleted
+
+
+def purge(now=None, grace=3600, batch_size=1000):
+    """
+    Delete expired packages, then files no package refers to that are older
+    than ``grace`` seconds (younger ones may be about to be recorded), and
+    abandoned staging files. Returns the numbers of packages and files.
+    """
+    now = now or timezone.now()
+    packages = discard(DataPackage.objects.filter(expires_at__lte=now))
+    root = package_dir()
+    if not root.is_dir():
+        return packages, 0
+    cutoff = time.time() - grace
+    files, batch = 0, []
+    for path in root.glob('??/*.zip'):
+        if path.stat().st_mtime < cutoff:
+            batch.append(path.stem)
+        if len(batch) >= batch_size:
+            files += _unlink_unused(batch)
+            batch = []
+    files += _unlink_unused(batch)
+    for path in root.glob('staging/*.zip'):
+        if path.stat().st_mtime < cutoff - 24 * 3600:
+            path.unlink(missing_ok=True)
+    return packages, files
+
+
+def download_url(package):
+    """The signed link the requester downloads ``package`` with."""
+    token = signing.dumps(str(package.request_id), salt=TOKEN_SALT)
+    return settings.SITE_URL.rstrip('/') + reverse('data_package', args=[token])
+
+
+def package_for(token):
+    """The package a download link names, or ``None`` for a link we did not sign."""
+    try:
+        request_id = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+    return DataPackage.objects.filter(request_id=request_id).first()
+
+
+def byte_range(header, size):
+    """
+    ``(first, last)`` byte of a single ``Range: bytes=`` header in a file of
+    ``size`` bytes, or ``None`` to send it all (no header, several ranges or
+    a malformed one). Raises ValueError when the range lies past the end.
+    """
+    match = _RANGE.fullmatch((header or '').strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # the last N bytes
+        if not int(last):
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    if last and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise ValueError(header)
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+class FileRange:
+    """
+    Bytes ``first`` to ``last`` of an open file, which reads, seeks and
+    tells as if they were all of it. No ``fileno()``: servers given one
+    would send from the descriptor's offset to the end.
+    """
+
+    def __init__(self, file, first, last):
+        self.file = file
+        self.first = first
+        self.length = last - first + 1
+        file.seek(first)
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.file.tell() - self.first
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.tell(), os.SEEK_END: self.length}[whence]
+        return self.file.seek(self.first + base + offset) - self.first
+
+    def read(self, size=-1):
+        left = max(self.length - self.tell(), 0)
+        return self.file.read(left if size is None or size < 0 else min(size, left))
+
+    def close(self):
+        self.file.close()
+
+
+def package_response(request, package):
+    """The download of ``package``: whole, one byte range of it, or handed to the web server."""
+    path = path_for(package.digest)
+    filename = f'data-package-{package.created_at:%Y-%m-%d}.zip'
+    etag = f'"{package.digest}"'
+
+    header = getattr(settings, 'DSAR_SENDFILE_HEADER', None)
+    if header:
+        # the web server sends the file and answers ranges itself
+        response = HttpResponse(content_type='application/zip')
+        if header.lower() == 'x-accel-redirect':
+            prefix = getattr(settings, 'DSAR_SENDFILE_PREFIX', '/protected/dsar-packages/')
+            response[header] = prefix.rstrip('/') + '/' + path.relative_to(package_dir()).as_posix()
+        else:
+            response[header] = str(path)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['ETag'] = etag
+        return response
+
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return HttpResponseGone(_('This data package is no longer available. Please submit a new request.'))
+    size = os.fstat(file.fileno()).st_size
+    wanted = request.headers.get('Range')
+    if request.headers.get('If-Range', etag) != etag:
+        wanted = None
+    try:
+        span = byte_range(wanted, size)
+    except ValueError:
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if span is None:
+        response = FileResponse(file, as_attachment=True, filename=filename, content_type='application/zip')
+    else:
+        first, last = span
+        response = FileResponse(
+            FileRange(file, first, last), as_attachment=True, filename=filename,
+            content_type='application/zip', status=206,
+        )
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(package.created_at.timestamp())
+    response['Cache-Control'] = 'private, no-store'
+    return response
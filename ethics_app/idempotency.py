@@ -0,0 +1,116 @@
+"""
+Idempotency keys for Celery tasks.
+
+Celery delivers at least once: a task may be retried after it already did
+its work, run again when a worker dies before acknowledging it, or be queued
+twice by a double click or an overlapping beat schedule. ``idempotent``
+derives a key from a task's arguments and claims it in ``TaskExecution``
+before running the task body:
+
+* a key that has completed short-circuits, returning the stored result;
+* a key held by another task ID short-circuits while its lease
+  (``TASK_IDEMPOTENCY_LEASE`` seconds) lasts, and is taken over once it has
+  run out, since its worker has presumably died;
+* a retry of the claiming task (same task ID) runs again, with a new lease.
+
+With ``remember=False`` the claim is released on completion, which makes a
+recurring job single-flight: a duplicate is skipped while one run is in
+progress, but the next scheduled run goes ahead. It is released as well when
+the task fails, except by ``self.retry()``, which keeps it for the retry. A
+failed task with ``remember`` set keeps its claim until the lease runs out.
+Jobs that run often and briefly pass a shorter ``lease``, so one lost with
+its worker holds up the next run for seconds rather than minutes.
+"""
+import functools
+import logging
+from datetime import timedelta
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.utils import timezone
+
+from .models import TaskExecution
+
+logger = logging.getLogger(__name__)
+
+
+def _lease(seconds=None):
+    if seconds is None:
+        seconds = getattr(settings, 'TASK_IDEMPOTENCY_LEASE', 600)
+    return timedelta(seconds=seconds)
+
+
+def claim(key, task_name, task_id=None, lease=None):
+    """
+    Claim ``key`` for ``task_id``. Returns ``(claimed, execution)``; when not
+    claimed, ``execution`` is the completed or still running claim. ``lease``
+    is in seconds and defaults to ``TASK_IDEMPOTENCY_LEASE``.
+    """
+    now = timezone.now()
+    task_id = task_id or ''
+    execution, created = TaskExecution.objects.get_or_create(
+        key=key, defaults={'task_name': task_name, 'task_id': task_id, 'started_at': now}
+    )
+    if created:
+        return True, execution
+    if execution.completed_at is not None:
+        return False, execution
+    if task_id and execution.task_id == task_id:
+        # a retry: its lease starts over
+        TaskExecution.objects.filter(pk=execution.pk, task_id=task_id).update(started_at=now)
+        execution.started_at = now
+        return True, execution
+    if execution.started_at > now - _lease(lease):
+        return False, execution
+    # The lease ran out: take over, unless another worker just did
+    taken = TaskExecution.objects.filter(
+        pk=execution.pk, task_id=execution.task_id, started_at=execution.started_at, completed_at=None,
+    ).update(task_id=task_id, started_at=now)
+    if taken:
+        execution.task_id, execution.started_at = task_id, now
+    return bool(taken), execution
+
+
+def release(execution):
+    """Drop the claim, unless another task has taken it over since."""
+    TaskExecution.objects.filter(pk=execution.pk, task_id=execution.task_id).delete()
+
+
+def complete(execution, result=None, remember=True):
+    if remember:
+        execution.completed_at = timezone.now()
+        execution.result = result
+        execution.save(update_fields=['completed_at', 'result'])
+    else:
+        release(execution)
+
+
+def idempotent(key, remember=True, lease=None):
+    """
+    Make a bound task (``bind=True``) idempotent under ``key(*args,
+    **kwargs)``. Apply it below ``@shared_task``. The result must be JSON
+    serializable when ``remember`` is set. ``lease`` overrides
+    ``TASK_IDEMPOTENCY_LEASE`` for this task.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(task, *args, **kwargs):
+            task_key = key(*args, **kwargs)
+            claimed, execution = claim(task_key, task.name, task.request.id, lease)
+            if not claimed:
+                state = 'completed' if execution.completed_at else f'running as {execution.task_id}'
+                logger.info(f'Skipping {task.name}: {task_key} already {state}')
+                return execution.result
+            try:
+                result = func(task, *args, **kwargs)
+            except Retry:
+                # the retry arrives with the same task ID and reclaims the key
+                raise
+            except Exception:
+                if not remember:
+                    release(execution)
+                raise
+            complete(execution, result, remember)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,349 @@
+"""
+Subject identity index.
+
+What we hold about one person is keyed three ways: their user account, the
+email address they gave in data subject requests, and the session keys their
+anonymous consents were recorded under (which change at every login and
+expire with the session). ``Subject`` ties these together so that exports
+and erasure find a person's rows through indexed lookups, instead of
+matching email strings or scanning for session keys.
+
+* A user has one subject (``Subject.user``).
+* ``SubjectIdentifier`` maps each email address, as a keyed SHA-256 digest
+  of its normalized form, and each session key to one subject. Digests keep
+  the index from being another copy of the addresses; they are keyed with
+  ``SECRET_KEY``, so run ``rebuild_subject_index`` after rotating it.
+* Data subject requests point at their subject (``DataSubjectRequest.subject``).
+
+Receivers keep the index current: saving a user or a request links its email
+address, and logging in links the session the visitor had before (where
+their anonymous consents are) and the one they get. When an identifier
+turns out to belong to two subjects, for example a request sent before its
+author signed up, the subjects are merged, unless both have a user account.
+
+Lookups go through a per-process LRU cache, ``subject_cache``, whose entries
+expire after ``SUBJECT_CACHE_SECONDS`` so that merges in other processes are
+picked up.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.sessions.models import Session
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
+
+from .models import DataPackage, DataSubjectRequest, Subject, SubjectIdentifier
+from .sharding import consents_on, shard_for
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def email_digest(email):
+    return salted_hmac('ethics_app.identity.email', normalize_email(email), algorithm='sha256').hexdigest()
+
+
+class SubjectCache:
+    """
+    Per-process LRU cache of ``(kind, value)`` to subject ID. Entries live
+    for ``ttl`` seconds; merges and erasures in this process clear it.
+    """
+
+    def __init__(self, maxsize=65536, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            subject_id, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return subject_id
+
+    def set(self, key, subject_id):
+        with self._lock:
+            self._entries[key] = (subject_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+subject_cache = SubjectCache(
+    getattr(settings, 'SUBJECT_CACHE_SIZE', 65536),
+    getattr(settings, 'SUBJECT_CACHE_SECONDS', 300),
+)
+
+
+def _lookup(kind, value):
+    """Subject ID for an identifier, or None."""
+    key = (kind, value)
+    subject_id = subject_cache.get(key)
+    if subject_id is None:
+        if kind == 'user':
+            subject_id = Subject.objects.filter(user_id=value).values_list('pk', flat=True).first()
+        else:
+            subject_id = SubjectIdentifier.objects.filter(kind=kind, value=value).values_list(
+                'subject_id', flat=True
+            ).first()
+        if subject_id is not None:
+            subject_cache.set(key, subject_id)
+    return subject_id
+
+
+def resolve(email=None, user=None, session_key=None):
+    """The subject known by any of the given identifiers, or None."""
+    subject_id = None
+    if user is not None:
+        subject_id = _lookup('user', user.pk)
+    if subject_id is None and email:
+        subject_id = _lookup('email', email_digest(email))
+    if subject_id is None and session_key:
+        subject_id = _lookup('session', session_key)
+    if subject_id is None:
+        return None
+    return Subject.objects.select_related('user').filter(pk=subject_id).first()
+
+
+def subject_id_for_user(user):
+    subject_id = _lookup('user', user.pk)
+    if subject_id is None:
+        subject_id = Subject.objects.get_or_create(user=user)[0].pk
+        subject_cache.set(('user', user.pk), subject_id)
+    return subject_id
+
+
+def merge(keep_id, other_id, using=None):
+    """
+    Fold subject ``other_id`` into ``keep_id``. Refused (returns False) when
+    both have a user account: two accounts may share an email address, but
+    they are still two people as far as their data goes.
+    """
+    if keep_id == other_id:
+        return True
+    with transaction.atomic(using=using):
+        subjects = {
+            s.pk: s for s in Subject.objects.using(using).select_for_update().filter(pk__in=[keep_id, other_id])
+        }
+        keep, other = subjects.get(keep_id), subjects.get(other_id)
+        if keep is None or other is None:
+            return False
+        if keep.user_id and other.user_id:
+            return False
+        SubjectIdentifier.objects.using(using).filter(subject_id=other.pk).update(subject_id=keep.pk)
+        DataSubjectRequest.objects.using(using).filter(subject_id=other.pk).update(subject_id=keep.pk)
+        user_id = other.user_id
+        other.delete()
+        if user_id:
+            Subject.objects.using(using).filter(pk=keep.pk).update(user_id=user_id)
+    subject_cache.invalidate()
+    return True
+
+
+def link(subject_id, kind, value):
+    """Record that identifier ``(kind, value)`` belongs to ``subject_id``, merging subjects if needed."""
+    current = _lookup(kind, value)
+    if current is None:
+        try:
+            with transaction.atomic():
+                SubjectIdentifier.objects.create(subject_id=subject_id, kind=kind, value=value)
+            subject_cache.set((kind, value), subject_id)
+            return subject_id
+        except IntegrityError:
+            # linked by another process in the meantime
+            current = _lookup(kind, value)
+    if current != subject_id and merge(subject_id, current):
+        return subject_id
+    return current
+
+
+def subject_id_for_email(email):
+    """ID of the subject with this email address, created if there is none."""
+    digest = email_digest(email)
+    subject_id = _lookup('email', digest)
+    if subject_id is None:
+        subject_id = link(Subject.objects.create().pk, 'email', digest)
+    return subject_id
+
+
+def session_keys(subject):
+    return list(subject.identifiers.filter(kind='session').values_list('value', flat=True))
+
+
+def subject_consents(subject):
+    """
+    Querysets of the subject's consent records, one per shard: those given
+    while signed in, then the anonymous ones of each of their sessions.
+    """
+    querysets = []
+    if subject.user_id:
+        querysets.append(consents_on(shard_for(user_id=subject.user_id)).filter(user_id=subject.user_id))
+    by_shard = {}
+    for key in session_keys(subject):
+        by_shard.setdefault(shard_for(session_key=key), []).append(key)
+    for alias, keys in by_shard.items():
+        querysets.append(consents_on(alias).filter(user__isnull=True, session_key__in=keys))
+    return querysets
+
+
+def erase(subject, dry_run=False):
+    """
+    Delete what we hold about ``subject``: their consent records, their
+    sessions, their user account and the data packages sent to them. Their
+    data subject requests and email digest are kept as the record that the
+    requests were handled. Returns the number of rows per kind.
+    """
+    from .dsar import discard
+
+    keys = session_keys(subject)
+    consents = subject_consents(subject)
+    sessions = Session.objects.filter(session_key__in=keys)
+    packages = DataPackage.objects.filter(request__subject=subject)
+    counts = {
+        'consent records': sum(queryset.count() for queryset in consents),
+        'sessions': sessions.count(),
+        'user accounts': int(subject.user_id is not None),
+        'data packages': packages.count(),
+    }
+    if dry_run:
+        return counts
+    for queryset in consents:
+        queryset.delete()
+    sessions.delete()
+    discard(packages)
+    subject.identifiers.filter(kind='session').delete()
+    if subject.user_id:
+        User.objects.filter(pk=subject.user_id).delete()
+    subject_cache.invalidate()
+    return counts
+
+
+def rebuild(batch_size=10_000, progress=None, using=None):
+    """
+    Index every user and data subject request that is not indexed yet, in
+    primary key batches. Needed after rows were written without signals
+    (``bulk_create``, seeding) or ``SECRET_KEY`` changed. Returns the numbers
+    of users and requests indexed.
+    """
+    users = requests = 0
+    after = 0
+    while True:
+        batch = list(
+            User.objects.using(using).filter(pk__gt=after, subject__isnull=True).order_by('pk').values_list('pk', 'email')[:batch_size]
+        )
+        if not batch:
+            break
+        with transaction.atomic(using=using):
+            Subject.objects.using(using).bulk_create([Subject(user_id=pk) for pk, _ in batch], ignore_conflicts=True)
+            subject_ids = dict(
+                Subject.objects.using(using).filter(user_id__in=[pk for pk, _ in batch]).values_list('user_id', 'pk')
+            )
+            wanted = {email_digest(email): subject_ids[pk] for pk, email in batch if email}
+            for digest, subject_id in _link_emails(wanted, using).items():
+                if subject_id != wanted[digest]:
+                    # requests sent before the user signed up
+                    merge(wanted[digest], subject_id, using)
+        users += len(batch)
+        after = batch[-1][0]
+        if progress:
+            progress(users, requests)
+
+    after = None
+    while True:
+        queryset = DataSubjectRequest.objects.using(using).filter(subject__isnull=True)
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+        batch = list(queryset.order_by('pk').values_list('pk', 'email')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic(using=using):
+            digests = {pk: email_digest(email) for pk, email in batch}
+            subject_ids = _link_emails(dict.fromkeys(digests.values()), using)
+            _set_request_subjects(
+                [(subject_ids[digest], pk) for pk, digest in digests.items()], using
+            )
+        requests += len(batch)
+        after = batch[-1][0]
+        if progress:
+            progress(users, requests)
+    return users, requests
+
+
+def _set_request_subjects(rows, using=None):
+    """Point requests at subjects from ``(subject_id, pk)`` rows, with one primary key update each."""
+    # bulk_update() compiles a CASE arm per row, which costs far more than the updates
+    using = using or router.db_for_write(DataSubjectRequest)
+    connection = connections[using]
+    meta = DataSubjectRequest._meta
+    sql = 'UPDATE %s SET %s = %%s WHERE %s = %%s' % (
+        connection.ops.quote_name(meta.db_table),
+        connection.ops.quote_name(meta.get_field('subject').column),
+        connection.ops.quote_name(meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(subject_id, meta.pk.get_db_prep_value(pk, connection)) for subject_id, pk in rows])
+
+
+def _link_emails(digests, using=None):
+    """
+    Bulk form of ``link`` for email digests mapped to a subject ID, or None
+    for a new subject. Digests that are already linked keep their subject.
+    Returns the subject ID of every digest.
+    """
+    linked = dict(
+        SubjectIdentifier.objects.using(using).filter(kind='email', value__in=list(digests)).values_list('value', 'subject_id')
+    )
+    missing = [digest for digest in digests if digest not in linked]
+    new_subjects = Subject.objects.using(using).bulk_create([Subject() for digest in missing if digests[digest] is None])
+    new_ids = iter(subject.pk for subject in new_subjects)
+    for digest in missing:
+        linked[digest] = digests[digest] or next(new_ids)
+    SubjectIdentifier.objects.using(using).bulk_create([
+        SubjectIdentifier(subject_id=linked[digest], kind='email', value=digest) for digest in missing
+    ])
+    return linked
+
+
+@receiver(post_save, sender=User)
+def _index_user(sender, instance, raw=False, **kwargs):
+    if raw or not instance.email:
+        return
+    subject_id = subject_id_for_user(instance)
+    if _lookup('email', email_digest(instance.email)) != subject_id:
+        link(subject_id, 'email', email_digest(instance.email))
+
+
+@receiver(pre_save, sender=DataSubjectRequest)
+def _index_request(sender, instance, raw=False, **kwargs):
+    if not raw and instance.subject_id is None and instance.email:
+        instance.subject_id = subject_id_for_email(instance.email)
+
+
+@receiver(user_logged_in)
+def _index_sessions(sender, request, user, **kwargs):
+    if request is None or not hasattr(request, 'session'):
+        return
+    subject_id = subject_id_for_user(user)
+    # login() has already replaced the session key; the cookie still
+    # carries the one the visitor's anonymous consents were given under
+    previous = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    for key in {previous, request.session.session_key}:
+        if key and len(key) <= 40 and key.isalnum():
+            link(subject_id, 'session', key)
@@ -0,0 +1,285 @@
+"""
+Resolve a client IP address to a country and the consent regime that applies
+there (GDPR, CCPA, KVKK).
+
+IP ranges are loaded once per process into an ``IPRangeIndex``: parallel,
+sorted ``array`` columns of range starts, range ends and country numbers,
+searched with ``bisect``. A few million ranges take tens of megabytes in
+primitive buffers rather than Python objects, so after a preloading master
+forks (``gunicorn --preload`` imports ``wsgi.py``, which loads the index when
+``WARMUP_ON_IMPORT`` is set) the pages stay shared between workers. An LRU cache in front of the index
+answers repeat visitors without parsing the address again.
+
+Sources can be a CSV of ``start,end,country`` rows (dotted/colon notation
+or integers, as in the DB-IP and IP2Location lite exports), a MaxMind
+``.mmdb`` database (needs the optional ``maxminddb`` package), or a
+precompiled ``.idx`` file written by ``IPRangeIndex.save`` that loads in
+milliseconds.
+"""
+import csv
+import ipaddress
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+# EU member states plus the EEA countries that apply the GDPR, and the UK
+# (UK GDPR) and Switzerland (revFADP), whose rules are equivalent for cookies.
+GDPR_COUNTRIES = {
+    'AT', 'BE', 'BG', 'HR', 'CY', 'CZ', 'DK', 'EE', 'FI', 'FR', 'DE', 'GR', 'HU', 'IE',
+    'IT', 'LV', 'LT', 'LU', 'MT', 'NL', 'PL', 'PT', 'RO', 'SK', 'SI', 'ES', 'SE',
+    'IS', 'LI', 'NO', 'GB', 'CH',
+}
+
+# Country-level resolution cannot tell California from other states, so the
+# CCPA opt-out model is applied to the whole US.
+REGIME_COUNTRIES = {'US': 'ccpa', 'TR': 'kvkk'}
+
+# regime: (opt-in required, default cookie choices)
+REGIMES = {
+    'gdpr': (True, {'functional': True, 'analytics': False, 'marketing': False}),
+    'kvkk': (True, {'functional': True, 'analytics': False, 'marketing': False}),
+    'ccpa': (False, {'functional': True, 'analytics': True, 'marketing': True}),
+    # unknown location: the strictest rules are the safe choice
+    'default': (True, {'functional': True, 'analytics': False, 'marketing': False}),
+}
+
+
+class Jurisdiction(namedtuple('Jurisdiction', ['country', 'regime'])):
+    """Country code ('' when unknown) and consent regime name."""
+    __slots__ = ()
+
+    @property
+    def opt_in(self):
+        return REGIMES[self.regime][0]
+
+    @property
+    def defaults(self):
+        return dict(REGIMES[self.regime][1])
+
+
+def regime_for(country):
+    if country in GDPR_COUNTRIES:
+        return 'gdpr'
+    return REGIME_COUNTRIES.get(country, 'default')
+
+
+def _to_int(value):
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return number, 4 if number <= 0xFFFFFFFF else 6
+    address = ipaddress.ip_address(value)
+    return int(address), address.version
+
+
+def _ipv4_mapped(number):
+    """Return the IPv4 number for an IPv4-mapped IPv6 number, else None."""
+    if number >> 32 == 0xFFFF:
+        return number & 0xFFFFFFFF
+    return None
+
+
+class IPRangeIndex:
+    """
+    Sorted, non-overlapping IP ranges mapped to country codes.
+
+    IPv4 ranges are stored as 32-bit integers. IPv6 ranges are stored by
+    their upper 64 bits, which is the finest granularity geolocation
+    databases publish in practice; ranges narrower than a /64 collapse to it.
+    """
+
+    MAGIC = b'EJIX1\n'
+
+    def __init__(self):
+        self.countries = []
+        self._numbers = {}
+        self.v4 = (array('I'), array('I'), array('H'))
+        self.v6 = (array('Q'), array('Q'), array('H'))
+
+    def __len__(self):
+        return len(self.v4[0]) + len(self.v6[0])
+
+    def _country_number(self, code):
+        number = self._numbers.get(code)
+        if number is None:
+            number = self._numbers[code] = len(self.countries)
+            self.countries.append(code)
+        return number
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Build from ``(start, end, version, country)`` tuples in any order."""
+        index = cls()
+        rows = {4: [], 6: []}
+        for start, end, version, country in ranges:
+            if version == 6:
+                start, end = start >> 64, end >> 64
+            rows[version].append((start, end, country))
+
+        for version, columns in ((4, index.v4), (6, index.v6)):
+            starts, ends, numbers = columns
+            for start, end, country in sorted(rows[version]):
+                number = index._country_number(country)
+                if ends and start <= ends[-1] + 1 and numbers[-1] == number:
+                    # adjacent or overlapping range for the same country
+                    ends[-1] = max(ends[-1], end)
+                    continue
+                if ends and start <= ends[-1]:
+                    start = ends[-1] + 1
+                    if start > end:
+                        continue
+                starts.append(start)
+                ends.append(end)
+                numbers.append(number)
+        return index
+
+    @classmethod
+    def from_csv(cls, path):
+        def rows():
+            with open(path, newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) < 3:
+                        continue
+                    country = row[2].strip().upper()
+                    if len(country) != 2 or country == 'ZZ':
+                        continue
+                    try:
+                        start, version = _to_int(row[0])
+                        end, _ = _to_int(row[1])
+                    except ValueError:
+                        continue  # header or comment line
+                    if version == 6 and _ipv4_mapped(start) is not None:
+                        start, end, version = _ipv4_mapped(start), _ipv4_mapped(end), 4
+                    yield start, end, version, country
+        return cls.from_ranges(rows())
+
+    @classmethod
+    def from_mmdb(cls, path):
+        try:
+            import maxminddb
+        except ImportError:
+            raise ImportError('Reading .mmdb files requires the maxminddb package')
+
+        def rows():
+            with maxminddb.open_database(path) as reader:
+                for network, record in reader:
+                    record = record or {}
+                    country = (record.get('country') or record.get('registered_country') or {}).get('iso_code')
+                    if country:
+                        yield (int(network.network_address), int(network.broadcast_address),
+                               network.version, country)
+        return cls.from_ranges(rows())
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            codes = ''.join(self.countries).encode('ascii')
+            f.write(struct.pack('<III', len(self.countries), len(self.v4[0]), len(self.v6[0])))
+            f.write(codes)
+            for column in self.v4 + self.v6:
+                column.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f'{path} is not an IP range index')
+            country_count, v4_count, v6_count = struct.unpack('<III', f.read(12))
+            codes = f.read(country_count * 2).decode('ascii')
+            index.countries = [codes[i:i + 2] for i in range(0, len(codes), 2)]
+            index._numbers = {code: i for i, code in enumerate(index.countries)}
+            for column, count in zip(index.v4 + index.v6, (v4_count,) * 3 + (v6_count,) * 3):
+                column.fromfile(f, count)
+        return index
+
+    def lookup(self, ip):
+        """Return the country code for ``ip`` or None. Raises ValueError for invalid input."""
+        address = ipaddress.ip_address(ip)
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if address.version == 4:
+            starts, ends, numbers = self.v4
+            key = int(address)
+        else:
+            starts, ends, numbers = self.v6
+            key = int(address) >> 64
+        i = bisect_right(starts, key) - 1
+        if i >= 0 and key <= ends[i]:
+            return self.countries[numbers[i]]
+        return None
+
+
+def load_index(path):
+    path = str(path)
+    if path.endswith('.idx'):
+        return IPRangeIndex.load(path)
+    if path.endswith('.mmdb'):
+        return IPRangeIndex.from_mmdb(path)
+    return IPRangeIndex.from_csv(path)
+
+
+class JurisdictionResolver:
+    """Country and regime lookups through an LRU cache in front of the index."""
+
+    def __init__(self, index=None, cache_size=65536):
+        self.index = index
+        self.country = lru_cache(maxsize=cache_size)(self._country)
+
+    def _country(self, ip):
+        if self.index is None or not ip:
+            return None
+        try:
+            return self.index.lookup(ip)
+        except ValueError:
+            return None
+
+    def resolve(self, ip):
+        country = self.country(ip) or ''
+        return Jurisdiction(country, regime_for(country))
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """Return the process-wide resolver, loading ``GEOIP_RANGES_FILE`` on first use."""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                path = getattr(settings, 'GEOIP_RANGES_FILE', None)
+                _resolver = JurisdictionResolver(
+                    load_index(path) if path else None,
+                    cache_size=getattr(settings, 'GEOIP_CACHE_SIZE', 65536),
+                )
+    return _resolver
+
+
+def trusted_client_ip(request):
+    """
+    The client address as our own proxies saw it: ``REMOTE_ADDR``, or with
+    ``NUM_PROXIES`` reverse proxies in front, the ``X-Forwarded-For`` hop
+    just before them. Entries further left are whatever the client sent.
+    """
+    hops = getattr(settings, 'NUM_PROXIES', 0)
+    remote = request.META.get('REMOTE_ADDR')
+    if not hops:
+        return remote
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    # the last proxy is REMOTE_ADDR; each one before it appended the address it was called from
+    chain = forwarded + [remote]
+    return chain[max(len(chain) - hops - 1, 0)]
+
+
+def for_request(request):
+    """Jurisdiction of the client making ``request``, resolved once per request."""
+    if not hasattr(request, '_jurisdiction'):
+        request._jurisdiction = get_resolver().resolve(trusted_client_ip(request))
+    return request._jurisdiction
@@ -0,0 +1,300 @@
+"""
+In-process load generator for the portal pages and the consent API.
+
+Virtual visitors run as asyncio tasks, each with its own ``AsyncClient`` (and
+therefore its own session cookie), and replay a weighted mix of page views
+and consent decisions through the ASGI handler without touching the network.
+Every request is profiled by ``QueryProfilerMiddleware`` so the client-side
+latency can be split into queueing, database, template and application time.
+
+Each visitor has an IP address of its own. ``abusers`` adds clients that
+hammer the consent API from one address, with a fresh session every time,
+to measure what rate limiting leaves for everyone else.
+"""
+import asyncio
+import json
+import random
+import time
+
+from django.test import AsyncClient
+from django.test.client import AsyncClientHandler
+
+CONSENT_TYPES = ['functional', 'analytics', 'marketing']
+
+
+async def view_home(client, rng):
+    return await client.get('/')
+
+
+async def view_consent_page(client, rng):
+    return await client.get('/consent/')
+
+
+async def submit_consent_form(client, rng):
+    data = {'functional_cookies': 'on'}
+    for field in ('analytics_cookies', 'marketing_cookies'):
+        if rng.random() < 0.5:
+            data[field] = 'on'
+    return await client.post('/consent/', data)
+
+
+async def post_consent_api(client, rng):
+    return await client.post(
+        '/api/cookie-consent/',
+        data=json.dumps({'type': rng.choice(CONSENT_TYPES), 'consent': rng.random() < 0.6}),
+        content_type='application/json',
+    )
+
+
+async def view_privacy_policy(client, rng):
+    return await client.get('/privacy-policy/')
+
+
+async def view_data_request(client, rng):
+    return await client.get('/data-request/')
+
+
+async def submit_data_request(client, rng):
+    n = rng.getrandbits(32)
+    return await client.post('/data-request/', {
+        'request_type': 'access',
+        'email': f'loadtest{n}@example.com',
+        'full_name': f'Load Test {n}',
+        'description': 'Please send me a copy of my data.',
+    })
+
+
+async def abuse_consent_api(client, rng):
+    client.cookies.clear()
+    return await post_consent_api(client, rng)
+
+
+ABUSIVE_SCENARIO = 'abusive_consent_api'
+ABUSER_ADDRESS = '203.0.113.1'
+
+
+# (name, weight, action, is a consent decision)
+SCENARIOS = [
+    ('home', 30, view_home, False),
+    ('consent_page', 15, view_consent_page, False),
+    ('consent_form', 10, submit_consent_form, True),
+    ('consent_api', 25, post_consent_api, True),
+    ('privacy_policy', 15, view_privacy_policy, False),
+    ('data_request_page', 4, view_data_request, False),
+    ('data_request_submit', 1, submit_data_request, False),
+]
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def _is_throttled(response):
+    return response.status_code == 429
+
+
+def _is_error(response):
+    if _is_throttled(response):
+        return False
+    if response.status_code >= 500:
+        return True
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(response.content).get('status') == 'error'
+    return False
+
+
+def _is_lock_error(response):
+    return b'database is locked' in response.content
+
+
+class LoadTest:
+    """
+    Run a closed-loop load test at one concurrency level.
+
+    ``new_visitor_rate`` is the chance that a visitor drops its cookies and
+    starts again as a fresh session after each request. ``abusers`` clients
+    post to the consent API without pause alongside the visitors; their
+    requests are reported as their own scenario and are not decisions.
+    """
+
+    def __init__(self, scenarios=None, think_time=0.0, new_visitor_rate=0.1, seed=0, abusers=0):
+        self.scenarios = scenarios or SCENARIOS
+        self.think_time = think_time
+        self.new_visitor_rate = new_visitor_rate
+        self.seed = seed
+        self.abusers = abusers
+
+    def run(self, concurrency, duration):
+        return asyncio.run(self._run(concurrency, duration))
+
+    async def _run(self, concurrency, duration):
+        # One handler (and middleware chain) shared by every visitor, as in a
+        # single ASGI worker process.
+        self.handler = AsyncClientHandler(enforce_csrf_checks=False)
+        samples = []
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(self._visitor(n, deadline, samples) for n in range(concurrency)),
+            *(self._abuser(n, deadline, samples) for n in range(self.abusers)),
+        )
+        elapsed = time.perf_counter() - started
+        return summarize(samples, elapsed, concurrency)
+
+    async def _new_client(self, address):
+        client = AsyncClient(client=[address, 0])
+        client.handler = self.handler
+        # Landing on the home page creates the session the consent API needs.
+        await client.get('/')
+        return client
+
+    def _sample(self, name, decision, start, response=None, exc=None):
+        latency = (time.perf_counter() - start) * 1000
+        if response is None:
+            return {
+                'scenario': name, 'decision': decision, 'latency_ms': latency,
+                'error': True, 'throttled': False, 'locked': 'database is locked' in str(exc),
+                'profile': None,
+            }
+        return {
+            'scenario': name,
+            'decision': decision,
+            'latency_ms': latency,
+            'error': _is_error(response),
+            'throttled': _is_throttled(response),
+            'locked': _is_lock_error(response),
+            'profile': getattr(response.asgi_request, '_profile', None),
+        }
+
+    async def _visitor(self, n, deadline, samples):
+        rng = random.Random(f'{self.seed}:{n}')
+        names = [scenario[0] for scenario in self.scenarios]
+        weights = [scenario[1] for scenario in self.scenarios]
+        by_name = {scenario[0]: scenario for scenario in self.scenarios}
+        address = f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'
+        client = await self._new_client(address)
+
+        while time.perf_counter() < deadline:
+            name, _, action, decision = by_name[rng.choices(names, weights)[0]]
+            start = time.perf_counter()
+            try:
+                response = await action(client, rng)
+            except Exception as exc:
+                samples.append(self._sample(name, decision, start, exc=exc))
+                continue
+            samples.append(self._sample(name, decision, start, response))
+            if rng.random() < self.new_visitor_rate:
+                client = await self._new_client(address)
+            if self.think_time:
+                await asyncio.sleep(rng.expovariate(1 / self.think_time))
+
+    async def _abuser(self, n, deadline, samples):
+        rng = random.Random(f'{self.seed}:abuser:{n}')
+        client = AsyncClient(client=[ABUSER_ADDRESS, 0])
+        client.handler = self.handler
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await abuse_consent_api(client, rng)
+            except Exception as exc:
+                samples.append(self._sample(ABUSIVE_SCENARIO, False, start, exc=exc))
+                continue
+            samples.append(self._sample(ABUSIVE_SCENARIO, False, start, response))
+            # a throttled reply is too cheap to yield on its own
+            await asyncio.sleep(0)
+
+
+def _latency_stats(latencies):
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'p50_ms': percentile(ordered, 50),
+        'p90_ms': percentile(ordered, 90),
+        'p95_ms': percentile(ordered, 95),
+        'p99_ms': percentile(ordered, 99),
+        'max_ms': ordered[-1] if ordered else 0.0,
+        'mean_ms': sum(ordered) / len(ordered) if ordered else 0.0,
+    }
+
+
+def component_breakdown(samples):
+    """
+    Split total client latency into time queued before the view thread picked
+    the request up, SQL, template rendering and remaining application code.
+    """
+    totals = {'queue_ms': 0.0, 'db_ms': 0.0, 'template_ms': 0.0, 'app_ms': 0.0}
+    for sample in samples:
+        profile = sample['profile']
+        if profile is None:
+            continue
+        server = profile['total_ms']
+        totals['queue_ms'] += max(sample['latency_ms'] - server, 0.0)
+        totals['db_ms'] += profile['sql_ms']
+        totals['template_ms'] += profile['template_ms']
+        totals['app_ms'] += max(server - profile['sql_ms'] - profile['template_ms'], 0.0)
+    overall = sum(totals.values()) or 1.0
+    return {name: {'total_ms': value, 'share': value / overall} for name, value in totals.items()}
+
+
+COMPONENT_LABELS = {
+    'queue_ms': 'worker saturation (requests queue for the sync view thread)',
+    'db_ms': 'database',
+    'template_ms': 'template rendering',
+    'app_ms': 'application code and middleware',
+}
+
+
+def saturating_component(result):
+    if result['lock_errors']:
+        return 'SQLite write lock (database is locked errors)'
+    breakdown = result['components']
+    worst = max(breakdown, key=lambda name: breakdown[name]['share'])
+    return COMPONENT_LABELS[worst]
+
+
+def summarize(samples, elapsed, concurrency):
+    by_scenario = {}
+    for sample in samples:
+        by_scenario.setdefault(sample['scenario'], []).append(sample['latency_ms'])
+    decisions = sum(
+        1 for sample in samples if sample['decision'] and not sample['error'] and not sample['throttled']
+    )
+    abusive = [sample for sample in samples if sample['scenario'] == ABUSIVE_SCENARIO]
+    legitimate = [sample for sample in samples if sample['scenario'] != ABUSIVE_SCENARIO]
+    abusive_served = sum(1 for sample in abusive if not sample['error'] and not sample['throttled'])
+    result = {
+        'concurrency': concurrency,
+        'duration_s': elapsed,
+        'requests': len(samples),
+        'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+        'decisions_per_s': decisions / elapsed if elapsed else 0.0,
+        'errors': sum(1 for sample in samples if sample['error']),
+        'visitors_throttled': sum(1 for sample in legitimate if sample['throttled']),
+        'abusive_requests': len(abusive),
+        'abusive_served_per_s': abusive_served / elapsed if elapsed else 0.0,
+        'abusive_throttled': sum(1 for sample in abusive if sample['throttled']),
+        'visitor_latency': _latency_stats([sample['latency_ms'] for sample in legitimate]),
+        'lock_errors': sum(1 for sample in samples if sample['locked']),
+        'latency': _latency_stats([sample['latency_ms'] for sample in samples]),
+        'scenarios': {
+            name: _latency_stats(latencies) for name, latencies in sorted(by_scenario.items())
+        },
+        'components': component_breakdown(samples),
+    }
+    result['bottleneck'] = saturating_component(result)
+    return result
+
+
+def find_saturation(results, min_gain=0.1):
+    """
+    Return the first result after which adding concurrency raised throughput
+    by less than ``min_gain``, or None if throughput kept scaling.
+    """
+    for previous, current in zip(results, results[1:]):
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 + min_gain):
+            return previous
+    return None
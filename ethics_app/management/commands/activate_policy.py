@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app import policies
+from ethics_app.models import PrivacyPolicy
+from ethics_app.sharding import fan_out, shard_aliases
+
+class Command(BaseCommand):
+    help = 'Make a privacy policy version current for its language and reconcile earlier consents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('version')
+        parser.add_argument(
+            '--language',
+            default='en',
+            help='Language of the policy version (default: en)',
+        )
+        parser.add_argument(
+            '--carry-over',
+            action='store_true',
+            help='Move earlier consents to this version instead of expiring them',
+        )
+        parser.add_argument(
+            '--include-legacy',
+            action='store_true',
+            help='Also reconcile consents recorded before policy versions were tracked, in every language',
+        )
+        parser.add_argument(
+            '--now',
+            action='store_true',
+            help='Reconcile earlier consents in this process instead of queueing a Celery task',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Consent records updated per chunk with --now (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            policy = PrivacyPolicy.objects.get(version=options['version'], language=options['language'])
+        except PrivacyPolicy.DoesNotExist:
+            raise CommandError(f"No {options['language']} privacy policy with version {options['version']}")
+
+        if options['carry_over'] and policy.requires_reconsent:
+            policy.requires_reconsent = False
+            policy.save(update_fields=['requires_reconsent'])
+
+        legacy = options['include_legacy']
+        stale = sum(fan_out(lambda alias: policies.stale_consents(policy, alias, legacy).count()))
+        policies.activate(policy, reconcile=not options['now'], include_legacy=legacy)
+        self.stdout.write(self.style.SUCCESS(
+            f'Activated {policy.language} privacy policy {policy.version}; {stale} earlier consents are now stale'
+        ))
+
+        if not options['now']:
+            self.stdout.write('Reconciliation queued')
+            return
+
+        action = 'Expired' if policy.requires_reconsent else 'Carried over'
+        total = 0
+        for alias in shard_aliases():
+            after = None
+            while True:
+                count, after = policies.reconcile_chunk(
+                    policy.pk, after, options['chunk_size'], alias, legacy
+                )
+                total += count
+                if after is None:
+                    break
+        self.stdout.write(self.style.SUCCESS(f'{action} {total} consent records'))
@@ -0,0 +1,186 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from pathlib import Path
+import logging
+import re
+import shutil
+
+# Glyph ranges kept when subsetting text fonts: Latin, Latin-1, Latin Extended-A
+# (French and Turkish), general punctuation, currency and common symbols.
+TEXT_UNICODES = [
+    (0x0020, 0x007E), (0x00A0, 0x00FF), (0x0100, 0x017F), (0x0131, 0x0131),
+    (0x02C6, 0x02DC), (0x2000, 0x206F), (0x20AC, 0x20AC), (0x2122, 0x2122),
+    (0x2190, 0x2193), (0x2212, 0x2212), (0xFEFF, 0xFEFF), (0xFFFD, 0xFFFD),
+]
+
+PLEX_WEIGHTS = {
+    100: 'Thin', 200: 'ExtraLight', 300: 'Light', 400: 'Regular',
+    500: 'Medium', 600: 'SemiBold', 700: 'Bold',
+}
+
+# Font Awesome classes that are modifiers rather than icons
+FA_MODIFIERS = {
+    'fw', 'xs', 'sm', 'lg', 'xl', '2xs', '2xl', '1x', '2x', '3x', '4x', '5x', '6x', '7x',
+    '8x', '9x', '10x', 'spin', 'pulse', 'beat', 'fade', 'bounce', 'flip', 'shake',
+    'border', 'pull-left', 'pull-right', 'stack', 'stack-1x', 'stack-2x', 'inverse',
+    'rotate-90', 'rotate-180', 'rotate-270', 'flip-horizontal', 'flip-vertical', 'ul', 'li',
+    'solid', 'regular', 'brands', 'classic', 'sharp',
+}
+
+SOURCE_MAP = re.compile(r'\s*/[/*][#@]\s*sourceMappingURL=[^\s*]+(\s*\*/)?\s*$', re.M)
+ICON_RULE = re.compile(r'((?:\.fa-[a-z0-9-]+:before,?)+)\{content:"\\([0-9a-f]+)"\}')
+ICON_NAME = re.compile(r'\.fa-([a-z0-9-]+):before')
+WOFF2_SOURCE = re.compile(r'(url\([^)]+\.woff2\) format\("woff2"\)),url\([^)]+\.ttf\) format\("truetype"\)')
+ICON_CLASS = re.compile(r'\b(fa[bsr]?|fa-solid|fa-brands|fa-regular)\s+fa-([a-z0-9-]+)|\bfa-([a-z0-9-]+)')
+FONT_WEIGHT = re.compile(r'font-weight\s*:\s*(\d{3})')
+TEMPLATE_WEIGHTS = {'fw-light': 300, 'fw-normal': 400, 'fw-medium': 500, 'fw-semibold': 600, 'fw-bold': 700}
+
+class Command(BaseCommand):
+    help = (
+        'Vendor Bootstrap, and subset Font Awesome and IBM Plex Sans to the icons, '
+        'weights and scripts the templates actually use (requires fonttools)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bootstrap', metavar='DIR',
+                            help='Bootstrap dist directory containing css/ and js/')
+        parser.add_argument('--fontawesome', metavar='DIR',
+                            help='Font Awesome Free directory containing css/ and webfonts/')
+        parser.add_argument('--plex', metavar='DIR',
+                            help='Directory with IBM Plex Sans woff2/ttf files (IBMPlexSans-Regular.woff2, ...)')
+
+    def handle(self, *args, **options):
+        if not any(options[source] for source in ('bootstrap', 'fontawesome', 'plex')):
+            raise CommandError('Pass at least one of --bootstrap, --fontawesome or --plex')
+
+        app_dir = Path(apps.get_app_config('ethics_app').path)
+        self.vendor_dir = app_dir / 'static' / 'vendor'
+        self.sources = [
+            path for path in (app_dir / 'templates').rglob('*.html')
+        ] + [path for path in (app_dir / 'static' / 'js').glob('*.js')]
+        self.stylesheets = list((app_dir / 'static' / 'css').glob('*.css'))
+
+        if options['bootstrap']:
+            self._vendor_bootstrap(Path(options['bootstrap']))
+        if options['fontawesome']:
+            self._subset_fontawesome(Path(options['fontawesome']))
+        if options['plex']:
+            self._subset_plex(Path(options['plex']))
+
+    def _subset(self, source, target, unicodes):
+        try:
+            from fontTools import subset
+        except ImportError:
+            raise CommandError('Font subsetting requires fonttools and brotli: pip install fonttools brotli')
+        logging.getLogger('fontTools').setLevel(logging.ERROR)
+        font_options = subset.Options()
+        font_options.flavor = 'woff2'
+        font_options.layout_features = ['*']
+        font_options.name_IDs = ['*']
+        font = subset.load_font(str(source), font_options)
+        subsetter = subset.Subsetter(font_options)
+        subsetter.populate(unicodes=unicodes)
+        subsetter.subset(font)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        subset.save_font(font, str(target), font_options)
+        self.stdout.write(
+            f'  {target.relative_to(self.vendor_dir)}: {source.stat().st_size:,} -> {target.stat().st_size:,} bytes'
+        )
+
+    def _write(self, target, text):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(text, encoding='utf-8')
+        self.stdout.write(f'  {target.relative_to(self.vendor_dir)}: {target.stat().st_size:,} bytes')
+
+    def _vendor_bootstrap(self, source):
+        self.stdout.write(self.style.HTTP_INFO('Bootstrap'))
+        for name in ('css/bootstrap.min.css', 'js/bootstrap.bundle.min.js'):
+            text = (source / name).read_text(encoding='utf-8')
+            # Source maps are not shipped; drop the references so that
+            # ManifestStaticFilesStorage does not try to hash missing files.
+            self._write(self.vendor_dir / 'bootstrap' / name, SOURCE_MAP.sub('', text) + '\n')
+
+    def _used_icons(self):
+        """Return ({icon: style}, ...) for every fa-* class in templates and scripts."""
+        icons = {}
+        for path in self.sources:
+            for prefix, prefixed, bare in ICON_CLASS.findall(path.read_text(encoding='utf-8')):
+                name = prefixed or bare
+                if name in FA_MODIFIERS:
+                    continue
+                style = 'brands' if prefix in ('fab', 'fa-brands') else 'solid'
+                if icons.get(name) != 'brands':
+                    icons[name] = style
+        return icons
+
+    def _subset_fontawesome(self, source):
+        self.stdout.write(self.style.HTTP_INFO('Font Awesome'))
+        used = self._used_icons()
+        codepoints = {'solid': set(), 'brands': set()}
+        found = set()
+
+        def prune(match, style):
+            names = [name for name in ICON_NAME.findall(match.group(1)) if name in used]
+            if not names:
+                return ''
+            found.update(names)
+            codepoints['brands' if style == 'brands' else 'solid'].add(int(match.group(2), 16))
+            return ','.join(f'.fa-{name}:before' for name in names) + f'{{content:"\\{match.group(2)}"}}'
+
+        parts = []
+        header = ''
+        for style in ('fontawesome', 'solid', 'brands'):
+            css = (source / 'css' / f'{style}.min.css').read_text(encoding='utf-8')
+            header = css[:css.index('*/') + 2]
+            css = ICON_RULE.sub(lambda match: prune(match, style), css[len(header):])
+            # keep only the woff2 source; the subset fonts are woff2 only
+            parts.append(WOFF2_SOURCE.sub(r'\1', css).strip())
+
+        missing = sorted(set(used) - found)
+        if missing:
+            self.stdout.write(self.style.WARNING(f"  not Font Awesome icons, ignored: {', '.join(missing)}"))
+
+        for style, weight in (('solid', 900), ('brands', 400)):
+            font = f'fa-{style}-{weight}.woff2'
+            self._subset(source / 'webfonts' / font, self.vendor_dir / 'fontawesome' / 'webfonts' / font,
+                         sorted(codepoints[style]) or [0x20])
+
+        self._write(self.vendor_dir / 'fontawesome' / 'css' / 'icons.css', header + '\n' + ''.join(parts) + '\n')
+        self.stdout.write(f'  {len(found)} icons kept')
+
+    def _used_weights(self):
+        weights = {400}
+        for path in self.stylesheets:
+            weights.update(int(w) for w in FONT_WEIGHT.findall(path.read_text(encoding='utf-8')))
+        for path in self.sources:
+            text = path.read_text(encoding='utf-8')
+            weights.update(weight for cls, weight in TEMPLATE_WEIGHTS.items() if cls in text)
+        # Plex Sans stops at 700; heavier weights render with the Bold face
+        return sorted({min(weight, 700) for weight in weights if weight in PLEX_WEIGHTS or weight > 700})
+
+    def _subset_plex(self, source):
+        self.stdout.write(self.style.HTTP_INFO('IBM Plex Sans'))
+        unicodes = [cp for start, end in TEXT_UNICODES for cp in range(start, end + 1)]
+        faces = []
+        for weight in self._used_weights():
+            name = f'IBMPlexSans-{PLEX_WEIGHTS[weight]}'
+            font_file = next(
+                (source / f'{name}.{ext}' for ext in ('woff2', 'ttf', 'otf') if (source / f'{name}.{ext}').exists()),
+                None,
+            )
+            if font_file is None:
+                raise CommandError(f'{name}.woff2 not found in {source}')
+            self._subset(font_file, self.vendor_dir / 'ibm-plex' / f'{name}.woff2', unicodes)
+            faces.append(
+                '@font-face{font-family:"IBM Plex Sans";font-style:normal;'
+                f'font-weight:{weight};font-display:swap;'
+                f'src:url({name}.woff2) format("woff2")}}'
+            )
+        license_file = source / 'LICENSE.txt'
+        if license_file.exists():
+            shutil.copy(license_file, self.vendor_dir / 'ibm-plex' / 'LICENSE.txt')
+        self._write(
+            self.vendor_dir / 'ibm-plex' / 'ibm-plex-sans.css',
+            '/* IBM Plex Sans - SIL Open Font License 1.1 - subset to Latin and Latin Extended-A */\n'
+            + '\n'.join(faces) + '\n',
+        )
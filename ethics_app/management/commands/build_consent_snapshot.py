@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app import analytics
+from ethics_app.management.commands.seed_ethics_data import row_count
+import time
+
+class Command(BaseCommand):
+    help = 'Build and publish the columnar consent snapshot behind the analytics API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            help='Snapshot directory (default: CONSENT_SNAPSHOT_DIR)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50_000,
+            help='Consents read per batch (default: 50000)',
+        )
+        parser.add_argument(
+            '--synthetic',
+            type=row_count,
+            metavar='ROWS',
+            help='Publish ROWS random consents instead, e.g. 50m, to size a host',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for --synthetic (default: 0)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            if options['synthetic']:
+                columns = analytics.synthetic_columns(options['synthetic'], seed=options['seed'])
+                path, rows = analytics.write_snapshot(columns, options['dir']), options['synthetic']
+            else:
+                path, rows = analytics.build_snapshot(options['dir'], options['batch_size'])
+        except ImportError as e:
+            raise CommandError(str(e))
+        size = sum(f.stat().st_size for f in path.iterdir())
+        self.stdout.write(self.style.SUCCESS(
+            f'Published {rows:,} consents ({size / 1e6:.1f} MB) to {path} in {time.perf_counter() - start:.1f}s'
+        ))
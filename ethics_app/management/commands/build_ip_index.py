@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app.jurisdiction import load_index
+import time
+
+class Command(BaseCommand):
+    help = 'Compile an IP ranges CSV or .mmdb file into a binary index for GEOIP_RANGES_FILE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='CSV of start,end,country rows or a MaxMind .mmdb file')
+        parser.add_argument('output', help='Path of the .idx file to write')
+
+    def handle(self, *args, **options):
+        if not options['output'].endswith('.idx'):
+            raise CommandError('The output file name must end in .idx')
+
+        started = time.perf_counter()
+        try:
+            index = load_index(options['source'])
+        except (OSError, ImportError, ValueError) as e:
+            raise CommandError(str(e))
+        index.save(options['output'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(index):,} ranges for {len(index.countries)} countries to "
+            f"{options['output']} in {time.perf_counter() - started:.1f}s"
+        ))
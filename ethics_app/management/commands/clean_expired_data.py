@@ -1,13 +1,12 @@
-### 2. GDPR Compliance Command: ethics_app/management/commands/cleanup_expired_data.py
-
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from datetime import timedelta
-from ethics_app.models import ConsentRecord, DataSubjectRequest
+from ethics_app import dsar, retention
+from ethics_app.models import DataPackage
 from django.conf import settings
+import time
 
 class Command(BaseCommand):
-    help = 'Clean up expired consent records and old data subject requests'
+    help = 'Delete data past the retention period of the processing activities that use it'
     
     def add_arguments(self, parser):
         parser.add_argument(
@@ -19,51 +18,66 @@ class Command(BaseCommand):
             '--days',
             type=int,
             default=getattr(settings, 'DATA_RETENTION_DAYS', 365),
-            help='Number of days to retain data (default: 365)',
+            help='Retention for data subject requests when no activity covers them (default: 365)',
         )
-    
-    def handle(self, *args, **options):
-        cutoff_date = timezone.now() - timedelta(days=options['days'])
-        dry_run = options['dry_run']
-        
-        # Find expired consent records
-        expired_consents = ConsentRecord.objects.filter(
-            expiry_date__lt=timezone.now()
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows deleted per transaction (default: 1000)',
         )
-        
-        # Find old data subject requests (completed/rejected > retention period)
-        old_requests = DataSubjectRequest.objects.filter(
-            created_at__lt=cutoff_date,
-            status__in=['completed', 'rejected']
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Tables swept concurrently; one at a time per SQLite database (default: 4)',
         )
-        
-        if dry_run:
-            self.stdout.write(
-                self.style.WARNING(
-                    f'DRY RUN: Would delete {expired_consents.count()} '
-                    f'expired consent records'
-                )
-            )
-            self.stdout.write(
-                self.style.WARNING(
-                    f'DRY RUN: Would delete {old_requests.count()} '
-                    f'old data subject requests'
-                )
-            )
-        else:
-            deleted_consents = expired_consents.count()
-            deleted_requests = old_requests.count()
-            
-            expired_consents.delete()
-            old_requests.delete()
-            
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f'Successfully deleted {deleted_consents} expired consent records'
-                )
-            )
+        parser.add_argument(
+            '--explain',
+            action='store_true',
+            help='Print the database query plan for each deletion plan',
+        )
+    
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        now = timezone.now()
+        plans, unknown = retention.compile_plans(default_days=options['days'])
+        for category, activities in sorted(unknown.items()):
+            self.stdout.write(self.style.WARNING(
+                f"Unknown data category '{category}' (used by {', '.join(activities)}); "
+                f"known categories: {', '.join(retention.CATEGORIES)}"
+            ))
+
+        self.stdout.write(self.style.HTTP_INFO('Retention plans:'))
+        total = 0
+        for plan, estimate in retention.estimate_plans(plans, now, options['batch_size']):
+            total += estimate['rows']
+            index_note = '' if estimate['indexed'] else self.style.WARNING(' [no index on date column]')
             self.stdout.write(
-                self.style.SUCCESS(
-                    f'Successfully deleted {deleted_requests} old data subject requests'
-                )
+                f"  {plan.label}: older than {plan.days} days by {plan.date_field} -> "
+                f"{estimate['rows']} rows in {estimate['batches']} batches{index_note}"
             )
+            if plan.activities:
+                self.stdout.write(f"    activities: {', '.join(plan.activities)}")
+            if options['explain']:
+                for line in estimate['explain'].splitlines():
+                    self.stdout.write(f'    {line}')
+
+        if options['dry_run']:
+            packages = DataPackage.objects.filter(expires_at__lte=now).count()
+            self.stdout.write(self.style.WARNING(
+                f'DRY RUN: Would delete {total} rows and {packages} expired data packages'
+            ))
+            return
+
+        started = time.perf_counter()
+        results = retention.run_plans(plans, now, options['batch_size'], options['workers'])
+        for plan, deleted in results:
+            self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} {plan.label} rows'))
+        packages, files = dsar.purge(now)
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully deleted {packages} expired data packages and {files} package files'
+        ))
+        self.stdout.write(f'Finished in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,71 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app import compaction
+import time
+
+class Command(BaseCommand):
+    help = 'Fold anonymous consents whose session has ended into daily tallies, from the last watermark'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the orphaned consents without compacting them or moving the watermark',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Anonymous consents examined per transaction (default: 5000)',
+        )
+        parser.add_argument(
+            '--max-chunks',
+            type=int,
+            help='Stop after this many chunks; the next run resumes from the watermark',
+        )
+        parser.add_argument(
+            '--grace-hours',
+            type=int,
+            help='Leave consents younger than this alone (default: session age plus 24)',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Start again from the oldest anonymous consent',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        if options['reset']:
+            compaction.reset_watermark()
+            self.stdout.write('Watermark reset')
+
+        def progress(scanned, compacted, watermark):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {scanned:,} scanned, {compacted:,} orphaned, up to {watermark.timestamp}')
+
+        grace = timedelta(hours=options['grace_hours']) if options['grace_hours'] is not None else None
+        start = time.perf_counter()
+        result = compaction.compact_orphans(
+            chunk_size=options['chunk_size'],
+            max_chunks=options['max_chunks'],
+            grace=grace,
+            dry_run=options['dry_run'],
+            progress=progress,
+        )
+        elapsed = time.perf_counter() - start
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f'DRY RUN: {result.compacted:,} of {result.scanned:,} anonymous consents are orphaned'
+            ))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {result.compacted:,} of {result.scanned:,} anonymous consents '
+            f'({result.tallies:,} new tallies) in {elapsed:.1f}s'
+        ))
+        if result.reclaimed_bytes is not None:
+            self.stdout.write(f'Reclaimed about {result.reclaimed_bytes / 1024 / 1024:.1f} MiB')
+        self.stdout.write(f'Watermark: {result.watermark}')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app import identity
+
+class Command(BaseCommand):
+    help = "Erase a data subject's consents, sessions and user account (GDPR Article 17)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email address of the user or requester')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count what would be erased without deleting anything',
+        )
+
+    def handle(self, *args, **options):
+        subject = identity.resolve(email=options['email'])
+        if subject is None:
+            raise CommandError(f'No data held for {options["email"]}')
+
+        counts = identity.erase(subject, dry_run=options['dry_run'])
+        for kind, count in counts.items():
+            self.stdout.write(f'  {kind}: {count:,}')
+        if options['dry_run']:
+            self.stdout.write('Dry run; nothing was erased')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Erased subject {subject.pk}; its {subject.requests.count()} data subject requests are kept'
+            ))
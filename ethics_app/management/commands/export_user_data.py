@@ -1,28 +1,39 @@
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from ethics_app.models import ConsentRecord, DataSubjectRequest
+from django.utils import timezone
+from ethics_app import identity
+from ethics_app.replicas import on_replica, replica_reads
 import json
 
 class Command(BaseCommand):
     help = 'Export all data for a specific user (GDPR Article 20)'
     
     def add_arguments(self, parser):
-        parser.add_argument('email', type=str, help='User email address')
+        parser.add_argument('email', type=str, help='Email address of the user or requester')
         parser.add_argument(
             '--format',
             choices=['json', 'csv'],
             default='json',
             help='Export format',
         )
+        parser.add_argument(
+            '--primary',
+            action='store_true',
+            help='Read from the primary database instead of the read replica',
+        )
     
     def handle(self, *args, **options):
-        try:
-            user = User.objects.get(email=options['email'])
-        except User.DoesNotExist:
+        with replica_reads(not options['primary']):
+            self._export(options)
+
+    def _export(self, options):
+        # the account, requests and sessions known by this address (in any case)
+        subject = identity.resolve(email=options['email'])
+        if subject is None:
             self.stdout.write(
-                self.style.ERROR(f'User with email {options["email"]} not found')
+                self.style.ERROR(f'No data held for {options["email"]}')
             )
             return
+        user = subject.user
         
         # Collect user data
         user_data = {
@@ -33,14 +44,16 @@ class Command(BaseCommand):
                 'last_name': user.last_name,
                 'date_joined': user.date_joined.isoformat(),
                 'last_login': user.last_login.isoformat() if user.last_login else None,
-            },
-            'consent_records': list(
-                ConsentRecord.objects.filter(user=user).values(
+            } if user else None,
+            'consent_records': [
+                consent
+                for consents in identity.subject_consents(subject)
+                for consent in on_replica(consents).values(
                     'consent_type', 'consent_given', 'timestamp', 'legal_basis'
                 )
-            ),
+            ],
             'data_subject_requests': list(
-                DataSubjectRequest.objects.filter(email=user.email).values(
+                subject.requests.values(
                     'request_type', 'description', 'status', 'created_at'
                 )
             ),
@@ -1,17 +1,16 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from django.db.models import Count, Q
-from ethics_app.models import ConsentRecord, DataSubjectRequest, DataBreach
-import json
+from ethics_app.replicas import replica_reads
+from ethics_app.reporting import CSVReportWriter, JSONReportWriter, PrivacyReport
 from datetime import timedelta
 
 class Command(BaseCommand):
     help = 'Generate privacy compliance report'
-    
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--format',
-            choices=['json', 'text'],
+            choices=['json', 'csv', 'text'],
             default='text',
             help='Output format (default: text)',
         )
@@ -21,61 +20,111 @@ class Command(BaseCommand):
             default=30,
             help='Report period in days (default: 30)',
         )
-    
+        parser.add_argument(
+            '--output',
+            metavar='PATH',
+            help='Stream the report to PATH instead of stdout',
+        )
+        parser.add_argument(
+            '--no-series',
+            action='store_true',
+            help='Omit the per-day time series from json/csv output',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Split the period across this many processes (default: 1)',
+        )
+        parser.add_argument(
+            '--primary',
+            action='store_true',
+            help='Read from the primary database instead of the read replica',
+        )
+
     def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        with replica_reads(not options['primary']):
+            self._report(options)
+
+    def _report(self, options):
         end_date = timezone.now()
         start_date = end_date - timedelta(days=options['days'])
-        
-        # Consent statistics
-        consent_stats = ConsentRecord.objects.filter(
-            timestamp__gte=start_date
-        ).values('consent_type').annotate(
-            total=Count('id'),
-            granted=Count('id', filter=Q(consent_given=True))
-        )
-        
-        # Data subject requests
-        request_stats = DataSubjectRequest.objects.filter(
-            created_at__gte=start_date
-        ).values('request_type', 'status').annotate(count=Count('id'))
-        
-        # Data breaches
-        breach_count = DataBreach.objects.filter(
-            detection_date__gte=start_date
-        ).count()
-        
-        # Prepare report data
+        series = options['format'] != 'text' and not options['no_series']
+
+        report = PrivacyReport(start_date, end_date, series=series, workers=options['workers'])
+        summaries = report.summaries()
+
         report_data = {
             'report_period': {
                 'start_date': start_date.isoformat(),
                 'end_date': end_date.isoformat(),
                 'days': options['days']
             },
-            'consent_statistics': list(consent_stats),
-            'data_subject_requests': list(request_stats),
-            'data_breaches': breach_count,
-            'generated_at': timezone.now().isoformat()
+            'consent_statistics': summaries['consent_statistics'],
+            'data_subject_requests': summaries['data_subject_requests'],
+            'data_breaches': sum(row['count'] for row in summaries['breach_severity']),
+            'breach_severity': summaries['breach_severity'],
+            'consent_by_country': summaries['consent_by_country'],
         }
-        
-        if options['format'] == 'json':
-            self.stdout.write(json.dumps(report_data, indent=2))
-        else:
+
+        if options['format'] == 'text':
+            report_data['generated_at'] = timezone.now().isoformat()
             self._print_text_report(report_data)
-    
+            return
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                self._stream(f.write, options['format'], report_data, report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self._stream(lambda text: self.stdout.write(text, ending=''),
+                         options['format'], report_data, report)
+
+    def _stream(self, write, fmt, report_data, report):
+        writer = JSONReportWriter(write) if fmt == 'json' else CSVReportWriter(write)
+        for key, value in report_data.items():
+            if isinstance(value, list):
+                writer.rows(key, value)
+            else:
+                writer.value(key, value)
+        for name, rows in report.series():
+            writer.rows(name, rows)
+        writer.value('generated_at', timezone.now().isoformat())
+        writer.close()
+
     def _print_text_report(self, data):
         self.stdout.write(self.style.SUCCESS('=== PRIVACY COMPLIANCE REPORT ==='))
         self.stdout.write(f"Period: {data['report_period']['start_date']} to {data['report_period']['end_date']}")
         self.stdout.write('')
-        
+
         self.stdout.write(self.style.HTTP_INFO('Consent Statistics:'))
         for stat in data['consent_statistics']:
             consent_rate = (stat['granted'] / stat['total'] * 100) if stat['total'] > 0 else 0
             self.stdout.write(f"  {stat['consent_type']}: {stat['granted']}/{stat['total']} ({consent_rate:.1f}%)")
-        
+
         self.stdout.write('')
         self.stdout.write(self.style.HTTP_INFO('Data Subject Requests:'))
         for req in data['data_subject_requests']:
             self.stdout.write(f"  {req['request_type']} ({req['status']}): {req['count']}")
-        
+
         self.stdout.write('')
         self.stdout.write(self.style.HTTP_INFO(f"Data Breaches: {data['data_breaches']}"))
+        for breach in data['breach_severity']:
+            self.stdout.write(
+                f"  {breach['severity']} {breach['breach_type']}: {breach['count']} "
+                f"({breach['affected_records'] or 0} affected records)"
+            )
+
+        countries = {}
+        for row in data['consent_by_country']:
+            totals = countries.setdefault(row['country'] or '??', [0, 0])
+            totals[0] += row['granted']
+            totals[1] += row['total']
+        if countries:
+            self.stdout.write('')
+            self.stdout.write(self.style.HTTP_INFO('Consent by Country:'))
+            for country, (granted, total) in sorted(countries.items(), key=lambda item: -item[1][1]):
+                self.stdout.write(f"  {country}: {granted}/{total} ({granted / total * 100:.1f}%)")
@@ -0,0 +1,137 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from ethics_app import benchmarks, loadtest
+import json
+
+class Command(BaseCommand):
+    help = 'Replay a realistic visitor mix against the portal in-process and report capacity'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            default='1,4,16,64',
+            help='Comma-separated virtual visitor counts to step through (default: 1,4,16,64)',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10.0,
+            help='Seconds to run at each concurrency level (default: 10)',
+        )
+        parser.add_argument(
+            '--think-time',
+            type=float,
+            default=0.0,
+            help='Mean pause between a visitor\'s requests in seconds (default: 0, closed loop)',
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            metavar='SCENARIO',
+            help='Restrict the mix to these scenarios',
+        )
+        parser.add_argument(
+            '--scale',
+            choices=list(benchmarks.SCALES),
+            help='Seed the scratch database with this many consent records first',
+        )
+        parser.add_argument(
+            '--db-file',
+            metavar='PATH',
+            help='SQLite file for the scratch database (default: in-memory)',
+        )
+        parser.add_argument(
+            '--abusers',
+            type=int,
+            default=0,
+            help='Clients hammering the consent API from one address alongside the visitors (default: 0)',
+        )
+        parser.add_argument(
+            '--no-rate-limit',
+            action='store_true',
+            help='Run without RATE_LIMITS, to compare against the protected portal',
+        )
+        parser.add_argument('--json', metavar='PATH', help='Write the results to PATH')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma-separated list of integers')
+
+        scenarios = loadtest.SCENARIOS
+        if options['only']:
+            scenarios = [s for s in scenarios if s[0] in options['only']]
+            if not scenarios:
+                raise CommandError('No matching scenarios')
+
+        if options['abusers'] < 0:
+            raise CommandError('--abusers must not be negative')
+
+        runner = loadtest.LoadTest(scenarios, think_time=options['think_time'], abusers=options['abusers'])
+        overrides = {'PROFILER_ENABLED': True, 'PROFILER_SAMPLE_RATE': 1.0}
+        if options['no_rate_limit']:
+            overrides['RATE_LIMITS'] = {}
+        results = []
+        with benchmarks.scratch_database(options['db_file']):
+            if options['scale']:
+                benchmarks.seed_dataset(benchmarks.SCALES[options['scale']], stdout=self.stdout)
+            with override_settings(**overrides):
+                for level in levels:
+                    self.stdout.write(f'Running {level} visitors for {options["duration"]:.0f}s...')
+                    result = runner.run(level, options['duration'])
+                    results.append(result)
+                    self._print_result(result)
+
+        self._print_summary(results)
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['json']}"))
+
+    def _print_result(self, result):
+        latency = result['latency']
+        self.stdout.write(
+            f"  {result['throughput_rps']:.1f} req/s, "
+            f"{result['decisions_per_s']:.1f} consent decisions/s, "
+            f"p50 {latency['p50_ms']:.1f}ms p95 {latency['p95_ms']:.1f}ms "
+            f"p99 {latency['p99_ms']:.1f}ms, errors {result['errors']}"
+        )
+        if result['abusive_requests']:
+            visitors = result['visitor_latency']
+            self.stdout.write(
+                f"    abusive: {result['abusive_requests']} requests, {result['abusive_throttled']} throttled, "
+                f"{result['abusive_served_per_s']:.1f}/s served; visitors p50 {visitors['p50_ms']:.1f}ms "
+                f"p95 {visitors['p95_ms']:.1f}ms, {result['visitors_throttled']} throttled"
+            )
+        elif result['visitors_throttled']:
+            self.stdout.write(f"    {result['visitors_throttled']} visitor requests throttled")
+        for name, stats in result['scenarios'].items():
+            self.stdout.write(
+                f"    {name:<22} n={stats['count']:<6} p50 {stats['p50_ms']:.1f}ms "
+                f"p95 {stats['p95_ms']:.1f}ms p99 {stats['p99_ms']:.1f}ms"
+            )
+        shares = ', '.join(
+            f"{name[:-3]} {component['share'] * 100:.0f}%"
+            for name, component in result['components'].items()
+        )
+        self.stdout.write(f'    time spent: {shares}')
+
+    def _print_summary(self, results):
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS('=== LOAD TEST SUMMARY ==='))
+        peak = max(results, key=lambda result: result['decisions_per_s'])
+        self.stdout.write(
+            f"Peak: {peak['decisions_per_s']:.1f} consent decisions/s "
+            f"({peak['throughput_rps']:.1f} req/s) at {peak['concurrency']} visitors"
+        )
+        knee = loadtest.find_saturation(results)
+        if knee is None:
+            self.stdout.write('Throughput was still scaling at the highest concurrency tested')
+        else:
+            self.stdout.write(
+                f"Throughput stops scaling beyond {knee['concurrency']} visitors "
+                f"(~{knee['throughput_rps']:.1f} req/s)"
+            )
+        self.stdout.write(self.style.WARNING(f"Saturating component: {results[-1]['bottleneck']}"))
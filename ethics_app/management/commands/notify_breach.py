@@ -0,0 +1,112 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ethics_app import breach as engine
+from ethics_app.models import DataBreach
+import json
+import time
+
+class Command(BaseCommand):
+    help = 'Resolve the subjects affected by a data breach and notify them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('breach_id', type=int)
+        parser.add_argument(
+            '--users',
+            metavar='JSON',
+            help='Add every user matching these User lookups, e.g. \'{"date_joined__lt": "2024-01-01"}\' or \'{}\' for all',
+        )
+        parser.add_argument(
+            '--subjects-file',
+            metavar='PATH',
+            help='Add subjects from a CSV with user_id/email[/name/language] columns, or one ID or email per line',
+        )
+        parser.add_argument(
+            '--dispatch',
+            action='store_true',
+            help='Queue the pending subjects as Celery chunk tasks',
+        )
+        parser.add_argument(
+            '--send',
+            action='store_true',
+            help='Send the pending notifications in this process',
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Clear recorded send errors so failed subjects are sent again',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Subjects per chunk / mail connection (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            breach = DataBreach.objects.get(id=options['breach_id'])
+        except DataBreach.DoesNotExist:
+            raise CommandError(f"Data breach {options['breach_id']} not found")
+
+        if options['users'] is not None:
+            try:
+                users = User.objects.filter(**json.loads(options['users']))
+            except (ValueError, TypeError, FieldError) as e:
+                raise CommandError(f'Invalid --users filter: {e}')
+            added = engine.add_subjects(breach, engine.subjects_from_users(users))
+            self.stdout.write(self.style.SUCCESS(f'Added {added} subjects from users'))
+
+        if options['subjects_file']:
+            try:
+                added = engine.add_subjects(breach, engine.subjects_from_file(options['subjects_file']))
+            except OSError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Added {added} subjects from {options['subjects_file']}"))
+
+        if options['retry_failed']:
+            cleared = engine.retry_failed(breach.id)
+            self.stdout.write(f'{cleared} failed subjects will be retried')
+
+        if options['dispatch']:
+            from ethics_app.tasks import notify_breach_subjects
+            notify_breach_subjects.delay(breach.id, options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS('Queued notification dispatch'))
+        elif options['send']:
+            self._send(breach, options['chunk_size'])
+
+        self._print_progress(breach)
+
+    def _send(self, breach, chunk_size):
+        engine.start_notification(breach.id)
+        started = time.perf_counter()
+        total_sent = total_failed = 0
+        for first_id, last_id in engine.plan_chunks(breach.id, chunk_size):
+            sent, failed = engine.send_chunk(breach.id, first_id, last_id)
+            total_sent += sent
+            total_failed += failed
+            rate = total_sent / (time.perf_counter() - started)
+            self.stdout.write(f'  sent {total_sent} ({total_failed} failed), {rate:.0f}/s')
+        engine.complete_if_done(breach.id)
+
+    def _print_progress(self, breach):
+        progress = engine.progress(breach)
+        self.stdout.write('')
+        self.stdout.write(self.style.HTTP_INFO(f'Breach {breach.id} notification status:'))
+        self.stdout.write(
+            f"  {progress['notified']}/{progress['total']} notified, "
+            f"{progress['failed']} failed, {progress['remaining']} remaining"
+        )
+        if progress['per_second']:
+            self.stdout.write(f"  throughput: {progress['per_second']:.1f} messages/s")
+        if progress['eta']:
+            self.stdout.write(f"  ETA: {timezone.localtime(progress['eta']):%Y-%m-%d %H:%M}")
+        if progress['completed_at']:
+            self.stdout.write(f"  completed: {timezone.localtime(progress['completed_at']):%Y-%m-%d %H:%M}")
+
+        deadline = f"{timezone.localtime(progress['deadline']):%Y-%m-%d %H:%M}"
+        if progress['on_track']:
+            self.stdout.write(self.style.SUCCESS(f'  72-hour deadline: {deadline}'))
+        else:
+            self.stdout.write(self.style.ERROR(f'  72-hour deadline: {deadline} (will be missed at this rate)'))
@@ -3,7 +3,8 @@ from django.utils import timezone
 from django.core.mail import send_mail
 from django.conf import settings
 from datetime import timedelta
-from ethics_app.models import ConsentRecord
+from django.contrib.auth.models import User
+from ethics_app.sharding import consents_on, fan_out
 
 class Command(BaseCommand):
     help = 'Notify users about expiring consent'
@@ -19,13 +20,23 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         notification_date = timezone.now() + timedelta(days=options['days_ahead'])
         
-        expiring_consents = ConsentRecord.objects.filter(
-            expiry_date__date=notification_date.date(),
-            user__isnull=False,
-            consent_given=True
-        ).select_related('user')
+        # Consents may live on shards apart from the users, so users are
+        # fetched separately rather than joined
+        expiring_consents = [
+            consent
+            for shard_consents in fan_out(lambda alias: list(consents_on(alias).filter(
+                expiry_date__date=notification_date.date(),
+                user__isnull=False,
+                consent_given=True
+            )))
+            for consent in shard_consents
+        ]
+        users = User.objects.in_bulk({consent.user_id for consent in expiring_consents})
         
         for consent in expiring_consents:
+            consent.user = users.get(consent.user_id)
+            if consent.user is None:
+                continue
             try:
                 send_mail(
                     subject='Your Privacy Preferences Are Expiring',
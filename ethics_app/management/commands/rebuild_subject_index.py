@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app import identity
+from ethics_app.models import Subject, SubjectIdentifier
+import time
+
+class Command(BaseCommand):
+    help = 'Index the users and data subject requests missing from the subject identity index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10_000,
+            help='Users or requests indexed per transaction (default: 10000)',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Drop the index and build it again, e.g. after SECRET_KEY changed (linked sessions are lost)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['reset']:
+            SubjectIdentifier.objects.all().delete()
+            Subject.objects.all().delete()
+            identity.subject_cache.invalidate()
+            self.stdout.write('Subject index cleared')
+
+        def progress(users, requests):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {users:,} users, {requests:,} requests indexed')
+
+        start = time.perf_counter()
+        users, requests = identity.rebuild(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {users:,} users and {requests:,} requests in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, DEFAULT_DB_ALIAS
+from ethics_app import search
+import time
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over data subject requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10_000,
+            help='Requests indexed per transaction (default: 10000)',
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Verify the index against the request table instead of rebuilding it',
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database holding the requests (default: default)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        backend = search.backend_for(options['database'])
+
+        if options['check']:
+            try:
+                backend.check()
+            except DatabaseError as e:
+                raise CommandError(f'The {backend.name} index is out of step, run reindex_requests: {e}')
+            self.stdout.write(self.style.SUCCESS(f'The {backend.name} index is consistent'))
+            return
+
+        def progress(done):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {done:,} indexed')
+
+        start = time.perf_counter()
+        count = backend.reindex(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count:,} requests with {backend.name} in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ethics_app import outbox
+from ethics_app.sharding import shard_aliases
+import time
+
+class Command(BaseCommand):
+    help = 'Relay consent change events to the outbox sink in the foreground, without Celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Relay what is waiting on every shard and exit',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when every outbox is empty (default: 1)',
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Show the events waiting on each shard and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for alias in shard_aliases():
+                count, oldest = outbox.backlog(alias)
+                age = f', oldest {(timezone.now() - oldest).total_seconds():.1f}s old' if oldest else ''
+                self.stdout.write(f'  {alias}: {count:,} events{age}')
+            return
+
+        sink = outbox.get_sink()
+        while True:
+            published, wait = 0, options['interval']
+            for alias in shard_aliases():
+                try:
+                    count = outbox.relay(alias, sink)
+                except outbox.Backpressure as e:
+                    self.stdout.write(self.style.WARNING(f'  {alias}: held back for {e.retry_after:.0f}s: {e}'))
+                    wait = max(wait, e.retry_after)
+                    continue
+                except Exception as e:
+                    if options['once']:
+                        raise
+                    self.stdout.write(self.style.ERROR(f'  {alias}: {type(e).__name__}: {e}'))
+                    wait = max(wait, 5.0)
+                    continue
+                if count:
+                    self.stdout.write(f'  {alias}: {count:,} events relayed')
+                published += count
+            if options['once']:
+                self.stdout.write(self.style.SUCCESS(f'Relayed {published:,} events'))
+                return
+            if not published or wait > options['interval']:
+                time.sleep(wait)
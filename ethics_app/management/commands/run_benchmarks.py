@@ -0,0 +1,135 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from ethics_app import benchmarks
+import json
+import time
+
+class Command(BaseCommand):
+    help = 'Benchmark the ethics_app hot paths against a freshly seeded scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            choices=list(benchmarks.SCALES),
+            default='10k',
+            help='Number of consent records to seed (default: 10k)',
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=5,
+            help='Timed rounds per benchmark (default: 5)',
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            metavar='NAME',
+            help='Run only the named benchmarks',
+        )
+        parser.add_argument(
+            '--json',
+            metavar='PATH',
+            help='Write the pytest-benchmark compatible report to PATH',
+        )
+        parser.add_argument(
+            '--compare',
+            metavar='PATH',
+            help='Compare mean timings against a stored baseline report',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=10.0,
+            help='Fail when a mean regresses by more than this percentage (default: 10)',
+        )
+        parser.add_argument(
+            '--db-file',
+            metavar='PATH',
+            help='SQLite file for the scratch database (default: in-memory)',
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Reuse an already seeded scratch database from --db-file',
+        )
+
+    def handle(self, *args, **options):
+        if options['keepdb'] and not options['db_file']:
+            raise CommandError('--keepdb requires --db-file')
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        # the consent cases post far faster than RATE_LIMITS lets a client
+        with benchmarks.scratch_database(options['db_file'], options['keepdb']), override_settings(RATE_LIMITS={}):
+            report = self._run(options)
+
+        self._print_table(report)
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote report to {options['json']}"))
+
+        if baseline is not None:
+            self._print_comparison(report, baseline, options['threshold'])
+
+    def _run(self, options):
+        rows = benchmarks.SCALES[options['scale']]
+        from ethics_app.sharding import consents_on, fan_out
+
+        existing = sum(fan_out(lambda alias: consents_on(alias).count())) if options['keepdb'] else 0
+        if existing:
+            self.stdout.write('Reusing seeded scratch database')
+            seeded = {'consent_records': existing}
+        else:
+            start = time.perf_counter()
+            seeded = benchmarks.seed_dataset(rows, stdout=self.stdout)
+            self.stdout.write(f'Seeding took {time.perf_counter() - start:.1f}s')
+
+        cases = benchmarks.build_benchmarks(rows)
+        if options['only']:
+            unknown = set(options['only']) - {case.name for case in cases}
+            if unknown:
+                raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+            cases = [case for case in cases if case.name in options['only']]
+
+        return benchmarks.run_benchmarks(
+            cases, options['rounds'], extra_info={'scale': options['scale'], 'seeded': seeded}
+        )
+
+    def _print_table(self, report):
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS('=== BENCHMARK RESULTS (times in ms) ==='))
+        header = f"{'Name':<30}{'Min':>10}{'Max':>10}{'Mean':>10}{'StdDev':>10}{'Median':>10}{'OPS':>12}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for bench in report['benchmarks']:
+            stats = bench['stats']
+            self.stdout.write(
+                f"{bench['name']:<30}"
+                f"{stats['min'] * 1000:>10.3f}{stats['max'] * 1000:>10.3f}"
+                f"{stats['mean'] * 1000:>10.3f}{stats['stddev'] * 1000:>10.3f}"
+                f"{stats['median'] * 1000:>10.3f}{stats['ops']:>12.1f}"
+            )
+
+    def _print_comparison(self, report, baseline, threshold):
+        self.stdout.write('')
+        self.stdout.write(self.style.HTTP_INFO('Comparison with baseline (mean):'))
+        regressions = []
+        for name, old, new, change, regressed in benchmarks.compare_to_baseline(
+            report, baseline, threshold
+        ):
+            line = f'  {name}: {old * 1000:.3f}ms -> {new * 1000:.3f}ms ({change:+.1f}%)'
+            if regressed:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} benchmark(s) regressed by more than {threshold}%: "
+                f"{', '.join(regressions)}"
+            )
@@ -0,0 +1,128 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.db import connections
+from ethics_app import identity
+from ethics_app.models import (
+    BreachSubject, ConsentRecord, DataBreach, DataPackage, DataSubjectRequest, Subject, SubjectIdentifier,
+)
+from ethics_app.sharding import is_sharded, shard_aliases
+from ethics_app.seeding import Seeder
+import os
+import time
+
+def row_count(value):
+    """Parse counts such as 50000, 10k, 1.5m or 10M."""
+    multipliers = {'k': 1_000, 'm': 1_000_000}
+    value = value.strip().lower()
+    try:
+        if value and value[-1] in multipliers:
+            return int(float(value[:-1]) * multipliers[value[-1]])
+        return int(value)
+    except ValueError:
+        raise CommandError(f'Invalid row count: {value}')
+
+class Command(BaseCommand):
+    help = 'Seed synthetic users, sessions, consents, requests and breaches for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consents',
+            type=row_count,
+            default=row_count('100k'),
+            help='Number of consent records to generate, e.g. 500k or 10m (default: 100k)',
+        )
+        parser.add_argument('--users', type=row_count, help='Users (default: one per 10 subjects)')
+        parser.add_argument('--requests', type=row_count, help='Data subject requests (default: 1%% of consents)')
+        parser.add_argument('--breaches', type=row_count, help='Data breaches (default: 1 per 100k consents)')
+        parser.add_argument(
+            '--no-sessions',
+            action='store_true',
+            help='Do not create django_session rows for anonymous consents',
+        )
+        parser.add_argument(
+            '--history-days',
+            type=int,
+            default=730,
+            help='Spread timestamps over this many days, skewed to recent (default: 730)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Processes generating shards in parallel (default: 1, 0 for one per CPU)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10_000,
+            help='Rows per INSERT batch (default: 10000)',
+        )
+        parser.add_argument(
+            '--shard-size',
+            type=int,
+            default=50_000,
+            help='Subjects/rows generated per shard (default: 50000)',
+        )
+        parser.add_argument(
+            '--fast',
+            action='store_true',
+            help='SQLite only: raw executemany with synchronous=OFF and in-memory journal',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete existing ethics_app data, sessions and seeded users first',
+        )
+        parser.add_argument('--database', default='default', help='Database alias (default: default)')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['fast'] and connections[using].vendor != 'sqlite':
+            self.stdout.write(self.style.WARNING('--fast only applies to SQLite; using bulk_create'))
+
+        if options['clear']:
+            self._clear(using)
+
+        workers = options['workers'] or os.cpu_count()
+        seeder = Seeder(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            shard_size=options['shard_size'],
+            workers=workers,
+            fast=options['fast'],
+            history_days=options['history_days'],
+            using=using,
+            stdout=self.stdout,
+        )
+
+        start = time.perf_counter()
+        counts = seeder.run(
+            options['consents'],
+            users=options['users'],
+            requests=options['requests'],
+            breaches=options['breaches'],
+            sessions=not options['no_sessions'],
+        )
+        elapsed = time.perf_counter() - start
+        total = sum(counts.values())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {total} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)'
+        ))
+        for label, count in counts.items():
+            self.stdout.write(f'  {label}: {count}')
+
+    def _clear(self, using):
+        for alias in shard_aliases() if is_sharded() else [using]:
+            ConsentRecord.objects.using(alias).all()._raw_delete(alias)
+        # rows referring to requests and breaches go first: raw deletes skip the collector
+        for model in (DataPackage, BreachSubject, DataSubjectRequest, DataBreach, Session):
+            model.objects.using(using).all()._raw_delete(using)
+        User.objects.using(using).filter(username__startswith='seed_').delete()
+        # the subject index: cleared sessions, and subjects left with no account or request
+        SubjectIdentifier.objects.using(using).filter(kind='session')._raw_delete(using)
+        Subject.objects.using(using).filter(user__isnull=True).delete()
+        identity.subject_cache.invalidate()
+        self.stdout.write(self.style.WARNING('Cleared existing data'))
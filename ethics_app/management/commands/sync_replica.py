@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app import replicas
+import time
+
+class Command(BaseCommand):
+    help = 'Refresh the SQLite read replicas with a snapshot of their primary databases'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'databases',
+            nargs='*',
+            metavar='ALIAS',
+            help='Primary database aliases to copy (default: all with a replica)',
+        )
+
+    def handle(self, *args, **options):
+        configured = replicas.replicas()
+        if not configured:
+            raise CommandError('No read replicas configured; set READ_REPLICA_DIR')
+        unknown = set(options['databases']) - set(configured)
+        if unknown:
+            raise CommandError(f"No replica for: {', '.join(sorted(unknown))}")
+
+        start = time.perf_counter()
+        try:
+            synced = replicas.sync_replicas(options['databases'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        for alias in synced:
+            self.stdout.write(f'  {alias} -> {configured[alias]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {len(synced)} replicas in {time.perf_counter() - start:.1f}s'
+        ))
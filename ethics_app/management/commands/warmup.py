@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand, CommandError
+from ethics_app import warmup
+import json
+
+class Command(BaseCommand):
+    help = 'Warm up this process as a worker would before forking, or profile its import time'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--steps',
+            nargs='+',
+            choices=list(warmup.STEPS),
+            metavar='STEP',
+            help=f"Run only these warm-up steps ({', '.join(warmup.STEPS)})",
+        )
+        parser.add_argument(
+            '--importtime',
+            action='store_true',
+            help='Profile the imports of a fresh worker with -X importtime instead',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=25,
+            help='Modules and packages listed in the import profile (default: 25)',
+        )
+        parser.add_argument('--json', metavar='PATH', help='Write the import profile to PATH')
+        parser.add_argument(
+            '--compare',
+            metavar='PATH',
+            help='Compare the import profile against a stored one',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=10.0,
+            help='Fail when the total or a package regresses by more than this percentage (default: 10)',
+        )
+
+    def handle(self, *args, **options):
+        if not options['importtime']:
+            if options['json'] or options['compare']:
+                raise CommandError('--json and --compare apply to --importtime')
+            self._warm_up(options['steps'])
+            return
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        try:
+            profile = warmup.import_profile()
+        except RuntimeError as e:
+            raise CommandError(f'The worker imports failed: {e}')
+        self._print_profile(profile, options['top'])
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(profile, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote import profile to {options['json']}"))
+
+        if baseline is not None:
+            self._print_comparison(profile, baseline, options['threshold'])
+
+    def _warm_up(self, steps):
+        failed = []
+        total = 0.0
+        for name, seconds, error in warmup.warm_up(steps):
+            total += seconds
+            line = f'  {name:<14}{seconds * 1000:>9.1f}ms'
+            if error:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'{line}  {error}'))
+            else:
+                self.stdout.write(line)
+        if failed:
+            raise CommandError(f"Warm-up steps failed: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS(f'Warmed up in {total * 1000:.1f}ms'))
+
+    def _print_profile(self, profile, top):
+        self.stdout.write(self.style.SUCCESS(
+            f"=== IMPORT TIME: {profile['total_ms']:.1f}ms over {len(profile['modules'])} modules ==="
+        ))
+        self.stdout.write(f"{'Module':<50}{'Self':>10}{'Cumulative':>12}")
+        for row in profile['modules'][:top]:
+            self.stdout.write(f"{row['module']:<50}{row['self_ms']:>8.1f}ms{row['cumulative_ms']:>10.1f}ms")
+        self.stdout.write('')
+        self.stdout.write(f"{'Package':<30}{'Modules':>10}{'Self':>12}{'Share':>8}")
+        for row in profile['packages'][:top]:
+            share = row['self_ms'] / profile['total_ms'] * 100 if profile['total_ms'] else 0.0
+            self.stdout.write(f"{row['package']:<30}{row['modules']:>10}{row['self_ms']:>10.1f}ms{share:>7.1f}%")
+
+    def _print_comparison(self, profile, baseline, threshold):
+        self.stdout.write('')
+        self.stdout.write(self.style.HTTP_INFO('Comparison with baseline (self time):'))
+        regressions = []
+        for name, old, new, change, regressed in warmup.compare_profiles(profile, baseline, threshold):
+            line = f'  {name}: {old:.1f}ms -> {new:.1f}ms ({change:+.1f}%)'
+            if regressed:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} import time(s) regressed by more than {threshold}%: "
+                f"{', '.join(regressions)}"
+            )
@@ -1,10 +1,33 @@
+import heapq
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from importlib import import_module
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
+from django.http import JsonResponse
+from django.utils.functional import SimpleLazyObject
 from django.shortcuts import redirect
 from django.urls import reverse
-from .models import ConsentRecord
+from . import jurisdiction
+from .policies import current_policies
+from .ratelimit import Limit, client_label, rate_limit_stats
+from .replicas import PIN_COOKIE, caught_up, on_replica, replica_reads, replicas
+from .sharding import subject_consents
 
 class ConsentMiddleware(MiddlewareMixin):
     def process_request(self, request):
+        # Country and consent regime of the client, resolved on first access
+        request.jurisdiction = SimpleLazyObject(lambda: jurisdiction.for_request(request))
+
         # Skip consent check for admin and consent pages
         exempt_paths = [
             '/admin/',
@@ -17,21 +40,24 @@ class ConsentMiddleware(MiddlewareMixin):
         if any(request.path.startswith(path) for path in exempt_paths):
             return None
 
-        # Check if user has given essential consent
-        has_consent = False
-
+        # Check if user has given essential consent under the current policy
+        consents = None
         if request.user.is_authenticated:
-            has_consent = ConsentRecord.objects.filter(
-                user=request.user,
-                consent_type='functional',
-                consent_given=True
-            ).exists()
+            consents = subject_consents(user=request.user)
         elif request.session.session_key:
-            has_consent = ConsentRecord.objects.filter(
-                session_key=request.session.session_key,
-                consent_type='functional',
-                consent_given=True
-            ).exists()
+            consents = subject_consents(session_key=request.session.session_key)
+
+        has_consent = False
+        if consents is not None:
+            # the latest decision counts when a subject has given several
+            given = list(
+                on_replica(consents.filter(consent_type='functional', consent_given=True))
+                .order_by('-timestamp').values_list('policy_id', flat=True)[:1]
+            )
+            if given:
+                has_consent = current_policies.is_current(given[0])
+                # Given under a superseded policy version: ask again
+                request.consent_stale = not has_consent
 
         # Redirect to consent page if no essential consent
         if not has_consent and request.path != reverse('consent_management'):  # Changed this line
@@ -40,3 +66,207 @@ class ConsentMiddleware(MiddlewareMixin):
             request.needs_consent = True
 
         return None
+
+
+# what SessionBase._get_new_session_key() makes
+SESSION_KEY = re.compile(r'[a-z0-9]{32}')
+
+
+class RateLimitMiddleware:
+    """
+    Turn away clients over the ``RATE_LIMITS`` of a path with a 429 before
+    anything else runs. Removed from the chain when no limits are set.
+    """
+
+    def __init__(self, get_response):
+        limits = getattr(settings, 'RATE_LIMITS', None)
+        if not limits:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self._session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        self._sessions = OrderedDict()  # session keys known to exist, LRU
+        self._sessions_lock = threading.Lock()
+        self._max_sessions = getattr(settings, 'RATE_LIMIT_MAX_KEYS', 100_000)
+        self.rules = {}
+        for path, scopes in limits.items():
+            rule = (path, [Limit(path, scope, rate, burst) for scope, (rate, burst) in scopes.items()])
+            # Matched before LocaleMiddleware, so under every language prefix too
+            self.rules[path] = rule
+            for code, _ in settings.LANGUAGES:
+                self.rules[f'/{code}{path}'] = rule
+
+    def _key(self, request, scope):
+        if scope == 'ip':
+            return jurisdiction.trusted_client_ip(request)
+        if scope == 'session':
+            # A client without a real session shares its address's bucket,
+            # so dropping or inventing cookies buys no fresh ones
+            cookie = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+            if self._known_session(cookie):
+                return cookie
+            return f'ip:{jurisdiction.trusted_client_ip(request)}'
+        raise ValueError(f'Unknown rate limit scope: {scope}')
+
+    def _known_session(self, cookie):
+        """Whether ``cookie`` names a stored session; each one is looked up once per process."""
+        if not SESSION_KEY.fullmatch(cookie):
+            return False
+        with self._sessions_lock:
+            if cookie in self._sessions:
+                self._sessions.move_to_end(cookie)
+                return True
+        if not self._session_store().exists(cookie):
+            return False
+        with self._sessions_lock:
+            self._sessions[cookie] = None
+            if len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+        return True
+
+    def __call__(self, request):
+        rule = self.rules.get(request.path_info)
+        if rule is None:
+            return self.get_response(request)
+        path, limits = rule
+        for limit in limits:
+            key = self._key(request, limit.scope)
+            if not key:
+                continue
+            throttled = limit.take(key)
+            if throttled:
+                tier, retry_after = throttled
+                rate_limit_stats.throttled(path, limit.scope, tier, client_label(limit.scope, key))
+                response = JsonResponse({'status': 'error', 'message': 'Too many requests'}, status=429)
+                response['Retry-After'] = str(max(math.ceil(retry_after), 1))
+                # counted in rate_limit_stats; a warning per rejected request would flood the log
+                response._has_been_logged = True
+                return response
+        rate_limit_stats.allowed(path)
+        return self.get_response(request)
+
+
+class ReplicaMiddleware:
+    """
+    Serve safe requests from the read replicas unless the client wrote
+    something the replicas do not hold yet, and pin the client to the
+    primary after every write. Removed from the chain without replicas.
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 120)
+
+    def __call__(self, request):
+        if request.method not in self.SAFE_METHODS:
+            written = time.time()
+            response = self.get_response(request)
+            response.set_cookie(PIN_COOKIE, f'{written:.3f}', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+            return response
+        with replica_reads(not self.pinned(request)):
+            return self.get_response(request)
+
+    @staticmethod
+    def pinned(request):
+        """Whether the client wrote something the replicas have not been synced past yet."""
+        written = request.COOKIES.get(PIN_COOKIE)
+        if written is None:
+            return False
+        try:
+            return not caught_up(float(written))
+        except ValueError:
+            return True
+
+
+class SlowRequestLog:
+    """Keep the N slowest sampled requests in a bounded min-heap."""
+
+    def __init__(self, size):
+        self.size = size
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._counter += 1
+            entry = (profile['total_ms'], self._counter, profile)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, entry)
+            elif entry[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def entries(self):
+        with self._lock:
+            return [entry[2] for entry in sorted(self._heap, reverse=True)]
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+
+slow_request_log = SlowRequestLog(getattr(settings, 'PROFILER_TOP_N', 50))
+
+
+class QueryProfilerMiddleware:
+    """
+    Record SQL count/time, template render time and total latency for a
+    sampled fraction of requests. Removed from the chain when disabled.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0.1)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = {'sql_count': 0, 'sql_ms': 0.0, 'template_ms': 0.0}
+        request._profile = profile
+
+        def record_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                profile['sql_count'] += 1
+                profile['sql_ms'] += (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record_query))
+            response = self.get_response(request)
+
+        profile.update({
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': (time.perf_counter() - start) * 1000,
+            'timestamp': timezone.now().isoformat(),
+        })
+        slow_request_log.add(profile)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is None:
+            return response
+
+        render = response.render
+
+        def timed_render():
+            start = time.perf_counter()
+            try:
+                return render()
+            finally:
+                profile['template_ms'] += (time.perf_counter() - start) * 1000
+
+        response.render = timed_render
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:06
+
+from django.db import migrations, models
+import django_countries.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consentrecord',
+            name='country',
+            field=django_countries.fields.CountryField(blank=True, max_length=2),
+        ),
+        migrations.AddIndex(
+            model_name='consentrecord',
+            index=models.Index(fields=['timestamp'], name='ethics_app__timesta_29fe04_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='databreach',
+            index=models.Index(fields=['detection_date'], name='ethics_app__detecti_5e525a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='datasubjectrequest',
+            index=models.Index(fields=['created_at'], name='ethics_app__created_3e3374_idx'),
+        ),
+    ]
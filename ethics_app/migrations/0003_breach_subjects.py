@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ethics_app', '0002_report_indexes_and_country'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='databreach',
+            name='notification_completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='databreach',
+            name='notification_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='databreach',
+            name='notifications_failed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='databreach',
+            name='notifications_sent',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='BreachSubject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254)),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('language', models.CharField(default='en', max_length=5)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, max_length=200)),
+                ('breach', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subjects', to='ethics_app.databreach')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['breach', 'notified_at'], name='ethics_app__breach__d4302d_idx')],
+                'unique_together': {('breach', 'email')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0003_breach_subjects'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='breachsubject',
+            index=models.Index(fields=['notified_at'], name='ethics_app__notifie_6613f3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consentrecord',
+            index=models.Index(fields=['expiry_date'], name='ethics_app__expiry__1fe9d7_idx'),
+        ),
+    ]
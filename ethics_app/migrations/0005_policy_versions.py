@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0004_retention_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consentrecord',
+            name='policy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='consents', to='ethics_app.privacypolicy'),
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='activated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='requires_reconsent',
+            field=models.BooleanField(default=True, help_text='Expire consents given under earlier versions instead of carrying them over'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_countries.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0005_policy_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('timestamp', models.DateTimeField(blank=True, null=True)),
+                ('last_id', models.CharField(blank=True, max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConsentTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('consent_type', models.CharField(choices=[('functional', 'Functional Cookies'), ('analytics', 'Analytics Cookies'), ('marketing', 'Marketing Cookies'), ('data_processing', 'Data Processing')], max_length=20)),
+                ('consent_given', models.BooleanField()),
+                ('country', django_countries.fields.CountryField(blank=True, max_length=2)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('policy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ethics_app.privacypolicy')),
+            ],
+            options={
+                'unique_together': {('day', 'consent_type', 'consent_given', 'country', 'policy')},
+            },
+        ),
+    ]
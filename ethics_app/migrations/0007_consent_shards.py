@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ethics_app', '0006_consent_compaction'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='consentrecord',
+            name='policy',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='consents', to='ethics_app.privacypolicy'),
+        ),
+        migrations.AlterField(
+            model_name='consentrecord',
+            name='user',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
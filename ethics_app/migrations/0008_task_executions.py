@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0007_consent_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskExecution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('task_name', models.CharField(max_length=200)),
+                ('task_id', models.CharField(blank=True, max_length=64)),
+                ('started_at', models.DateTimeField()),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, router
+
+
+def install(apps, schema_editor):
+    from ethics_app.search import backend_for
+
+    alias = schema_editor.connection.alias
+    if router.allow_migrate(alias, 'ethics_app', model_name='datasubjectrequest'):
+        backend_for(alias).reindex()
+
+
+def uninstall(apps, schema_editor):
+    from ethics_app.search import backend_for
+
+    alias = schema_editor.connection.alias
+    if router.allow_migrate(alias, 'ethics_app', model_name='datasubjectrequest'):
+        backend_for(alias).uninstall()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0008_task_executions'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
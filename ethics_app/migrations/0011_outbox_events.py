@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0010_subject_identity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=80)),
+                ('consent_type', models.CharField(choices=[('functional', 'Functional Cookies'), ('analytics', 'Analytics Cookies'), ('marketing', 'Marketing Cookies'), ('data_processing', 'Data Processing')], max_length=20)),
+                ('consent_given', models.BooleanField()),
+                ('policy_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
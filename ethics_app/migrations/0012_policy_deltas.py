@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:55
+
+from django.db import migrations, models, router
+
+
+def _texts(policies):
+    from ethics_app.policy_history import apply_delta
+
+    texts, newer = [], None
+    for policy in policies:
+        text = policy.content if policy.delta is None or newer is None else apply_delta(newer, policy.delta)
+        texts.append((policy, text))
+        newer = text
+    return texts
+
+
+def _chains(apps, schema_editor):
+    PrivacyPolicy = apps.get_model('ethics_app', 'PrivacyPolicy')
+    alias = schema_editor.connection.alias
+    if not router.allow_migrate(alias, 'ethics_app', model_name='privacypolicy'):
+        return
+    policies = PrivacyPolicy.objects.using(alias)
+    for language in policies.values_list('language', flat=True).distinct().order_by():
+        yield policies, _texts(policies.filter(language=language).order_by('-effective_date', '-pk'))
+
+
+def pack(apps, schema_editor):
+    from ethics_app.policy_history import content_hash, make_delta
+
+    for policies, texts in _chains(apps, schema_editor):
+        newer = None
+        for policy, text in texts:
+            delta = None if newer is None else make_delta(newer, text)
+            policies.filter(pk=policy.pk).update(
+                content=text if delta is None else '', delta=delta, content_hash=content_hash(text)
+            )
+            newer = text
+
+
+def unpack(apps, schema_editor):
+    for policies, texts in _chains(apps, schema_editor):
+        for policy, text in texts:
+            policies.filter(pk=policy.pk).update(content=text, delta=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0011_outbox_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='delta',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack, unpack),
+    ]
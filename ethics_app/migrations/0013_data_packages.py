@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0012_policy_deltas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataPackage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('request', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='package', to='ethics_app.datasubjectrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['digest'], name='ethics_app__digest_cfc362_idx'), models.Index(fields=['expires_at'], name='ethics_app__expires_a0ab8d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, router
+
+
+def rebuild(apps, schema_editor):
+    # The FTS5 index was keyed on request rowids, which VACUUM may renumber;
+    # rebuild it keyed on stable docids.
+    from ethics_app.search import backend_for
+
+    alias = schema_editor.connection.alias
+    if router.allow_migrate(alias, 'ethics_app', model_name='datasubjectrequest'):
+        backend = backend_for(alias)
+        backend.uninstall()
+        backend.reindex()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0013_data_packages'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild, migrations.RunPython.noop),
+    ]
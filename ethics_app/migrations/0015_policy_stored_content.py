@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ethics_app', '0014_request_search_docids'),
+    ]
+
+    # The text is read through PrivacyPolicy.content, which rebuilds earlier
+    # versions from their deltas; the column itself keeps its name.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='privacypolicy',
+                    old_name='content',
+                    new_name='stored_content',
+                ),
+                migrations.AlterField(
+                    model_name='privacypolicy',
+                    name='stored_content',
+                    field=models.TextField(blank=True, db_column='content', editable=False),
+                ),
+            ],
+        ),
+    ]
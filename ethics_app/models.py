@@ -13,7 +13,9 @@ class ConsentRecord(models.Model):
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # Consents may live on a shard apart from users and policies, so neither
+    # key is enforced by the database; see ethics_app.sharding.
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
     session_key = models.CharField(max_length=40, null=True, blank=True)
     ip_address = models.GenericIPAddressField()
     consent_type = models.CharField(max_length=20, choices=CONSENT_TYPES)
@@ -21,9 +23,17 @@ class ConsentRecord(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     expiry_date = models.DateTimeField()
     legal_basis = models.CharField(max_length=100, default='consent')
+    country = CountryField(blank=True)
+    # Policy version the consent was given under; see ethics_app.policies
+    policy = models.ForeignKey('PrivacyPolicy', on_delete=models.DO_NOTHING, db_constraint=False,
+                               null=True, blank=True, related_name='consents')
 
     class Meta:
         unique_together = ['user', 'session_key', 'consent_type']
+        indexes = [
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['expiry_date']),
+        ]
 
 class DataSubjectRequest(models.Model):
     REQUEST_TYPES = [
@@ -51,6 +61,15 @@ class DataSubjectRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
     response = models.TextField(blank=True)
+    # Set from the email address on save; see ethics_app.identity
+    subject = models.ForeignKey('Subject', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='requests')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
 class DataProcessingActivity(models.Model):
     name = models.CharField(max_length=200)
     purpose = models.TextField()
@@ -83,13 +102,135 @@ class DataBreach(models.Model):
     notification_required = models.BooleanField(default=True)
     authority_notified = models.BooleanField(default=False)
     subjects_notified = models.BooleanField(default=False)
+    notification_started_at = models.DateTimeField(null=True, blank=True)
+    notification_completed_at = models.DateTimeField(null=True, blank=True)
+    notifications_sent = models.IntegerField(default=0)
+    notifications_failed = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['detection_date']),
+        ]
+
+class BreachSubject(models.Model):
+    """A data subject affected by a breach, and whether they have been notified."""
+    breach = models.ForeignKey(DataBreach, on_delete=models.CASCADE, related_name='subjects')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    email = models.EmailField()
+    name = models.CharField(max_length=200, blank=True)
+    language = models.CharField(max_length=5, default='en')
+    notified_at = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        unique_together = ['breach', 'email']
+        indexes = [
+            models.Index(fields=['breach', 'notified_at']),
+            models.Index(fields=['notified_at']),
+        ]
 
 class PrivacyPolicy(models.Model):
     version = models.CharField(max_length=10)
-    content = models.TextField()
+    # Only the newest version of a language stores its full text; earlier
+    # ones store '' and a compressed delta to the next version. Read and
+    # assign the text through ``content``. See ethics_app.policy_history
+    stored_content = models.TextField(db_column='content', blank=True, editable=False)
     effective_date = models.DateTimeField()
     language = models.CharField(max_length=5, default='en')
     is_active = models.BooleanField(default=False)
+    activated_at = models.DateTimeField(null=True, blank=True)
+    requires_reconsent = models.BooleanField(
+        default=True,
+        help_text="Expire consents given under earlier versions instead of carrying them over",
+    )
+    delta = models.BinaryField(null=True, blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
 
     class Meta:
         unique_together = ['version', 'language']
+
+    @property
+    def content(self):
+        """The full text, rebuilt from the deltas for an earlier version."""
+        if '_content' in self.__dict__:
+            return self._content
+        from .policy_history import content_of
+        return content_of(self)
+
+    @content.setter
+    def content(self, text):
+        # stored when the version is saved
+        self._content = text
+
+class ConsentTally(models.Model):
+    """Daily counts of anonymous consents compacted after their session ended."""
+    day = models.DateField()
+    consent_type = models.CharField(max_length=20, choices=ConsentRecord.CONSENT_TYPES)
+    consent_given = models.BooleanField()
+    country = CountryField(blank=True)
+    policy = models.ForeignKey(PrivacyPolicy, on_delete=models.SET_NULL, null=True, blank=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['day', 'consent_type', 'consent_given', 'country', 'policy']
+
+class JobWatermark(models.Model):
+    """How far an incremental background job has got, as a (timestamp, id) position."""
+    name = models.CharField(max_length=100, unique=True)
+    timestamp = models.DateTimeField(null=True, blank=True)
+    last_id = models.CharField(max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class TaskExecution(models.Model):
+    """Claim on an idempotency key by a Celery task run; see ethics_app.idempotency."""
+    key = models.CharField(max_length=200, unique=True)
+    task_name = models.CharField(max_length=200)
+    task_id = models.CharField(max_length=64, blank=True)
+    started_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+
+class Subject(models.Model):
+    """One person, however they reached us; see ethics_app.identity."""
+    user = models.OneToOneField(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='subject')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class SubjectIdentifier(models.Model):
+    """An email address (as a keyed digest) or session key known to belong to a subject."""
+    KINDS = [
+        ('email', 'Email digest'),
+        ('session', 'Session key'),
+    ]
+
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='identifiers')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    value = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['kind', 'value']
+
+
+class OutboxEvent(models.Model):
+    """A consent change waiting to be relayed downstream; see ethics_app.outbox."""
+    # Lives on the shard of the consent it describes, so no foreign keys
+    subject = models.CharField(max_length=80)
+    consent_type = models.CharField(max_length=20, choices=ConsentRecord.CONSENT_TYPES)
+    consent_given = models.BooleanField()
+    policy_id = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class DataPackage(models.Model):
+    """The downloadable copy of a subject's data answering a request; see ethics_app.dsar."""
+    request = models.OneToOneField(DataSubjectRequest, on_delete=models.CASCADE, related_name='package')
+    # SHA-256 of the zip file, which is stored once however many requests it answers
+    digest = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['digest']),
+            models.Index(fields=['expires_at']),
+        ]
@@ -0,0 +1,215 @@
+"""
+Transactional outbox for consent changes.
+
+Ad-tech and analytics systems downstream have to stop using a visitor's data
+within seconds of a withdrawal. Polling ``ConsentRecord`` cannot tell them:
+``timestamp`` is set when a record is created and never again. Instead the
+consent views add an ``OutboxEvent`` for every change they make, in the
+transaction that makes it and on the same shard, so an event exists exactly
+when its change was committed. ``relay`` publishes a shard's events to the
+configured sink in batches, oldest first, and deletes them once the sink has
+accepted them:
+
+* Delivery is at least once. A relay that dies between publishing a batch
+  and deleting it publishes the batch again, so consumers drop events whose
+  ``id`` they have already seen.
+* A subject's events arrive in order. A subject's consents, and so its
+  events, live on one shard; its writes queue on its consent rows; and one
+  relay runs per shard at a time (the ``relay_outbox`` task is
+  single-flight).
+* A sink that cannot keep up raises ``Backpressure``. The relay stops, the
+  events wait in the outbox, and the task retries after ``retry_after``.
+
+Celery beat starts the relays every second; ``manage.py relay_outbox``
+runs them in the foreground instead. The sink is ``OUTBOX_SINK`` (a dotted
+path) built with ``OUTBOX_SINK_OPTIONS``: ``FileSink`` appends JSON lines,
+``RedisStreamSink`` adds to a Redis stream, ``WebhookSink`` posts batches.
+
+Subjects are ``user:<id>`` or ``session:<digest>``: session keys are
+credentials, so only a keyed digest of one leaves.
+"""
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Min
+from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+
+FIELDS = ('pk', 'subject', 'consent_type', 'consent_given', 'policy_id', 'created_at')
+
+
+class Backpressure(Exception):
+    """The sink is full or overloaded; try again after ``retry_after`` seconds."""
+
+    def __init__(self, message, retry_after=5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def subject_key(user_id=None, session_key=None):
+    if user_id is not None:
+        return f'user:{user_id}'
+    digest = salted_hmac('ethics_app.outbox.session', session_key or '', algorithm='sha256').hexdigest()
+    return f'session:{digest[:32]}'
+
+
+def record(alias, records):
+    """
+    Add an event for each of ``records``, consents just created or changed on
+    ``alias``. Call it inside the transaction that writes them.
+    """
+    OutboxEvent.objects.using(alias).bulk_create([
+        OutboxEvent(
+            subject=subject_key(consent.user_id, consent.session_key),
+            consent_type=consent.consent_type,
+            consent_given=consent.consent_given,
+            policy_id=consent.policy_id,
+        )
+        for consent in records
+    ])
+
+
+def message(alias, row):
+    pk, subject, consent_type, consent_given, policy_id, created_at = row
+    return {
+        'id': f'{alias}:{pk}',
+        'subject': subject,
+        'consent_type': consent_type,
+        'consent_given': consent_given,
+        'policy': policy_id,
+        'at': created_at.isoformat(),
+    }
+
+
+class Sink:
+    """Where relayed events go. ``publish`` returns once the sink holds the batch."""
+
+    def publish(self, messages):
+        raise NotImplementedError
+
+
+class FileSink(Sink):
+    """JSON lines appended to ``path``, synced to disk per batch."""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    def publish(self, messages):
+        data = ''.join(json.dumps(m, separators=(',', ':')) + '\n' for m in messages).encode()
+        # one O_APPEND write, so the relays of several shards do not interleave lines
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class MemorySink(Sink):
+    """Keeps the messages in a list, for development and benchmarks."""
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, messages):
+        self.messages.extend(messages)
+
+
+class RedisStreamSink(Sink):
+    """
+    Entries added to a Redis stream. Consumers trim what they have
+    processed; once the stream holds ``max_length`` entries the relay waits.
+    """
+
+    def __init__(self, url=None, stream='consent-events', max_length=1_000_000):
+        import redis
+
+        self.client = redis.Redis.from_url(url or settings.CELERY_BROKER_URL)
+        self.stream = stream
+        self.max_length = max_length
+
+    def publish(self, messages):
+        if self.max_length:
+            length = self.client.xlen(self.stream)
+            if length + len(messages) > self.max_length:
+                raise Backpressure(f'{self.stream} holds {length} entries')
+        pipeline = self.client.pipeline(transaction=False)
+        for m in messages:
+            pipeline.xadd(self.stream, {'event': json.dumps(m, separators=(',', ':'))})
+        pipeline.execute()
+
+
+class WebhookSink(Sink):
+    """Batches POSTed as ``{"events": [...]}``; 429 and 503 answers hold the relay back."""
+
+    def __init__(self, url, timeout=5, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def publish(self, messages):
+        body = json.dumps({'events': messages}, separators=(',', ':')).encode()
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            if e.code in (429, 503):
+                try:
+                    retry_after = float(e.headers.get('Retry-After', 5))
+                except ValueError:
+                    retry_after = 5.0
+                raise Backpressure(f'{self.url} answered {e.code}', retry_after)
+            raise
+
+
+_sink = None
+
+
+def get_sink():
+    """The process-wide sink built from ``OUTBOX_SINK`` and ``OUTBOX_SINK_OPTIONS``."""
+    global _sink
+    if _sink is None:
+        path = getattr(settings, 'OUTBOX_SINK', 'ethics_app.outbox.FileSink')
+        _sink = import_string(path)(**getattr(settings, 'OUTBOX_SINK_OPTIONS', {}))
+    return _sink
+
+
+def relay(alias=DEFAULT_DB_ALIAS, sink=None, batch_size=None, seconds=None):
+    """
+    Publish the events waiting on ``alias``, oldest first, until there are
+    none left or ``seconds`` have passed. Returns the number published. When
+    the sink fails (``Backpressure`` or otherwise) the error propagates and
+    the unpublished events stay in the outbox.
+    """
+    sink = sink or get_sink()
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 500)
+    deadline = time.monotonic() + seconds if seconds else None
+    events = OutboxEvent.objects.using(alias)
+    published = 0
+    while deadline is None or time.monotonic() < deadline:
+        rows = list(events.order_by('pk').values_list(*FIELDS)[:batch_size])
+        if not rows:
+            break
+        sink.publish([message(alias, row) for row in rows])
+        # by key rather than range: an event committed late with a lower key
+        # than the batch's last must not be deleted unpublished
+        events.filter(pk__in=[row[0] for row in rows]).delete()
+        published += len(rows)
+        if len(rows) < batch_size:
+            break
+    return published
+
+
+def backlog(alias=DEFAULT_DB_ALIAS):
+    """Number of events waiting on ``alias`` and when the oldest was recorded."""
+    events = OutboxEvent.objects.using(alias)
+    return events.count(), events.aggregate(oldest=Min('created_at'))['oldest']
@@ -0,0 +1,163 @@
+"""
+Privacy policy versions and consent staleness.
+
+Every ``ConsentRecord`` points at the ``PrivacyPolicy`` it was given under,
+and the active policy of each language is the current version. A consent is
+stale when its policy is no longer current, which ``CurrentPolicies``
+answers from a small in-memory snapshot of the active policy IDs, so no
+consent row has to change when a new version goes live. Activating a policy
+is a couple of single-row writes however many consents exist. The
+``reconcile_policy_consents`` task then walks the stale records of each
+consent shard in primary key chunks and, depending on the new policy's
+``requires_reconsent``, either carries them over to it or expires them.
+Consents recorded before versions were tracked have no policy and no
+language, so they are only reconciled when the caller opts in with
+``include_legacy``; otherwise activating one language's policy would
+expire the legacy consents of visitors in every language.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ConsentRecord, PrivacyPolicy
+from .sharding import shard_aliases
+
+
+class CurrentPolicies:
+    """
+    Per-process snapshot of the active policy of each language. Reloaded
+    every ``ttl`` seconds so that activations in other processes are picked
+    up; activations and admin edits in this process invalidate it at once.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._by_language = {}
+        self._ids = frozenset()
+        self._versioned = False
+
+    def _load(self):
+        rows = PrivacyPolicy.objects.filter(is_active=True).order_by('effective_date').values_list(
+            'id', 'language', 'activated_at'
+        )
+        by_language = {}
+        versioned = False
+        for policy_id, language, activated_at in rows:
+            # several active versions of one language: the latest takes effect
+            by_language[language] = policy_id
+            versioned = versioned or activated_at is not None
+        self._by_language = by_language
+        self._ids = frozenset(by_language.values())
+        self._versioned = versioned
+        self._loaded_at = time.monotonic()
+
+    def _refresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                    self._load()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def for_language(self, language):
+        """ID of the policy consent given in ``language`` is recorded under, or None."""
+        self._refresh()
+        return self._by_language.get(language) or self._by_language.get(settings.LANGUAGE_CODE)
+
+    def is_current(self, policy_id):
+        """Whether consent given under ``policy_id`` still stands."""
+        self._refresh()
+        if not self._ids:
+            return True
+        if policy_id is None:
+            # Given before consents were tied to a policy. Those stand until the
+            # first version is activated through activate().
+            return not self._versioned
+        return policy_id in self._ids
+
+
+current_policies = CurrentPolicies(getattr(settings, 'POLICY_CACHE_SECONDS', 60))
+
+
+@receiver(post_save, sender=PrivacyPolicy)
+@receiver(post_delete, sender=PrivacyPolicy)
+def _invalidate_current_policies(sender, **kwargs):
+    current_policies.invalidate()
+
+
+def activate(policy, reconcile=True, include_legacy=False):
+    """
+    Make ``policy`` the current version for its language. Consents given
+    under earlier versions become stale immediately; unless ``reconcile`` is
+    False, a background task then migrates or expires them, along with the
+    consents that have no policy at all when ``include_legacy`` is set.
+    """
+    from .tasks import reconcile_policy_consents
+
+    now = timezone.now()
+    with transaction.atomic():
+        PrivacyPolicy.objects.filter(language=policy.language, is_active=True).exclude(pk=policy.pk).update(
+            is_active=False
+        )
+        PrivacyPolicy.objects.filter(pk=policy.pk).update(is_active=True, activated_at=now)
+        if reconcile:
+            for alias in shard_aliases():
+                transaction.on_commit(
+                    lambda alias=alias: reconcile_policy_consents.delay(
+                        policy.pk, alias=alias, include_legacy=include_legacy
+                    )
+                )
+    policy.is_active = True
+    policy.activated_at = now
+    current_policies.invalidate()
+
+
+def stale_consents(policy, alias='default', include_legacy=False):
+    """
+    Consent records on ``alias`` that ``policy`` supersedes and
+    reconciliation has not dealt with yet. Consents without a policy belong
+    to no language and are only included with ``include_legacy``.
+    """
+    superseded = PrivacyPolicy.objects.filter(language=policy.language).exclude(pk=policy.pk)
+    condition = Q(policy_id__in=list(superseded.values_list('id', flat=True)))
+    if include_legacy:
+        condition |= Q(policy__isnull=True)
+    queryset = ConsentRecord.objects.using(alias).filter(condition)
+    if policy.requires_reconsent:
+        queryset = queryset.filter(expiry_date__gt=timezone.now())
+    return queryset
+
+
+def reconcile_chunk(policy_id, after=None, chunk_size=1000, alias='default', include_legacy=False):
+    """
+    Migrate or expire up to ``chunk_size`` stale consents on ``alias`` with
+    primary keys after ``after``. Returns ``(count, last_pk)``; ``last_pk``
+    is None when nothing is left or ``policy_id`` is no longer the current
+    version.
+    """
+    policy = PrivacyPolicy.objects.filter(pk=policy_id, is_active=True).first()
+    if policy is None:
+        # superseded in the meantime; the newer version's run takes over
+        return 0, None
+    queryset = stale_consents(policy, alias, include_legacy)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+    if not pks:
+        return 0, None
+
+    chunk = ConsentRecord.objects.using(alias).filter(pk__in=pks)
+    if policy.requires_reconsent:
+        count = chunk.update(expiry_date=timezone.now())
+    else:
+        count = chunk.update(policy=policy)
+    return count, pks[-1] if len(pks) == chunk_size else None
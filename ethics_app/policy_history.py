@@ -0,0 +1,287 @@
+"""
+Privacy policy version storage and "what changed" diffs.
+
+Every version of every language used to keep its full text, though
+consecutive versions share most of it. Now only the newest version of each
+language (by ``effective_date``) does, in ``stored_content``. Each earlier
+version stores '' and a reverse delta instead, as RCS does: zlib-compressed
+line operations that rebuild its text from the next newer version's.
+``PrivacyPolicy.content`` is the full text whichever way it is stored:
+``content_of`` walks the chain back from the newest version, and remembers
+the texts it rebuilt per process. ``content_hash`` is the SHA-256 of a
+version's full text.
+
+Saving a version through the ORM (creating one, editing its content, moving
+its date or language) or deleting one repacks the chains it touches.
+Assigning ``content`` on an earlier version replaces its text. Queryset
+``update()`` calls bypass the signals, so use ``repack`` after them.
+
+``compare`` diffs the visible text of two versions paragraph by paragraph,
+and word by word within changed paragraphs, into structured changes and an
+HTML fragment. ``diff`` caches that result in the ``POLICY_DIFF_CACHE``
+cache, keyed by both versions' IDs and content hashes, so each pair is
+computed once and an edit never serves a stale diff.
+"""
+import hashlib
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+from functools import lru_cache
+from html import unescape
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils.html import escape, strip_tags
+
+from .models import PrivacyPolicy
+
+# fields whose change can alter a version's text or its place in a chain
+CHAIN_FIELDS = {'stored_content', 'effective_date', 'language'}
+
+_BLOCK_END = re.compile(r'<\s*(?:br|/p|/li|/h[1-6]|/div|/tr|/dt|/dd|/blockquote|/section)\b[^>]*>', re.IGNORECASE)
+_WORDS = re.compile(r'(\s+)')
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def make_delta(base, text):
+    """
+    Compressed operations rebuilding ``text`` from ``base``: a ``[start,
+    end]`` pair copies those lines of ``base``, a string is literal text.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, base_lines, lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode(), 9)
+
+
+def apply_delta(base, delta):
+    base_lines = base.splitlines(keepends=True)
+    return ''.join(
+        ''.join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op
+        for op in json.loads(zlib.decompress(delta))
+    )
+
+
+def _chain(language):
+    """``(pk, stored_content, delta)`` of each version of ``language``, newest first."""
+    return list(
+        PrivacyPolicy.objects.filter(language=language)
+        .order_by('-effective_date', '-pk')
+        .values_list('pk', 'stored_content', 'delta')
+    )
+
+
+def texts_of(language):
+    """The full text of every version of ``language``, by ID."""
+    texts, newer = {}, None
+    for pk, content, delta in _chain(language):
+        text = content if delta is None or newer is None else apply_delta(newer, delta)
+        texts[pk] = newer = text
+    return texts
+
+
+@lru_cache(maxsize=64)
+def _rebuilt(pk, digest, language):
+    # keyed by the hash too: an edited version is rebuilt afresh
+    return texts_of(language)[pk]
+
+
+def content_of(policy):
+    """The full text of ``policy`` as stored; ``policy.content`` also sees unsaved edits."""
+    if policy.delta is None:
+        return policy.stored_content
+    return _rebuilt(policy.pk, policy.content_hash, policy.language)
+
+
+def repack(language, texts=None):
+    """
+    Store the newest version of ``language`` in full and each earlier one as
+    a delta to the next. ``texts`` gives the full text of each version by
+    ID when the stored form no longer tells, as after an edit; by default it
+    is read from the stored chain.
+    """
+    texts = texts_of(language) if texts is None else texts
+    newer = None
+    with transaction.atomic():
+        for pk, content, delta in _chain(language):
+            text = texts[pk]
+            if newer is None:
+                stored = {'stored_content': text, 'delta': None}
+            else:
+                stored = {'stored_content': '', 'delta': make_delta(newer, text)}
+            stored['content_hash'] = content_hash(text)
+            PrivacyPolicy.objects.filter(pk=pk).update(**stored)
+            newer = text
+
+
+def storage(language=None):
+    """``(versions, full_bytes, stored_bytes)``: the texts' size against what is stored."""
+    policies = PrivacyPolicy.objects.all()
+    if language:
+        policies = policies.filter(language=language)
+    versions = full = stored = 0
+    for code in policies.values_list('language', flat=True).distinct():
+        texts = texts_of(code)
+        versions += len(texts)
+        full += sum(len(text.encode()) for text in texts.values())
+    for content, delta in policies.values_list('stored_content', 'delta'):
+        stored += len(content.encode()) + (len(delta) if delta is not None else 0)
+    return versions, full, stored
+
+
+@receiver(pre_save, sender=PrivacyPolicy)
+def _before_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._chains = None
+    if raw or (update_fields is not None and not CHAIN_FIELDS & set(update_fields)):
+        return
+    languages = {instance.language}
+    if instance.pk is not None:
+        languages.update(PrivacyPolicy.objects.filter(pk=instance.pk).values_list('language', flat=True))
+    texts = {}
+    for language in languages:
+        texts.update(texts_of(language))
+    # a version saved back unedited keeps the text its chain rebuilds
+    if '_content' in instance.__dict__:
+        texts[instance.pk] = instance._content
+    elif instance.pk is None:
+        texts[None] = ''
+    instance._chains = (languages, texts)
+
+
+@receiver(post_save, sender=PrivacyPolicy)
+def _after_save(sender, instance, **kwargs):
+    chains = getattr(instance, '_chains', None)
+    if chains is None:
+        return
+    languages, texts = chains
+    if None in texts:
+        texts[instance.pk] = texts.pop(None)
+    for language in languages:
+        repack(language, texts)
+    instance.content_hash = content_hash(texts[instance.pk])
+    instance._chains = None
+
+
+@receiver(pre_delete, sender=PrivacyPolicy)
+def _before_delete(sender, instance, **kwargs):
+    instance._chains = ({instance.language}, texts_of(instance.language))
+
+
+@receiver(post_delete, sender=PrivacyPolicy)
+def _after_delete(sender, instance, **kwargs):
+    languages, texts = instance._chains
+    for language in languages:
+        repack(language, texts)
+
+
+def paragraphs(html):
+    """The visible text of policy HTML, one paragraph per block or line."""
+    text = unescape(strip_tags(_BLOCK_END.sub('\n', html)))
+    return [' '.join(line.split()) for line in text.splitlines() if line.strip()]
+
+
+def _words_html(old, new):
+    """``new`` with the words changed from ``old`` marked up."""
+    old_words, new_words = _WORDS.split(old), _WORDS.split(new)
+    parts = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_words, new_words, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            parts.append(escape(''.join(new_words[j1:j2])))
+            continue
+        if i2 > i1:
+            parts.append(f"<del>{escape(''.join(old_words[i1:i2]))}</del>")
+        if j2 > j1:
+            parts.append(f"<ins>{escape(''.join(new_words[j1:j2]))}</ins>")
+    return ''.join(parts)
+
+
+def compare(old_html, new_html):
+    """
+    The paragraphs added, removed and changed from ``old_html`` to
+    ``new_html``, and the new text as an HTML fragment with the changes
+    marked: ``<ins>``/``<del>`` within paragraphs, and the classes
+    ``policy-added``, ``policy-removed`` and ``policy-changed`` on them.
+    """
+    old, new = paragraphs(old_html), paragraphs(new_html)
+    changes, html = [], []
+    counts = {'added': 0, 'removed': 0, 'changed': 0}
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            html.extend(f'<p>{escape(text)}</p>' for text in new[j1:j2])
+            continue
+        changes.append({'op': tag, 'old': old[i1:i2], 'new': new[j1:j2]})
+        # changed paragraphs pair up in order; the rest were added or removed
+        paired = min(i2 - i1, j2 - j1)
+        for before, after in zip(old[i1:i1 + paired], new[j1:j1 + paired]):
+            html.append(f'<p class="policy-changed">{_words_html(before, after)}</p>')
+        html.extend(f'<p class="policy-removed"><del>{escape(text)}</del></p>' for text in old[i1 + paired:i2])
+        html.extend(f'<p class="policy-added"><ins>{escape(text)}</ins></p>' for text in new[j1 + paired:j2])
+        counts['changed'] += paired
+        counts['removed'] += i2 - i1 - paired
+        counts['added'] += j2 - j1 - paired
+    return {**counts, 'changes': changes, 'html': '\n'.join(html)}
+
+
+def diff(old, new):
+    """``compare`` of two versions, from the cache when this pair was compared before."""
+    if not (old.content_hash and new.content_hash):
+        return compare(old.content, new.content)
+    cache = caches[getattr(settings, 'POLICY_DIFF_CACHE', 'default')]
+    key = f'policy-diff:{new.language}:{old.pk}:{old.content_hash}:{new.pk}:{new.content_hash}'
+    result = cache.get(key)
+    if result is None:
+        result = compare(old.content, new.content)
+        cache.set(key, result, getattr(settings, 'POLICY_DIFF_CACHE_SECONDS', 7 * 24 * 3600))
+    return result
+
+
+def versions(language):
+    """The versions of ``language``, oldest first, without their text."""
+    return list(
+        PrivacyPolicy.objects.filter(language=language)
+        .order_by('effective_date', 'pk')
+        .only('pk', 'version', 'language', 'effective_date', 'is_active', 'content_hash')
+    )
+
+
+def pair(language, old_version=None, new_version=None):
+    """
+    The two versions of ``language`` to compare and all its versions: by
+    default the current version and the one before it. Raises
+    ``PrivacyPolicy.DoesNotExist`` for an unknown version, ValueError when
+    there is nothing earlier to compare with.
+    """
+    from .policies import current_policies
+
+    ordered = versions(language)
+    by_version = {policy.version: policy for policy in ordered}
+    for wanted in (old_version, new_version):
+        if wanted and wanted not in by_version:
+            raise PrivacyPolicy.DoesNotExist(f'No {language} privacy policy with version {wanted}')
+    if new_version:
+        new = by_version[new_version]
+    else:
+        current = current_policies.for_language(language)
+        new = next((policy for policy in ordered if policy.pk == current), ordered[-1] if ordered else None)
+    if new is None:
+        raise PrivacyPolicy.DoesNotExist(f'No {language} privacy policy')
+    if old_version:
+        old = by_version[old_version]
+    else:
+        index = ordered.index(new)
+        if not index:
+            raise ValueError(f'{language} privacy policy {new.version} is the first version')
+        old = ordered[index - 1]
+    return old, new, ordered
@@ -0,0 +1,172 @@
+"""
+Rate limiting for the consent API and any other path in ``RATE_LIMITS``.
+
+``RateLimitMiddleware`` runs first in the chain, so turning a client away
+costs a dictionary lookup and a little arithmetic: no session load, no body
+parsing, no query. Each limited path has a token bucket per client IP and
+per session cookie. A bucket holds up to ``burst`` tokens and refills at
+``rate`` tokens a second. Every request takes one token, and a request that
+finds its bucket empty gets a 429 with ``Retry-After``.
+
+Buckets live in the worker process (``TokenBuckets``). Each process tracks
+at most ``RATE_LIMIT_MAX_KEYS`` clients and forgets the least recently seen
+first. With several workers each has its own buckets, so a client spreading
+requests across them gets a multiple of the limit. Setting
+``RATE_LIMIT_CACHE`` to a cache alias shared by the workers (Redis,
+memcached) adds a second tier (``SharedWindows``): a counter per client and
+``RATE_LIMIT_WINDOW`` seconds in that cache, which caps the total. Only
+requests the local bucket let through reach the cache, so a flood is turned
+away before it costs a cache round trip. The shared tier fails open: an
+unreachable cache does not take the API down with it.
+
+``rate_limit_stats`` counts allowed and throttled requests by path, scope
+and tier, and keeps the clients throttled most often.
+"""
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBuckets:
+    """Per-process token buckets for any number of keys, LRU-bounded to ``max_keys``."""
+
+    def __init__(self, rate, burst, max_keys=100_000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Take a token for ``key``. Returns 0 if there was one, else seconds until there will be."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = self.burst
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                self._buckets.move_to_end(key)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedWindows:
+    """
+    Fixed-window request counters in a shared cache: at most
+    ``rate * window + burst`` requests per key and window, across processes.
+    """
+
+    def __init__(self, cache_alias, rate, burst, window=10):
+        self.cache = caches[cache_alias]
+        self.window = window
+        self.limit = int(rate * window + burst)
+
+    def take(self, key, now=None):
+        now = time.time() if now is None else now
+        window = int(now // self.window)
+        cache_key = f'ratelimit:{key}:{window}'
+        try:
+            if self.cache.add(cache_key, 1, self.window * 2):
+                count = 1
+            else:
+                count = self.cache.incr(cache_key)
+        except ValueError:
+            # expired between add() and incr()
+            self.cache.add(cache_key, 1, self.window * 2)
+            count = 1
+        except Exception:
+            logger.warning('Rate limit cache unavailable, allowing request', exc_info=True)
+            return 0.0
+        if count <= self.limit:
+            return 0.0
+        return (window + 1) * self.window - now
+
+
+class RateLimitStats:
+    """Allowed and throttled request counts, and the most throttled clients."""
+
+    def __init__(self, top_n=20, max_clients=10_000):
+        self.top_n = top_n
+        self.max_clients = max_clients
+        self._counts = Counter()  # (path, scope, tier, outcome) -> requests
+        self._clients = Counter()  # (scope, client) -> throttled requests
+        self._lock = threading.Lock()
+
+    def allowed(self, path):
+        with self._lock:
+            self._counts[path, None, None, 'allowed'] += 1
+
+    def throttled(self, path, scope, tier, client):
+        with self._lock:
+            self._counts[path, scope, tier, 'throttled'] += 1
+            self._clients[scope, client] += 1
+            if len(self._clients) > self.max_clients:
+                self._clients = Counter(dict(self._clients.most_common(self.max_clients // 2)))
+
+    def report(self):
+        with self._lock:
+            counts = sorted(self._counts.items(), key=lambda item: [str(part) for part in item[0]])
+            clients = self._clients.most_common(self.top_n)
+        return {
+            'requests': [
+                {'path': path, 'scope': scope, 'tier': tier, 'outcome': outcome, 'count': count}
+                for (path, scope, tier, outcome), count in counts
+            ],
+            'top_throttled': [
+                {'scope': scope, 'client': client, 'count': count} for (scope, client), count in clients
+            ],
+        }
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._clients.clear()
+
+
+rate_limit_stats = RateLimitStats(getattr(settings, 'RATE_LIMIT_TOP_N', 20))
+
+
+class Limit:
+    """The buckets of one scope (``ip`` or ``session``) of one path."""
+
+    def __init__(self, path, scope, rate, burst):
+        self.path = path
+        self.scope = scope
+        self.local = TokenBuckets(rate, burst, getattr(settings, 'RATE_LIMIT_MAX_KEYS', 100_000))
+        alias = getattr(settings, 'RATE_LIMIT_CACHE', None)
+        self.shared = SharedWindows(alias, rate, burst, getattr(settings, 'RATE_LIMIT_WINDOW', 10)) if alias else None
+
+    def take(self, key):
+        """Returns ``(tier, retry_after)`` for a throttled request, None for an allowed one."""
+        retry_after = self.local.take(key)
+        if retry_after:
+            return 'local', retry_after
+        if self.shared is not None:
+            retry_after = self.shared.take(f'{self.path}:{self.scope}:{key}')
+            if retry_after:
+                return 'shared', retry_after
+        return None
+
+
+def client_label(scope, key):
+    """How a throttled client is shown in the stats: session keys are credentials, so only a prefix."""
+    return f'{key[:8]}...' if scope == 'session' and not key.startswith('ip:') else key
@@ -0,0 +1,150 @@
+"""
+Read replicas.
+
+``DATABASE_REPLICAS`` maps database aliases to read-only copies of them.
+Reports, exports, the expiry notices and read-only requests run inside
+``replica_reads()``, where ``ReplicaRouter`` sends model reads to the copy
+of ``default`` and ``replica_for``/``on_replica`` map explicitly chosen
+aliases (such as consent shards) to theirs. Writes always go to the
+primary, so long report queries no longer hold locks that consent writes
+have to wait for.
+
+A replica lags behind its primary. ``ReplicaMiddleware`` therefore pins a
+client to the primary after each of its own writes (any non-safe request),
+with a cookie holding the time of the write, so visitors see the consents
+they just gave. The pin holds until every replica has been synced past that
+time, or for ``REPLICA_PIN_SECONDS`` when a replica cannot tell when it was
+synced. Sessions, accounts, the subject index and data packages, which a
+request needs to see as soon as another has written them, are always read
+from the primary (``PRIMARY_MODELS``).
+
+Locally, a replica is a SQLite file refreshed from its primary with
+``sync_replicas``: every minute by the ``sync_read_replicas`` Celery task,
+or with the ``sync_replica`` command. The file's modification time is set
+to when its snapshot was taken.
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'pin_primary'
+# read from the primary even inside replica_reads(): logins, sign-ups and
+# identity links must be seen by the very next request
+PRIMARY_MODELS = {
+    'sessions.session',
+    'auth.user',
+    'auth.group',
+    'auth.permission',
+    'ethics_app.subject',
+    'ethics_app.subjectidentifier',
+    'ethics_app.datapackage',
+}
+
+_reading = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', None) or {}
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Read from the replicas within this block (or function, as a decorator)."""
+    token = _reading.set(enabled)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def replica_for(alias):
+    """Alias to read ``alias`` from: its replica inside ``replica_reads()``, else itself."""
+    if _reading.get():
+        return replicas().get(alias, alias)
+    return alias
+
+
+def on_replica(queryset):
+    """Re-target a queryset bound to a primary alias at that alias' replica."""
+    alias = replica_for(queryset.db)
+    return queryset if alias == queryset.db else queryset.using(alias)
+
+
+def primary_of(alias):
+    for primary, replica in replicas().items():
+        if replica == alias:
+            return primary
+    return alias
+
+
+def sync_replicas(aliases=None):
+    """
+    Overwrite each SQLite replica with a consistent snapshot of its primary,
+    using SQLite's online backup. Returns the aliases copied.
+    """
+    synced = []
+    for primary, replica in replicas().items():
+        if aliases and primary not in aliases:
+            continue
+        source, target = connections[primary], connections[replica]
+        if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+            raise ValueError(f'{primary} is not a SQLite database; replicate it with its own tooling')
+        source.ensure_connection()
+        target.ensure_connection()
+        started = time.time()
+        source.connection.backup(target.connection)
+        if not target.is_in_memory_db():
+            os.utime(target.settings_dict['NAME'], (started, started))
+        synced.append(primary)
+    return synced
+
+
+def synced_at(alias):
+    """When the replica ``alias`` was last synced, in epoch seconds, or None when it cannot tell."""
+    connection = connections[alias]
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return None
+    try:
+        return os.stat(connection.settings_dict['NAME']).st_mtime
+    except OSError:
+        return None
+
+
+def caught_up(since):
+    """Whether every replica holds what was written to its primary up to ``since`` (epoch seconds)."""
+    for alias in replicas().values():
+        synced = synced_at(alias)
+        if synced is None or synced < since:
+            return False
+    return True
+
+
+class ReplicaRouter:
+    """
+    Inside ``replica_reads()``, read models stored on ``default`` from its
+    replica, but for ``PRIMARY_MODELS``. Replicas are copies, so nothing is
+    migrated on them.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in PRIMARY_MODELS:
+            return None
+        alias = replica_for(DEFAULT_DB_ALIAS)
+        return alias if alias != DEFAULT_DB_ALIAS else None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if primary_of(obj1._state.db) == primary_of(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas().values():
+            return False
+        return None
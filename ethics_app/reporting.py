@@ -0,0 +1,376 @@
+"""
+Streaming privacy compliance report engine.
+
+Summary breakdowns and per-day time series are aggregated in the database
+(date truncation, GROUP BY and a running-total window) and streamed row by row
+to a JSON or CSV writer, so memory stays bounded by the number of distinct
+days and keys rather than the number of records. Long periods can be split
+into day-aligned ranges computed in a process pool and merged in order.
+Consent sections are computed on every consent shard in parallel and merged,
+and anonymous consents compacted into ``ConsentTally`` rows are added back
+into them, counted on the UTC day they were given. Inside ``replica_reads()``
+every query goes to the databases' read replicas.
+"""
+import csv
+import heapq
+import itertools
+import json
+import multiprocessing
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import CharField, Count, F, Func, IntegerField, Q, Sum, Window
+from django.db.models.functions import Coalesce, Substr, TruncDate
+
+from .models import ConsentRecord, ConsentTally, DataBreach, DataSubjectRequest
+from .replicas import replica_for
+from .sharding import fan_out, is_sharded, shard_aliases
+
+
+class RunningTotal(Func):
+    """SUM() usable as a window over an aggregate, e.g. SUM(COUNT(id)) OVER (...)."""
+    function = 'SUM'
+    window_compatible = True
+    output_field = IntegerField()
+
+
+def _consent_measures():
+    return {
+        'total': Count('id'),
+        'granted': Count('id', filter=Q(consent_given=True)),
+    }
+
+
+def _tally_measures():
+    return {
+        'total': Coalesce(Sum('count'), 0),
+        'granted': Coalesce(Sum('count', filter=Q(consent_given=True)), 0),
+    }
+
+
+def _request_measures():
+    return {'count': Count('id')}
+
+
+def _breach_measures():
+    return {'count': Count('id'), 'affected_records': Sum('affected_records')}
+
+
+# name: (model, date field, grouping keys, measures factory)
+SUMMARY_SECTIONS = {
+    'consent_statistics': (ConsentRecord, 'timestamp', ['consent_type'], _consent_measures),
+    'data_subject_requests': (DataSubjectRequest, 'created_at', ['request_type', 'status'], _request_measures),
+    'breach_severity': (DataBreach, 'detection_date', ['severity', 'breach_type'], _breach_measures),
+    'consent_by_country': (ConsentRecord, 'timestamp', ['country', 'consent_type'], _consent_measures),
+}
+
+# name: (model, date field, grouping keys, measures factory, measure accumulated per key)
+SERIES_SECTIONS = {
+    'consent_daily': (ConsentRecord, 'timestamp', ['consent_type'], _consent_measures, 'total'),
+    'request_daily': (DataSubjectRequest, 'created_at', ['request_type'], _request_measures, 'count'),
+    'breach_daily': (DataBreach, 'detection_date', ['severity'], _breach_measures, 'count'),
+}
+
+# Sections whose records may have been compacted into ConsentTally rows
+TALLIED_SECTIONS = {'consent_statistics', 'consent_by_country', 'consent_daily'}
+
+
+def day_trunc(field, using='default'):
+    """
+    Truncate a datetime column to its UTC day in the database, whatever the
+    current time zone, so every backend puts a record on the same day. SQLite
+    stores datetimes as UTC text, so a native SUBSTR avoids TruncDate's
+    per-row Python function there.
+    """
+    if connections[using].vendor == 'sqlite':
+        return Substr(field, 1, 10, output_field=CharField())
+    return TruncDate(field, tzinfo=dt_timezone.utc)
+
+
+def _in_range(model, date_field, start, end, using):
+    return model.objects.using(replica_for(using)).filter(**{
+        f'{date_field}__gte': start,
+        f'{date_field}__lt': end,
+    })
+
+
+def summary_queryset(name, start, end, using='default'):
+    model, date_field, keys, measures = SUMMARY_SECTIONS[name]
+    return (
+        _in_range(model, date_field, start, end, using)
+        .values(*keys)
+        .annotate(**measures())
+        .order_by(*keys)
+    )
+
+
+def series_queryset(name, start, end, using='default'):
+    model, date_field, keys, measures, accumulated = SERIES_SECTIONS[name]
+    aggregates = measures()
+    return (
+        _in_range(model, date_field, start, end, using)
+        .annotate(day=day_trunc(date_field, using))
+        .values('day', *keys)
+        .annotate(**aggregates)
+        .annotate(cumulative=Window(
+            RunningTotal(aggregates[accumulated]),
+            partition_by=[F(key) for key in keys],
+            order_by=F('day').asc(),
+        ))
+        .order_by('day', *keys)
+    )
+
+
+def _first_midnight(moment):
+    """The first UTC midnight at or after ``moment``, as a date."""
+    moment = moment.astimezone(dt_timezone.utc)
+    return moment.date() if moment.time() == dt_time.min else moment.date() + timedelta(days=1)
+
+
+def _tallies_in_range(start, end, using):
+    """Tallies whose UTC day starts within ``[start, end)``."""
+    return ConsentTally.objects.using(replica_for(using)).filter(
+        day__gte=_first_midnight(start),
+        day__lt=_first_midnight(end),
+    )
+
+
+def tally_summary_queryset(name, start, end, using='default'):
+    keys = SUMMARY_SECTIONS[name][2]
+    return _tallies_in_range(start, end, using).values(*keys).annotate(**_tally_measures()).order_by(*keys)
+
+
+def tally_series_queryset(name, start, end, using='default'):
+    keys = SERIES_SECTIONS[name][2]
+    return (
+        _tallies_in_range(start, end, using)
+        .values('day', *keys)
+        .annotate(**_tally_measures())
+        .order_by('day', *keys)
+    )
+
+
+def merge_series(name, *streams):
+    """
+    Merge day-ordered series rows from several sources (shards, tallies),
+    summing rows for the same day and key and recomputing the running totals
+    that each database computed over its own rows alone.
+    """
+    _, _, keys, _, accumulated = SERIES_SECTIONS[name]
+    measures = list(SERIES_SECTIONS[name][3]())
+    merged = heapq.merge(
+        *[((str(row['day']), i, row) for row in stream) for i, stream in enumerate(streams)],
+        key=lambda item: item[:2],
+    )
+    totals = {}
+    for _, day_rows in itertools.groupby(merged, key=lambda item: item[0]):
+        by_key = {}
+        for _, _, row in day_rows:
+            key = tuple(row[k] for k in keys)
+            if key in by_key:
+                for measure in measures:
+                    by_key[key][measure] = (by_key[key][measure] or 0) + (row[measure] or 0)
+            else:
+                # same column order whichever source comes first
+                by_key[key] = {**dict(zip(keys, key)), 'day': row['day'], **{m: row[m] for m in measures}}
+        for key in sorted(by_key, key=lambda k: [str(v) for v in k]):
+            row = by_key[key]
+            totals[key] = totals.get(key, 0) + (row[accumulated] or 0)
+            row['cumulative'] = totals[key]
+            yield row
+
+
+def _section_aliases(model, using):
+    """Consent records are spread over the shards; everything else is on ``using``."""
+    if model is ConsentRecord and is_sharded():
+        return shard_aliases()
+    return [using]
+
+
+def summary_rows(name, start, end, using='default'):
+    """One summary section, computed on every shard in parallel and merged."""
+    aliases = _section_aliases(SUMMARY_SECTIONS[name][0], using)
+    if len(aliases) == 1:
+        return list(summary_queryset(name, start, end, aliases[0]))
+    parts = fan_out(lambda alias: {name: list(summary_queryset(name, start, end, alias))}, aliases)
+    return merge_summaries(parts, name)
+
+
+def series_rows(name, start, end, using='default'):
+    """Stream one series section, merging the shards' day-ordered rows."""
+    aliases = _section_aliases(SERIES_SECTIONS[name][0], using)
+    streams = [
+        series_queryset(name, start, end, alias).iterator(chunk_size=5000)
+        for alias in aliases
+    ]
+    if len(streams) == 1:
+        return streams[0]
+    return merge_series(name, *streams)
+
+
+def split_period(start, end, parts):
+    """Split ``[start, end)`` into up to ``parts`` ranges cut at UTC midnight."""
+    first_day = start.date() + timedelta(days=1)
+    days = (end.date() - first_day).days
+    if parts <= 1 or days < parts:
+        return [(start, end)]
+    step = days / parts
+    cuts = [
+        datetime.combine(first_day + timedelta(days=round(i * step)), dt_time.min, dt_timezone.utc)
+        for i in range(parts)
+    ]
+    bounds = [start] + cuts[1:] + [end]
+    return list(zip(bounds, bounds[1:]))
+
+
+def compute_range(args):
+    """Aggregate every section for one range; run inside pool workers."""
+    start, end, series, using = args
+    try:
+        result = {name: summary_rows(name, start, end, using) for name in SUMMARY_SECTIONS}
+        if series:
+            for name in SERIES_SECTIONS:
+                result[name] = list(series_rows(name, start, end, using))
+        return result
+    finally:
+        connections.close_all()
+
+
+def _row_key(row, measures):
+    return tuple((k, v) for k, v in row.items() if k not in measures)
+
+
+def merge_summaries(parts, name):
+    measures = set(SUMMARY_SECTIONS[name][3]())
+    merged = {}
+    for part in parts:
+        for row in part[name]:
+            key = _row_key(row, measures)
+            if key in merged:
+                for measure in measures:
+                    merged[key][measure] = (merged[key][measure] or 0) + (row[measure] or 0)
+            else:
+                merged[key] = dict(row)
+    return [merged[key] for key in sorted(merged, key=lambda k: [str(v) for _, v in k])]
+
+
+def chain_series(parts, name):
+    """Concatenate per-range series in order, carrying running totals across."""
+    keys = SERIES_SECTIONS[name][2]
+    offsets = {}
+    for part in parts:
+        last = {}
+        for row in part[name]:
+            key = tuple(row[k] for k in keys)
+            row['cumulative'] += offsets.get(key, 0)
+            last[key] = row['cumulative']
+            yield row
+        offsets.update(last)
+
+
+class PrivacyReport:
+    """
+    Compute a report over ``[start, end)``. Summaries are small and returned
+    as lists; series are generators that stream from the database.
+    """
+
+    def __init__(self, start, end, series=True, workers=1, using='default'):
+        self.start = start
+        self.end = end
+        self.include_series = series
+        self.workers = workers
+        self.using = using
+        self._parts = None
+
+        ranges = split_period(start, end, workers)
+        if len(ranges) > 1:
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(len(ranges)) as pool:
+                self._parts = pool.map(
+                    compute_range, [(s, e, series, using) for s, e in ranges]
+                )
+
+    def summaries(self):
+        if self._parts is not None:
+            summaries = {name: merge_summaries(self._parts, name) for name in SUMMARY_SECTIONS}
+        else:
+            summaries = {
+                name: summary_rows(name, self.start, self.end, self.using)
+                for name in SUMMARY_SECTIONS
+            }
+        for name in TALLIED_SECTIONS.intersection(SUMMARY_SECTIONS):
+            tallies = list(tally_summary_queryset(name, self.start, self.end, self.using))
+            if tallies:
+                summaries[name] = merge_summaries([summaries, {name: tallies}], name)
+        return summaries
+
+    def series(self):
+        """Yield ``(name, rows)`` for each daily series."""
+        if not self.include_series:
+            return
+        for name in SERIES_SECTIONS:
+            if self._parts is not None:
+                rows = chain_series(self._parts, name)
+            else:
+                rows = series_rows(name, self.start, self.end, self.using)
+            if name in TALLIED_SECTIONS:
+                tallies = tally_series_queryset(name, self.start, self.end, self.using)
+                if tallies.exists():
+                    rows = merge_series(name, rows, tallies.iterator())
+            yield name, rows
+
+
+class JSONReportWriter:
+    """Write a JSON object incrementally, one array element per line."""
+
+    def __init__(self, write):
+        self.write = write
+        self.first = True
+
+    def _key(self, key):
+        self.write(('{\n' if self.first else ',\n') + f'  {json.dumps(key)}: ')
+        self.first = False
+
+    def value(self, key, value):
+        self._key(key)
+        self.write(json.dumps(value, cls=DjangoJSONEncoder))
+
+    def rows(self, key, rows):
+        self._key(key)
+        self.write('[')
+        separator = '\n    '
+        for row in rows:
+            self.write(separator + json.dumps(row, cls=DjangoJSONEncoder))
+            separator = ',\n    '
+        self.write('\n  ]')
+
+    def close(self):
+        self.write('{}\n' if self.first else '\n}\n')
+
+
+class CSVReportWriter:
+    """Write every section as long-format rows of one CSV table."""
+
+    COLUMNS = ['section', 'day', 'key', 'total', 'granted', 'count', 'affected_records', 'cumulative']
+    MEASURES = COLUMNS[3:]
+
+    def __init__(self, write):
+        self.write = write
+        self.writer = csv.writer(self)
+        self.writer.writerow(self.COLUMNS)
+
+    def value(self, key, value):
+        if not isinstance(value, dict):
+            self.writer.writerow([key, '', '', '', '', value, '', ''])
+
+    def rows(self, key, rows):
+        for row in rows:
+            dimensions = [str(v) for k, v in row.items() if k not in self.MEASURES and k != 'day']
+            self.writer.writerow(
+                [key, row.get('day', ''), '/'.join(dimensions)]
+                + [row.get(measure, '') for measure in self.MEASURES]
+            )
+
+    def close(self):
+        pass
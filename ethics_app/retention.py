@@ -0,0 +1,220 @@
+"""
+Retention policy engine.
+
+Every ``DataProcessingActivity`` names the data categories it uses, its
+legal basis and a retention period. ``compile_plans`` turns those into one
+deletion plan per category (and, for consent records, per legal basis),
+keeping the longest period any activity needs. Each plan filters on an
+indexed date column, is estimated with ``COUNT`` and ``EXPLAIN`` before
+anything is deleted, and deletes in primary-key batches so locks stay short.
+Plans on different tables, and on different consent shards, run
+concurrently; plans on the same table run one after another.
+"""
+import copy
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BreachSubject, ConsentRecord, DataProcessingActivity, DataSubjectRequest
+from .sharding import is_sharded, shard_aliases
+
+# category: (model, date column, extra filter, column matched against the activity's legal basis)
+CATEGORIES = {
+    'consent_records': (ConsentRecord, 'timestamp', Q(), 'legal_basis'),
+    'data_subject_requests': (DataSubjectRequest, 'created_at', Q(status__in=['completed', 'rejected']), None),
+    'sessions': (Session, 'expire_date', Q(), None),
+    'breach_subjects': (BreachSubject, 'notified_at', Q(notified_at__isnull=False), None),
+}
+
+
+def normalize_category(name):
+    return re.sub(r'[^a-z0-9]+', '_', name.strip().lower()).strip('_')
+
+
+def parse_categories(text):
+    """Split an activity's free-text ``data_categories`` into normalized names."""
+    return [normalize_category(part) for part in re.split(r'[,;\n]', text) if part.strip()]
+
+
+def _is_indexed(model, field_name):
+    field = model._meta.get_field(field_name)
+    if field.db_index or field.unique or field.primary_key:
+        return True
+    for index in model._meta.indexes:
+        if index.fields and index.fields[0].lstrip('-') == field_name:
+            return True
+    return False
+
+
+class RetentionPlan:
+    """Delete rows of one model whose ``date_field`` is older than ``days``."""
+
+    def __init__(self, category, model, date_field, days, base_filter=Q(),
+                 legal_basis_field=None, legal_basis=None, activities=(), alias=None):
+        self.category = category
+        self.model = model
+        self.date_field = date_field
+        self.days = days
+        self.base_filter = base_filter
+        self.legal_basis_field = legal_basis_field
+        self.legal_basis = legal_basis
+        self.activities = list(activities)
+        # database the rows live on when it is not the caller's (consent shards)
+        self.alias = alias
+
+    def __repr__(self):
+        return f'<RetentionPlan {self.label}>'
+
+    @property
+    def label(self):
+        label = self.category
+        if self.legal_basis:
+            label += f' ({self.legal_basis})'
+        if self.alias:
+            label += f' [{self.alias}]'
+        return label
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def indexed(self):
+        return _is_indexed(self.model, self.date_field)
+
+    def queryset(self, now, using='default'):
+        using = self.alias or using
+        lookups = {f'{self.date_field}__lt': now - timedelta(days=self.days)}
+        if self.legal_basis_field and self.legal_basis:
+            lookups[f'{self.legal_basis_field}__iexact'] = self.legal_basis
+        return self.model._default_manager.using(using).filter(self.base_filter, **lookups)
+
+    def estimate(self, now, batch_size, using='default'):
+        queryset = self.queryset(now, using)
+        rows = queryset.count()
+        try:
+            explain = queryset.only('pk').explain()
+        except Exception as e:
+            explain = f'unavailable: {e}'
+        return {
+            'rows': rows,
+            'batches': math.ceil(rows / batch_size),
+            'indexed': self.indexed,
+            'explain': explain,
+        }
+
+    def execute(self, now, batch_size, using='default'):
+        """Delete matching rows in primary-key batches; returns the number deleted."""
+        using = self.alias or using
+        queryset = self.queryset(now, using)
+        manager = self.model._default_manager.db_manager(using)
+        deleted = 0
+        while True:
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            with transaction.atomic(using=using):
+                count, _ = manager.filter(pk__in=pks).delete()
+            deleted += count
+
+
+def compile_plans(activities=None, default_days=None):
+    """
+    Build deletion plans from processing activities. Returns ``(plans, unknown)``
+    where ``unknown`` maps unrecognised category names to the activities using them.
+
+    Expired consent records are always swept, and completed or rejected data
+    subject requests fall back to ``default_days`` (``DATA_RETENTION_DAYS``)
+    when no activity covers them.
+    """
+    if activities is None:
+        activities = DataProcessingActivity.objects.order_by('id')
+    if default_days is None:
+        default_days = getattr(settings, 'DATA_RETENTION_DAYS', 365)
+
+    plans = {}
+    unknown = {}
+    for activity in activities:
+        for category in parse_categories(activity.data_categories):
+            if category not in CATEGORIES:
+                unknown.setdefault(category, []).append(activity.name)
+                continue
+            model, date_field, base_filter, basis_field = CATEGORIES[category]
+            basis = activity.legal_basis.strip().lower() if basis_field else None
+            plan = plans.get((category, basis))
+            if plan is None:
+                plan = plans[(category, basis)] = RetentionPlan(
+                    category, model, date_field, activity.retention_period, base_filter,
+                    legal_basis_field=basis_field, legal_basis=basis,
+                )
+            # data kept for several purposes lives as long as the longest one needs
+            plan.days = max(plan.days, activity.retention_period)
+            plan.activities.append(activity.name)
+
+    compiled = [RetentionPlan('expired_consents', ConsentRecord, 'expiry_date', 0)]
+    if not any(category == 'data_subject_requests' for category, _ in plans):
+        model, date_field, base_filter, _ = CATEGORIES['data_subject_requests']
+        compiled.append(RetentionPlan('data_subject_requests', model, date_field, default_days, base_filter))
+    compiled.extend(plans.values())
+    return [shard_plan for plan in compiled for shard_plan in _per_shard(plan)], unknown
+
+
+def _per_shard(plan):
+    if plan.model is not ConsentRecord or not is_sharded():
+        return [plan]
+    plans = []
+    for alias in shard_aliases():
+        shard_plan = copy.copy(plan)
+        shard_plan.alias = alias
+        plans.append(shard_plan)
+    return plans
+
+
+def group_by_table(plans, using='default'):
+    groups = {}
+    for plan in plans:
+        groups.setdefault((plan.alias or using, plan.table), []).append(plan)
+    return list(groups.values())
+
+
+def estimate_plans(plans, now=None, batch_size=1000, using='default'):
+    now = now or timezone.now()
+    return [(plan, plan.estimate(now, batch_size, using)) for plan in plans]
+
+
+def _run_group(group, now, batch_size, using):
+    try:
+        return [(plan, plan.execute(now, batch_size, using)) for plan in group]
+    finally:
+        connections.close_all()
+
+
+def run_plans(plans, now=None, batch_size=1000, workers=4, using='default'):
+    """
+    Execute plans, one thread per table and database. SQLite allows a single
+    writer per database file, so all plans on one SQLite database share a
+    thread. Returns ``[(plan, deleted)]``.
+    """
+    now = now or timezone.now()
+    groups = []
+    by_sqlite_database = {}
+    for group in group_by_table(plans, using):
+        alias = group[0].alias or using
+        if connections[alias].vendor == 'sqlite':
+            by_sqlite_database.setdefault(alias, []).extend(group)
+        else:
+            groups.append(group)
+    groups.extend(by_sqlite_database.values())
+
+    if workers <= 1 or len(groups) <= 1:
+        return [(plan, plan.execute(now, batch_size, using)) for group in groups for plan in group]
+    with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+        futures = [pool.submit(_run_group, group, now, batch_size, using) for group in groups]
+        return [result for future in futures for result in future.result()]
@@ -0,0 +1,326 @@
+"""
+Full-text search over data subject requests.
+
+The DPO team triages and de-duplicates requests by searching their
+requester's name, email address and description. ``search_requests``
+finds the requests containing every word of a query, the last of which may
+be the start of a word, as it is while the query is typed. The newest
+``REQUEST_SEARCH_CANDIDATES`` matches are ranked, names and addresses
+weighing more than descriptions, so a word that appears in most requests
+costs no more to search for than a rare one. The work is done by a backend
+chosen for the database (``REQUEST_SEARCH_BACKEND`` overrides the choice
+with a dotted path):
+
+* ``FTS5Backend`` (SQLite): a contentless FTS5 index, so the text is not
+  stored twice. Requests have UUID keys and their rowids may be renumbered
+  by ``VACUUM``, so the index is keyed on the ``INTEGER PRIMARY KEY`` of a
+  small table numbering the requests, whose values ``VACUUM`` keeps.
+  Triggers keep both in step with every insert, delete and text change,
+  including bulk ones. Migrations that rebuild the request table drop its
+  triggers; run ``reindex_requests`` after them.
+* ``PostgresBackend``: a GIN index on a weighted ``tsvector`` expression,
+  which PostgreSQL maintains itself.
+* ``ScanBackend`` (anything else): ``icontains`` filters, newest first. No
+  index, so every search reads the whole table.
+"""
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import DataSubjectRequest
+
+FIELDS = ('full_name', 'email', 'description')
+WEIGHTS = {'full_name': 10.0, 'email': 10.0, 'description': 1.0}
+
+# Letters and digits, as the FTS5 unicode61 tokenizer sees words
+_WORD = re.compile(r'[^\W_]+')
+
+
+def words(query, limit=16):
+    return _WORD.findall(query.lower())[:limit]
+
+
+class SearchBackend:
+    """Indexes and searches the requests stored on one database alias."""
+
+    name = 'custom'
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.connection = connections[using]
+        self.meta = DataSubjectRequest._meta
+
+    def quoted(self, name):
+        return self.connection.ops.quote_name(name)
+
+    @property
+    def table(self):
+        return self.quoted(self.meta.db_table)
+
+    @property
+    def columns(self):
+        return [self.quoted(self.meta.get_field(name).column) for name in FIELDS]
+
+    def where(self, filters):
+        """SQL conditions and parameters for ``field=value`` filters on the request table."""
+        clauses, params = [], []
+        for name, value in filters.items():
+            clauses.append(f'r.{self.quoted(self.meta.get_field(name).column)} = %s')
+            params.append(value)
+        return ''.join(f' AND {clause}' for clause in clauses), params
+
+    def install(self):
+        """Create the index if it does not exist."""
+
+    def uninstall(self):
+        """Drop the index."""
+
+    def reindex(self, batch_size=10_000, progress=None):
+        """Rebuild the index from the request table. Returns the number of requests indexed."""
+        return 0
+
+    def check(self):
+        """Raise an error if the index disagrees with the request table."""
+
+    def search(self, terms, limit, offset=0, candidates=1000, **filters):
+        """
+        Return ``(pk, rank)`` pairs for requests matching every term, the
+        best of the newest ``candidates`` first.
+        """
+        raise NotImplementedError
+
+
+class FTS5Backend(SearchBackend):
+    name = 'fts5'
+
+    @property
+    def index(self):
+        return self.quoted(f'{self.meta.db_table}_fts')
+
+    @property
+    def docs(self):
+        """The table numbering requests: ``docid INTEGER PRIMARY KEY``, ``request_id``."""
+        return self.quoted(f'{self.meta.db_table}_fts_docs')
+
+    @property
+    def pk(self):
+        return self.quoted(self.meta.pk.column)
+
+    def _trigger(self, event):
+        return self.quoted(f'{self.meta.db_table}_fts_{event}')
+
+    def install(self):
+        index, table, docs, pk = self.index, self.table, self.docs, self.pk
+        columns = ', '.join(self.columns)
+        new = ', '.join(f'new.{column}' for column in self.columns)
+        old = ', '.join(f'old.{column}' for column in self.columns)
+        new_docid = f'(SELECT docid FROM {docs} WHERE request_id = new.{pk})'
+        old_docid = f'(SELECT docid FROM {docs} WHERE request_id = old.{pk})'
+        # a contentless index forgets the text, so deleting it takes the old values
+        delete_old = f"INSERT INTO {index}({index}, rowid, {columns}) VALUES ('delete', {old_docid}, {old});"
+        insert_new = f'INSERT INTO {index}(rowid, {columns}) VALUES ({new_docid}, {new});'
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {docs} ('
+                f'docid INTEGER PRIMARY KEY, request_id {self.meta.pk.db_type(self.connection)} NOT NULL UNIQUE)'
+            )
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({columns}, content='', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self._trigger('insert')} AFTER INSERT ON {table} "
+                f"BEGIN INSERT INTO {docs}(request_id) VALUES (new.{pk}); {insert_new} END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self._trigger('delete')} AFTER DELETE ON {table} "
+                f"BEGIN {delete_old} DELETE FROM {docs} WHERE request_id = old.{pk}; END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self._trigger('update')} AFTER UPDATE OF {columns} ON {table} "
+                f"BEGIN {delete_old} {insert_new} END"
+            )
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for event in ('insert', 'delete', 'update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {self._trigger(event)}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.index}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.docs}')
+
+    def reindex(self, batch_size=10_000, progress=None):
+        """
+        Number the requests that have no docid yet, oldest first, then index
+        them in docid batches, each in its own transaction, so that request
+        writes only wait for one batch at a time. Requests created meanwhile
+        are numbered and indexed by the triggers.
+        """
+        self.install()
+        index, table, docs, pk = self.index, self.table, self.docs, self.pk
+        columns = ', '.join(self.columns)
+        created_at = self.quoted(self.meta.get_field('created_at').column)
+        with transaction.atomic(using=self.using), self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('delete-all')")
+            cursor.execute(f'DELETE FROM {docs} WHERE request_id NOT IN (SELECT {pk} FROM {table})')
+            cursor.execute(
+                f'INSERT INTO {docs}(request_id) SELECT {pk} FROM {table} '
+                f'WHERE {pk} NOT IN (SELECT request_id FROM {docs}) ORDER BY {created_at}'
+            )
+            cursor.execute(f'SELECT max(docid) FROM {docs}')
+            last_docid = cursor.fetchone()[0] or 0
+
+        done, after = 0, 0
+        while after < last_docid:
+            with transaction.atomic(using=self.using), self.connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT docid FROM {docs} WHERE docid > %s AND docid <= %s ORDER BY docid LIMIT 1 OFFSET %s',
+                    [after, last_docid, batch_size - 1],
+                )
+                row = cursor.fetchone()
+                upto = row[0] if row else last_docid
+                cursor.execute(
+                    f'INSERT INTO {index}(rowid, {columns}) '
+                    f'SELECT d.docid, {", ".join(f"r.{column}" for column in self.columns)} '
+                    f'FROM {docs} d JOIN {table} r ON r.{pk} = d.request_id WHERE d.docid > %s AND d.docid <= %s',
+                    [after, upto],
+                )
+                done += cursor.rowcount
+            after = upto
+            if progress:
+                progress(done)
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('optimize')")
+        return done
+
+    def check(self):
+        index, table, docs, pk = self.index, self.table, self.docs, self.pk
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {index}({index}, rank) VALUES ('integrity-check', 1)")
+            # the index keeps no text to compare, but every request must have its docid
+            cursor.execute(
+                f'SELECT (SELECT count(*) FROM {table} WHERE {pk} NOT IN (SELECT request_id FROM {docs})), '
+                f'(SELECT count(*) FROM {docs} WHERE request_id NOT IN (SELECT {pk} FROM {table}))'
+            )
+            unnumbered, stale = cursor.fetchone()
+        if unnumbered or stale:
+            raise DatabaseError(f'{unnumbered} requests are not indexed and {stale} deleted ones still are')
+
+    def search(self, terms, limit, offset=0, candidates=1000, **filters):
+        index = self.index
+        weights = ', '.join(str(WEIGHTS[name]) for name in FIELDS)
+        conditions, params = self.where(filters)
+        # "john smi" finds John Smith. A prefix makes FTS5 read every
+        # posting of the words it covers, so only the last term is one.
+        match = ' '.join(f'"{term}"' for term in terms) + '*'
+        # Newest first (docids follow creation), FTS5 stops reading postings
+        # after the candidates; ranking every match would score all of them.
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT pk, score FROM ('
+                f'SELECT r.{self.pk} AS pk, bm25({index}, {weights}) AS score '
+                f'FROM {index} JOIN {self.docs} d ON d.docid = {index}.rowid '
+                f'JOIN {self.table} r ON r.{self.pk} = d.request_id '
+                f'WHERE {index} MATCH %s{conditions} ORDER BY {index}.rowid DESC LIMIT %s'
+                f') ORDER BY score LIMIT %s OFFSET %s',
+                [match, *params, candidates, limit, offset],
+            )
+            # bm25 scores are negative, better matches lower
+            return [(self.meta.pk.to_python(pk), -score) for pk, score in cursor.fetchall()]
+
+
+class PostgresBackend(SearchBackend):
+    name = 'postgresql'
+
+    @property
+    def index(self):
+        return self.quoted(f'{self.meta.db_table}_search')
+
+    def document(self, alias=''):
+        # Email addresses are split like FTS5 splits them, so that "doe"
+        # finds jane.doe@example.com; the default parser keeps them whole.
+        name, email, description = (f'{alias}{column}' for column in self.columns)
+        return (
+            f"(setweight(to_tsvector('simple', {name}), 'A') || "
+            f"setweight(to_tsvector('simple', translate({email}, '.@+-_', '     ')), 'A') || "
+            f"setweight(to_tsvector('simple', {description}), 'D'))"
+        )
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {self.index} ON {self.table} USING gin ({self.document()})')
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX IF EXISTS {self.index}')
+
+    def reindex(self, batch_size=10_000, progress=None):
+        self.install()
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'REINDEX INDEX {self.index}')
+            cursor.execute(f'SELECT count(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    def search(self, terms, limit, offset=0, candidates=1000, **filters):
+        document = self.document('r.')
+        conditions, params = self.where(filters)
+        query = ' & '.join(terms) + ':*'
+        created_at = self.quoted(self.meta.get_field('created_at').column)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT pk, score FROM ('
+                f'SELECT r.{self.quoted(self.meta.pk.column)} AS pk, ts_rank({document}, q) AS score '
+                f"FROM {self.table} r, to_tsquery('simple', %s) q "
+                f'WHERE {document} @@ q{conditions} ORDER BY r.{created_at} DESC LIMIT %s'
+                f') candidates ORDER BY score DESC LIMIT %s OFFSET %s',
+                [query, *params, candidates, limit, offset],
+            )
+            return cursor.fetchall()
+
+
+class ScanBackend(SearchBackend):
+    name = 'scan'
+
+    def search(self, terms, limit, offset=0, candidates=1000, **filters):
+        queryset = DataSubjectRequest.objects.using(self.using).filter(**filters)
+        for term in terms:
+            queryset = queryset.filter(
+                Q(full_name__icontains=term) | Q(email__icontains=term) | Q(description__icontains=term)
+            )
+        pks = queryset.order_by('-created_at').values_list('pk', flat=True)[offset:offset + limit]
+        return [(pk, None) for pk in pks]
+
+
+BACKENDS = {'sqlite': FTS5Backend, 'postgresql': PostgresBackend}
+
+
+def backend_for(using=DEFAULT_DB_ALIAS):
+    path = getattr(settings, 'REQUEST_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)(using)
+    return BACKENDS.get(connections[using].vendor, ScanBackend)(using)
+
+
+def search_requests(query, limit=20, offset=0, using=None, **filters):
+    """
+    Requests matching every word of ``query``, the best of the newest
+    matches first, each with a ``search_rank`` (higher is better; None from
+    ``ScanBackend``).
+    ``filters`` are exact matches on request fields, such as ``status``.
+    """
+    terms = words(query)
+    if not terms:
+        return []
+    using = using or router.db_for_read(DataSubjectRequest)
+    candidates = max(getattr(settings, 'REQUEST_SEARCH_CANDIDATES', 1000), offset + limit)
+    ranked = backend_for(using).search(terms, limit, offset, candidates, **filters)
+    requests = DataSubjectRequest.objects.using(using).in_bulk([pk for pk, _ in ranked])
+    results = []
+    for pk, rank in ranked:
+        if pk in requests:
+            requests[pk].search_rank = rank
+            results.append(requests[pk])
+    return results
@@ -0,0 +1,465 @@
+"""
+Synthetic data generation for load and capacity testing.
+
+Rows are generated as plain tuples in ID-range shards so that generation can
+be spread over a process pool, then written by the parent process either with
+batched ``bulk_create`` or, on SQLite, with raw ``executemany`` under
+fast-insert pragmas. Tables with ``auto_now_add`` dates always take raw
+inserts, so they keep their generated history. Consent records go to their
+subjects' consent shards.
+"""
+import functools
+import ipaddress
+import multiprocessing
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import identity
+from .breach import LANGUAGE_BY_COUNTRY
+from .models import ConsentRecord, DataBreach, DataSubjectRequest, PrivacyPolicy
+from .search import backend_for
+from .sharding import is_sharded, shard_for
+
+CONSENT_FIELDS = [
+    'id', 'user_id', 'session_key', 'ip_address', 'consent_type',
+    'consent_given', 'timestamp', 'expiry_date', 'legal_basis', 'country', 'policy_id',
+]
+SESSION_FIELDS = ['session_key', 'session_data', 'expire_date']
+USER_FIELDS = [
+    'id', 'username', 'email', 'first_name', 'last_name', 'password',
+    'is_active', 'is_staff', 'is_superuser', 'date_joined',
+]
+REQUEST_FIELDS = [
+    'id', 'request_type', 'email', 'full_name', 'description', 'status',
+    'created_at', 'processed_at', 'response',
+]
+BREACH_FIELDS = [
+    'breach_type', 'severity', 'description', 'affected_records', 'detection_date',
+    'notification_required', 'authority_notified', 'subjects_notified',
+    'notifications_sent', 'notifications_failed',
+]
+
+FIRST_NAMES = ['Amira', 'Lucas', 'Elif', 'Omar', 'Chloe', 'Mehmet', 'Yasmin', 'Hugo', 'Zeynep', 'Karim']
+LAST_NAMES = ['Haddad', 'Martin', 'Yilmaz', 'Mansour', 'Dubois', 'Kaya', 'Saleh', 'Bernard', 'Demir', 'Nasser']
+EMAIL_DOMAINS = ['example.com', 'example.org', 'example.net', 'mail.test']
+COUNTRY_WEIGHTS = [
+    ('TR', 22), ('FR', 18), ('DE', 12), ('EG', 10), ('SA', 8), ('GB', 8),
+    ('US', 7), ('AE', 5), ('MA', 4), ('NL', 3), ('', 3),
+]
+
+# Visitor behaviour on the cookie banner: (weight, grant probability per type)
+CONSENT_PROFILES = [
+    (0.55, {'functional': 1.0, 'analytics': 1.0, 'marketing': 1.0}),   # accept all
+    (0.30, {'functional': 1.0, 'analytics': 0.0, 'marketing': 0.0}),   # essential only
+    (0.15, {'functional': 0.9, 'analytics': 0.5, 'marketing': 0.2}),   # customised
+]
+REQUEST_TYPE_WEIGHTS = [
+    ('access', 45), ('erasure', 30), ('rectification', 10),
+    ('portability', 7), ('objection', 5), ('restriction', 3),
+]
+SEVERITY_WEIGHTS = [('low', 50), ('medium', 30), ('high', 15), ('critical', 5)]
+
+USER_SHARE = 10  # every Nth consent subject is an account holder
+
+
+def _skewed_age(rng, history_days):
+    """Age in seconds, skewed towards recent activity."""
+    return rng.betavariate(1, 3) * history_days * 86400
+
+
+def _ip_address(rng):
+    if rng.random() < 0.05:
+        return str(ipaddress.IPv6Address(rng.getrandbits(128)))
+    return f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+
+
+def _choose(rng, weighted):
+    choices, weights = zip(*weighted)
+    return rng.choices(choices, weights)[0]
+
+
+def consent_shard(shard):
+    """
+    Generate consent and session rows for subjects ``[start, end)``. Each shard
+    has its own RNG stream so output does not depend on the worker count.
+    Consents are given under the active policy of their country's language,
+    so they do not count as recorded before policy versions were tracked.
+    """
+    start, end, seed, first_user_id, user_count, now, history_days, session_data, policy_ids = shard
+    rng = random.Random(f'{seed}:consents:{start}')
+    expiry = timedelta(days=settings.CONSENT_EXPIRY_DAYS)
+    session_age = timedelta(seconds=settings.SESSION_COOKIE_AGE)
+    profiles = [profile for _, profile in CONSENT_PROFILES]
+    profile_weights = [weight for weight, _ in CONSENT_PROFILES]
+
+    consents = []
+    sessions = []
+    for subject in range(start, end):
+        user_id = None
+        session_key = None
+        if subject % USER_SHARE == 0 and subject // USER_SHARE < user_count:
+            user_id = first_user_id + subject // USER_SHARE
+        else:
+            session_key = '%032x' % rng.getrandbits(128)
+
+        timestamp = now - timedelta(seconds=_skewed_age(rng, history_days))
+        if session_key is not None:
+            sessions.append((session_key, session_data, timestamp + session_age))
+
+        profile = rng.choices(profiles, profile_weights)[0]
+        ip_address = _ip_address(rng)
+        country = _choose(rng, COUNTRY_WEIGHTS)
+        language = LANGUAGE_BY_COUNTRY.get(country, settings.LANGUAGE_CODE)
+        policy_id = policy_ids.get(language, policy_ids.get(settings.LANGUAGE_CODE))
+        consent_types = list(profile)
+        if user_id is not None and rng.random() < 0.5:
+            consent_types.append('data_processing')
+        for consent_type in consent_types:
+            consents.append((
+                uuid.UUID(int=rng.getrandbits(128), version=4),
+                user_id,
+                session_key,
+                ip_address,
+                consent_type,
+                rng.random() < profile.get(consent_type, 1.0),
+                timestamp,
+                timestamp + expiry,
+                'consent',
+                country,
+                policy_id,
+            ))
+    return consents, sessions
+
+
+def user_email(user_id):
+    return f'user{user_id}@{EMAIL_DOMAINS[user_id % len(EMAIL_DOMAINS)]}'
+
+
+def user_shard(shard):
+    """Generate users with primary keys ``[start, end)``."""
+    start, end, seed, now, history_days, password = shard
+    rng = random.Random(f'{seed}:users:{start}')
+    rows = []
+    for user_id in range(start, end):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        rows.append((
+            user_id,
+            f'seed_{user_id}',
+            user_email(user_id),
+            first_name,
+            last_name,
+            password,
+            True,
+            False,
+            False,
+            now - timedelta(seconds=_skewed_age(rng, history_days)),
+        ))
+    return rows
+
+
+def request_shard(shard):
+    start, end, seed, first_user_id, user_count, now, history_days = shard
+    rng = random.Random(f'{seed}:requests:{start}')
+    rows = []
+    for n in range(start, end):
+        request_type = _choose(rng, REQUEST_TYPE_WEIGHTS)
+        created_at = now - timedelta(seconds=_skewed_age(rng, history_days))
+        age_days = (now - created_at).days
+        if age_days > 30:
+            status = 'completed' if rng.random() < 0.9 else 'rejected'
+        else:
+            status = _choose(rng, [('pending', 50), ('processing', 20), ('completed', 25), ('rejected', 5)])
+        processed_at = None
+        response = ''
+        if status in ('completed', 'rejected'):
+            processed_at = created_at + timedelta(days=rng.uniform(0.1, 30))
+            response = f'Request type {request_type} processed'
+
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        if user_count and rng.random() < 0.7:
+            email = user_email(first_user_id + rng.randrange(user_count))
+        else:
+            email = f'{first_name}.{last_name}.r{n}@{rng.choice(EMAIL_DOMAINS)}'.lower()
+        rows.append((
+            uuid.UUID(int=rng.getrandbits(128), version=4),
+            request_type,
+            email,
+            f'{first_name} {last_name}',
+            f'Please handle my {request_type} request regarding my personal data.',
+            status,
+            created_at,
+            processed_at,
+            response,
+        ))
+    return rows
+
+
+def breach_shard(shard):
+    start, end, seed, now, history_days = shard
+    rng = random.Random(f'{seed}:breaches:{start}')
+    breach_types = [choice for choice, _ in DataBreach.BREACH_TYPES]
+    rows = []
+    for n in range(start, end):
+        severity = _choose(rng, SEVERITY_WEIGHTS)
+        detection_date = now - timedelta(seconds=_skewed_age(rng, history_days))
+        notified = (now - detection_date).days > 3
+        rows.append((
+            rng.choice(breach_types),
+            severity,
+            f'Synthetic {severity} breach #{n}',
+            min(int(rng.paretovariate(1.2) * 10), 10_000_000),
+            detection_date,
+            severity != 'low',
+            notified and severity != 'low',
+            notified and severity in ('high', 'critical'),
+            0,
+            0,
+        ))
+    return rows
+
+
+def _sqlite_rows(rows):
+    """Convert generated values to what the SQLite backend stores."""
+    converted = []
+    for row in rows:
+        values = []
+        for value in row:
+            if isinstance(value, datetime):
+                value = str(value.astimezone(dt_timezone.utc).replace(tzinfo=None))
+            elif isinstance(value, uuid.UUID):
+                value = value.hex
+            values.append(value)
+        converted.append(values)
+    return converted
+
+
+def _generate(func, fast, shard):
+    """Run a shard generator, preparing rows for raw inserts in the worker."""
+    result = func(shard)
+    if not fast:
+        return result
+    if isinstance(result, tuple):
+        return tuple(_sqlite_rows(rows) for rows in result)
+    return _sqlite_rows(result)
+
+
+class Seeder:
+    """
+    Generate and insert a synthetic dataset.
+
+    ``workers`` > 1 generates shards in a forked process pool; ``fast`` writes
+    with raw ``executemany`` and relaxed durability pragmas on SQLite.
+    """
+
+    FAST_PRAGMAS = {
+        'synchronous': 'OFF',
+        'journal_mode': 'MEMORY',
+        'temp_store': 'MEMORY',
+        'cache_size': '-262144',
+    }
+
+    def __init__(self, seed=0, batch_size=10_000, shard_size=50_000, workers=1,
+                 fast=False, history_days=730, using='default', stdout=None):
+        self.seed = seed
+        self.batch_size = batch_size
+        self.shard_size = shard_size
+        self.workers = workers
+        self.using = using
+        self.connection = connections[using]
+        self.consent_aliases = sorted(set(settings.CONSENT_SHARDS)) if is_sharded() else [using]
+        self.fast = fast and all(
+            connections[alias].vendor == 'sqlite' for alias in {using, *self.consent_aliases}
+        )
+        self.history_days = history_days
+        self.stdout = stdout
+        self.now = timezone.now()
+        self.counts = {}
+
+    def _report(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def _shards(self, total):
+        for start in range(0, total, self.shard_size):
+            yield start, min(start + self.shard_size, total)
+
+    def _map(self, func, shards):
+        func = functools.partial(_generate, func, self.fast)
+        if self.workers <= 1:
+            return map(func, shards)
+        pool = multiprocessing.get_context('fork').Pool(self.workers)
+        self._pools.append(pool)
+        return pool.imap(func, shards)
+
+    def _write(self, model, fields, rows, using=None):
+        """
+        Insert ``rows`` (tuples ordered like ``fields``) in batches. Models
+        with ``auto_now_add`` dates among ``fields`` are inserted raw too, as
+        ``bulk_create`` would overwrite the generated dates with "now".
+        """
+        if not rows:
+            return
+        using = using or self.using
+        meta = model._meta
+        keeps_dates = any(getattr(meta.get_field(name), 'auto_now_add', False) for name in fields)
+        if self.fast or keeps_dates:
+            connection = connections[using]
+            if not self.fast:
+                # fast rows were converted for SQLite in the worker; these go through their fields
+                prepared = [meta.get_field(name) for name in fields]
+                rows = [
+                    [field.get_db_prep_save(value, connection) for field, value in zip(prepared, row)]
+                    for row in rows
+                ]
+            columns = ', '.join(
+                connection.ops.quote_name(meta.get_field(name).column) for name in fields
+            )
+            sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                connection.ops.quote_name(meta.db_table),
+                columns,
+                ', '.join(['%s'] * len(fields)),
+            )
+            with connection.cursor() as cursor:
+                for i in range(0, len(rows), self.batch_size):
+                    cursor.executemany(sql, rows[i:i + self.batch_size])
+        else:
+            model.objects.using(using).bulk_create(
+                (model(**dict(zip(fields, row))) for row in rows),
+                batch_size=self.batch_size,
+            )
+        self.counts[model._meta.label] = self.counts.get(model._meta.label, 0) + len(rows)
+
+    def _apply_pragmas(self):
+        previous = {}
+        for alias in {self.using, *self.consent_aliases}:
+            previous[alias] = {}
+            with connections[alias].cursor() as cursor:
+                for pragma, value in self.FAST_PRAGMAS.items():
+                    cursor.execute(f'PRAGMA {pragma}')
+                    previous[alias][pragma] = cursor.fetchone()[0]
+                    cursor.execute(f'PRAGMA {pragma} = {value}')
+        return previous
+
+    def _restore_pragmas(self, previous):
+        for alias, pragmas in previous.items():
+            with connections[alias].cursor() as cursor:
+                for pragma, value in pragmas.items():
+                    cursor.execute(f'PRAGMA {pragma} = {value}')
+
+    def run(self, consents, users=None, requests=None, breaches=None, sessions=True):
+        """
+        Seed roughly ``consents`` consent records; other tables default to
+        counts proportional to it. Returns the number of rows per model.
+        """
+        subjects = max(consents // 3, 1)
+        users = subjects // USER_SHARE if users is None else users
+        requests = consents // 100 if requests is None else requests
+        breaches = max(consents // 100_000, 1) if breaches is None else breaches
+
+        self._pools = []
+        previous_pragmas = self._apply_pragmas() if self.fast else None
+        try:
+            first_user_id = self._seed_users(users)
+            self._seed_consents(subjects, first_user_id, users, sessions)
+            self._seed_requests(requests, first_user_id, users)
+            self._seed_rows('data breaches', DataBreach, BREACH_FIELDS, breach_shard, breaches,
+                            lambda start, end: (start, end, self.seed, self.now,
+                                                self.history_days))
+            self._index_subjects()
+        finally:
+            for pool in self._pools:
+                pool.terminate()
+            if previous_pragmas:
+                self._restore_pragmas(previous_pragmas)
+        return self.counts
+
+    def _seed_rows(self, label, model, fields, func, total, shard_args):
+        started = time.perf_counter()
+        shards = (shard_args(start, end) for start, end in self._shards(total))
+        for rows in self._map(func, shards):
+            with transaction.atomic(using=self.using):
+                self._write(model, fields, rows)
+        self._report_rate(label, total, started)
+
+    def _seed_requests(self, total, first_user_id, users):
+        search_index = backend_for(self.using)
+        if self.fast:
+            # one rebuild of the search index costs less than its triggers firing for every row
+            search_index.uninstall()
+        try:
+            self._seed_rows('data subject requests', DataSubjectRequest, REQUEST_FIELDS,
+                            request_shard, total,
+                            lambda start, end: (start, end, self.seed, first_user_id, users,
+                                                self.now, self.history_days))
+        finally:
+            if self.fast:
+                started = time.perf_counter()
+                indexed = search_index.reindex()
+                self._report_rate('data subject requests into the search index', indexed, started)
+
+    def _index_subjects(self):
+        # rows were written without signals, so the identity index is built in bulk
+        started = time.perf_counter()
+        users, requests = identity.rebuild(self.batch_size, using=self.using)
+        self._report_rate('users and requests into the subject index', users + requests, started)
+
+    def _seed_users(self, total):
+        first_id = (User.objects.using(self.using).aggregate(Max('id'))['id__max'] or 0) + 1
+        password = make_password(None)
+        self._seed_rows('users', User, USER_FIELDS, user_shard, total,
+                        lambda start, end: (start + first_id, end + first_id, self.seed,
+                                            self.now, self.history_days, password))
+        return first_id
+
+    def _seed_consents(self, subjects, first_user_id, user_count, sessions):
+        started = time.perf_counter()
+        session_data = SessionStore().encode({})
+        shards = (
+            (start, end, self.seed, first_user_id, user_count, self.now,
+             self.history_days, session_data, self._policy_ids())
+            for start, end in self._shards(subjects)
+        )
+        total = 0
+        for consent_rows, session_rows in self._map(consent_shard, shards):
+            if sessions:
+                with transaction.atomic(using=self.using):
+                    self._write(Session, SESSION_FIELDS, session_rows)
+            for alias, rows in self._by_consent_shard(consent_rows).items():
+                with transaction.atomic(using=alias):
+                    self._write(ConsentRecord, CONSENT_FIELDS, rows, alias)
+            total += len(consent_rows)
+        self._report_rate('consent records', total, started)
+
+    def _policy_ids(self):
+        """ID of the active policy of each language; the latest takes effect, as in ``CurrentPolicies``."""
+        return dict(
+            PrivacyPolicy.objects.using(self.using).filter(is_active=True)
+            .order_by('effective_date').values_list('language', 'id')
+        )
+
+    def _by_consent_shard(self, rows):
+        if not is_sharded():
+            return {self.using: rows}
+        by_shard = {}
+        for row in rows:
+            # rows start (id, user_id, session_key, ...)
+            by_shard.setdefault(shard_for(row[1], row[2]), []).append(row)
+        return by_shard
+
+    def _report_rate(self, label, total, started):
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self._report(f'Seeded {total} {label} in {elapsed:.1f}s ({rate:,.0f} rows/s)')
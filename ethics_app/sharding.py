@@ -0,0 +1,160 @@
+"""
+Consent sharding.
+
+Consent writes outnumber everything else by orders of magnitude, and on a
+single SQLite database every one of them queues on the same write lock as
+data subject requests and admin traffic. When ``CONSENT_SHARDS`` lists
+database aliases, ``ConsentRecord`` rows live on those instead of
+``default``. Each subject's records go to the shard picked by a stable hash
+of its user ID or session key, so the reads and writes for one visitor touch
+one shard and writes on different shards do not wait for each other.
+
+Per-subject code goes through ``shard_for``/``subject_consents``. Code that
+scans every consent (reports, retention, compaction, policy reconciliation)
+runs once per shard with ``fan_out`` and merges the results. With no shards
+configured every helper resolves to ``default`` and behaves as before.
+
+Hashing is modulo the shard count, so the count is fixed once consents have
+been written: changing it sends existing subjects to a different shard.
+"""
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import ConsentRecord, PrivacyPolicy
+from .replicas import replica_for
+
+
+def shard_aliases():
+    return list(getattr(settings, 'CONSENT_SHARDS', None) or [DEFAULT_DB_ALIAS])
+
+
+def is_sharded():
+    return bool(getattr(settings, 'CONSENT_SHARDS', None))
+
+
+def shard_for(user_id=None, session_key=None):
+    """Alias of the shard holding the consents of a user or, failing that, a session."""
+    shards = shard_aliases()
+    if len(shards) == 1:
+        return shards[0]
+    key = f'user:{user_id}' if user_id is not None else f'session:{session_key}'
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return shards[int.from_bytes(digest, 'big') % len(shards)]
+
+
+def shard_of(record):
+    return shard_for(record.user_id, record.session_key)
+
+
+def subject_consents(user=None, session_key=None):
+    """One subject's consents, queried on that subject's shard."""
+    if user is not None:
+        return ConsentRecord.objects.using(shard_for(user_id=user.pk)).filter(user=user)
+    # consents given while signed in carry the user instead; "user IS NULL"
+    # also lets the lookup use the (user, session_key, consent_type) index
+    return ConsentRecord.objects.using(shard_for(session_key=session_key)).filter(
+        user__isnull=True, session_key=session_key
+    )
+
+
+def consents_on(alias):
+    return ConsentRecord.objects.using(alias)
+
+
+def fan_out(func, aliases=None):
+    """
+    Call ``func(alias)`` for every shard, in parallel threads when there is
+    more than one. Each thread runs in a copy of the caller's context, so
+    ``replica_reads()`` carries over. Returns the results in shard order.
+    """
+    aliases = shard_aliases() if aliases is None else list(aliases)
+    if len(aliases) == 1:
+        return [func(aliases[0])]
+
+    def call(alias):
+        try:
+            return func(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, call, alias) for alias in aliases]
+        return [future.result() for future in futures]
+
+
+def bulk_create_consents(records, batch_size=None):
+    """``bulk_create`` consent records on their subjects' shards."""
+    by_shard = {}
+    for record in records:
+        by_shard.setdefault(shard_of(record), []).append(record)
+    for alias, shard_records in by_shard.items():
+        ConsentRecord.objects.using(alias).bulk_create(shard_records, batch_size=batch_size)
+
+
+class ConsentShardRouter:
+    """
+    Route consent records to their subject's shard whenever Django passes
+    the record (saves) or the user (related managers) as a hint. Anything
+    else that touches ``ConsentRecord`` must pick a shard explicitly; with
+    shards configured the table does not exist on ``default``, so a
+    forgotten ``using()`` fails loudly instead of reading an empty table.
+    ``OutboxEvent`` is written in the consents' transaction, so its table is
+    migrated onto the shards beside theirs; the router does not route its
+    queries, and callers pass the shard to ``using()`` themselves.
+    """
+
+    def _route(self, model, hints):
+        instance = hints.get('instance')
+        if model is ConsentRecord:
+            if isinstance(instance, ConsentRecord):
+                return shard_of(instance)
+            if isinstance(instance, User):
+                return shard_for(user_id=instance.pk)
+            return None
+        if isinstance(instance, ConsentRecord):
+            # users and policies referenced from a record stay on default
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        alias = self._route(model, hints)
+        return replica_for(alias) if alias else None
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if isinstance(obj1, ConsentRecord) or isinstance(obj2, ConsentRecord):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not is_sharded():
+            return None
+        shards = shard_aliases()
+        if app_label == 'ethics_app' and model_name in ('consentrecord', 'outboxevent'):
+            return db in shards
+        if db in shards and db != DEFAULT_DB_ALIAS:
+            return False
+        return None
+
+
+# ConsentRecord's user and policy keys have no database constraint and
+# DO_NOTHING, since the rows may live on another database; these receivers
+# do what CASCADE and SET_NULL used to do.
+
+@receiver(pre_delete, sender=User)
+def _delete_user_consents(sender, instance, **kwargs):
+    subject_consents(user=instance).delete()
+
+
+@receiver(pre_delete, sender=PrivacyPolicy)
+def _detach_policy_consents(sender, instance, **kwargs):
+    fan_out(lambda alias: consents_on(alias).filter(policy_id=instance.pk).update(policy=None))
@@ -4,17 +4,38 @@
 class ConsentManager {
     constructor() {
         this.consentTypes = ['functional', 'analytics', 'marketing'];
+        this.apiUrl = '/api/cookie-consent/';
+        this.flushDelay = 400;
+        this.maxRetryDelay = 60000;
         this.consentData = this.loadConsentData();
+        // Last state the server acknowledged, and decisions not yet sent
+        const confirmed = this.loadConfirmedConsents();
+        this.confirmedConsents = confirmed.consents;
+        this.confirmedExpires = confirmed.expires;
+        this.pendingConsents = {};
+        // Sent by beacon, which only says the browser queued the request
+        this.unconfirmedConsents = this.loadUnconfirmedConsents();
+        this.retryDelay = 0;
+        this.retryTimer = null;
+        this.scheduleFlush = this.debounce(() => this.flush(), this.flushDelay);
         this.cookieBanner = document.getElementById('cookie-banner');
         this.init();
     }
 
     init() {
-        // Show banner if no consent given
-        if (!this.hasEssentialConsent()) {
+        // Show banner if no consent given, or if it was given under a
+        // privacy policy version that has since been replaced
+        if (this.cookieBanner && 'policyUpdated' in this.cookieBanner.dataset) {
+            // the server no longer counts the stored decisions; resend them on confirmation
+            this.saveConfirmedConsents({}, this.confirmedExpires);
+            this.showCookieBanner();
+        } else if (!this.hasEssentialConsent()) {
             this.showCookieBanner();
         }
 
+        // Confirm whatever a previous page could only send by beacon
+        this.requeueUnconfirmed();
+
         // Load analytics/marketing scripts based on consent
         this.loadConsentBasedScripts();
 
@@ -39,6 +60,17 @@ class ConsentManager {
             });
         });
 
+        // Send whatever is still queued when the page is hidden or unloaded;
+        // a beacon survives navigation where a fetch may be cancelled.
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') {
+                this.flush({ beacon: true });
+            } else {
+                this.requeueUnconfirmed();
+            }
+        });
+        window.addEventListener('pagehide', () => this.flush({ beacon: true }));
+
         // Smooth scroll for anchor links
         document.querySelectorAll('a[href^="#"]').forEach(anchor => {
             anchor.addEventListener('click', function (e) {
@@ -93,33 +125,163 @@ class ConsentManager {
             localStorage.setItem('consentData', JSON.stringify(consentData));
             this.consentData = consentData;
             
-            // Send to server
-            this.sendConsentToServer(data);
+            // Queue for the server; rapid changes are coalesced into one request
+            this.queueConsent(data);
         } catch (e) {
             console.warn('Failed to save consent data:', e);
         }
     }
 
-    async sendConsentToServer(consentData) {
+    // Server Synchronisation
+    loadConfirmedConsents() {
         try {
-            const response = await fetch('/api/cookie-consent/', {
+            const data = JSON.parse(localStorage.getItem('consentConfirmed') || 'null');
+            // The server keys consent by session, so its acknowledgement
+            // is only good for as long as that session lives.
+            if (data && new Date(data.expires) > new Date()) {
+                return data;
+            }
+        } catch (e) {
+            console.warn('Failed to load confirmed consent:', e);
+        }
+        return { consents: {}, expires: null };
+    }
+
+    saveConfirmedConsents(consents, expires) {
+        this.confirmedConsents = consents;
+        this.confirmedExpires = expires;
+        try {
+            localStorage.setItem('consentConfirmed', JSON.stringify({ consents, expires }));
+        } catch (e) {
+            console.warn('Failed to save confirmed consent:', e);
+        }
+    }
+
+    loadUnconfirmedConsents() {
+        try {
+            return JSON.parse(localStorage.getItem('consentUnconfirmed') || '{}');
+        } catch (e) {
+            console.warn('Failed to load unconfirmed consent:', e);
+            return {};
+        }
+    }
+
+    saveUnconfirmedConsents(consents) {
+        this.unconfirmedConsents = consents;
+        try {
+            if (Object.keys(consents).length) {
+                localStorage.setItem('consentUnconfirmed', JSON.stringify(consents));
+            } else {
+                localStorage.removeItem('consentUnconfirmed');
+            }
+        } catch (e) {
+            console.warn('Failed to save unconfirmed consent:', e);
+        }
+    }
+
+    requeueUnconfirmed() {
+        if (Object.keys(this.unconfirmedConsents).length) {
+            // decisions made since then take precedence
+            this.pendingConsents = { ...this.unconfirmedConsents, ...this.pendingConsents };
+            this.scheduleFlush();
+        }
+    }
+
+    scheduleRetry() {
+        // Back off exponentially while the server cannot be reached
+        this.retryDelay = Math.min(this.retryDelay ? this.retryDelay * 2 : 1000, this.maxRetryDelay);
+        clearTimeout(this.retryTimer);
+        this.retryTimer = setTimeout(() => this.flush(), this.retryDelay);
+    }
+
+    queueConsent(consentData) {
+        const unconfirmed = { ...this.unconfirmedConsents };
+        this.consentTypes.forEach(type => {
+            if (type in consentData) {
+                this.pendingConsents[type] = consentData[type] === true;
+                // a new decision supersedes one sent by beacon
+                delete unconfirmed[type];
+            }
+        });
+        this.saveUnconfirmedConsents(unconfirmed);
+        this.scheduleFlush();
+    }
+
+    takePendingChanges() {
+        const changes = {};
+        Object.entries(this.pendingConsents).forEach(([type, given]) => {
+            if (this.confirmedConsents[type] !== given) {
+                changes[type] = given;
+            }
+        });
+        this.pendingConsents = {};
+        return Object.keys(changes).length ? changes : null;
+    }
+
+    flush({ beacon = false } = {}) {
+        const changes = this.takePendingChanges();
+        if (!changes) {
+            return;
+        }
+
+        if (beacon && navigator.sendBeacon) {
+            // sendBeacon cannot set headers, so the CSRF token travels as a form field
+            const form = new FormData();
+            form.append('csrfmiddlewaretoken', this.getCSRFToken());
+            form.append('consents', JSON.stringify(changes));
+            form.append('language', this.getPageLanguage());
+            if (navigator.sendBeacon(this.apiUrl, form)) {
+                // Queued by the browser, not necessarily delivered: keep the changes
+                // until a later request is acknowledged
+                this.saveUnconfirmedConsents({ ...this.unconfirmedConsents, ...changes });
+                return;
+            }
+        }
+        this.sendConsentToServer(changes);
+    }
+
+    async sendConsentToServer(changes) {
+        try {
+            const response = await fetch(this.apiUrl, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                     'X-CSRFToken': this.getCSRFToken()
                 },
-                body: JSON.stringify(consentData)
+                body: JSON.stringify({ consents: changes, language: this.getPageLanguage() }),
+                keepalive: true
             });
 
-            if (!response.ok) {
+            const result = response.ok ? await response.json() : null;
+            if (!result || result.status !== 'success') {
                 throw new Error('Failed to send consent to server');
             }
+            this.saveConfirmedConsents(result.consents, result.expires);
+            const unconfirmed = { ...this.unconfirmedConsents };
+            Object.keys(changes).forEach(type => delete unconfirmed[type]);
+            this.saveUnconfirmedConsents(unconfirmed);
+            this.retryDelay = 0;
         } catch (e) {
+            // Re-queue anything that was not superseded in the meantime
+            this.pendingConsents = { ...changes, ...this.pendingConsents };
             console.warn('Failed to send consent to server:', e);
+            this.scheduleRetry();
         }
     }
 
+    getPageLanguage() {
+        // The API URL has no language prefix; the server records consent under
+        // the policy of the language the page was shown in
+        return document.documentElement.lang || '';
+    }
+
     getCSRFToken() {
+        // CSRF_COOKIE_HTTPONLY hides the cookie from scripts; every page renders
+        // the token in the language switcher form.
+        const input = document.querySelector('input[name="csrfmiddlewaretoken"]');
+        if (input) {
+            return input.value;
+        }
         const cookies = document.cookie.split(';');
         for (let cookie of cookies) {
             const [name, value] = cookie.trim().split('=');
@@ -622,7 +784,7 @@ window.addEventListener('unhandledrejection', (e) => {
 });
 
 // Service Worker registration for offline functionality
-if ('serviceWorker' in navigator && consentManager.hasConsent('functional')) {
+if ('serviceWorker' in navigator && consentManager && consentManager.hasConsent('functional')) {
     window.addEventListener('load', () => {
         navigator.serviceWorker.register('/sw.js')
             .then(registration => {
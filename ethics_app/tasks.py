@@ -1,6 +1,7 @@
 from celery import shared_task
 from django.core.mail import send_mail
 from django.conf import settings
+from .idempotency import idempotent
 from .models import DataSubjectRequest
 import logging
 from django.utils import timezone  # Add this line
@@ -8,34 +9,41 @@ from django.utils import timezone  # Add this line
 logger = logging.getLogger(__name__)
 
 @shared_task(bind=True, max_retries=3)
+@idempotent(lambda request_id: f'dsr:{request_id}')
 def process_data_subject_request(self, request_id):
-    """Process data subject request asynchronously"""
+    """Process data subject request asynchronously; duplicates and retries after completion are skipped"""
+    from . import dsar
+
     try:
         request = DataSubjectRequest.objects.get(id=request_id)
         
-        # Update status to processing
-        request.status = 'processing'
-        request.save()
-        
-        # Simulate processing time
-        import time
-        time.sleep(2)
-        
-        # Process based on request type
-        if request.request_type == 'access':
-            # Generate data export
-            response_text = f"Data access request processed for {request.email}"
-        elif request.request_type == 'erasure':
-            # Perform data deletion
-            response_text = f"Data erasure completed for {request.email}"
+        if request.status != 'completed':
+            # Update status to processing
+            request.status = 'processing'
+            request.save()
+            
+            # Process based on request type
+            if request.request_type in dsar.PACKAGE_TYPES:
+                # Build (or reuse) the data package and link to it
+                package = dsar.build(request)
+                response_text = (
+                    f"Your data is ready to download until {package.expires_at:%Y-%m-%d}: "
+                    f"{dsar.download_url(package)}"
+                )
+            elif request.request_type == 'erasure':
+                # Perform data deletion
+                response_text = f"Data erasure completed for {request.email}"
+            else:
+                response_text = f"Request type {request.request_type} processed"
+            
+            # Update request with response
+            request.status = 'completed'
+            request.response = response_text
+            request.processed_at = timezone.now()
+            request.save()
         else:
-            response_text = f"Request type {request.request_type} processed"
-        
-        # Update request with response
-        request.status = 'completed'
-        request.response = response_text
-        request.processed_at = timezone.now()
-        request.save()
+            # a retry after the email failed
+            response_text = request.response
         
         # Send notification email
         send_mail(
@@ -68,14 +76,117 @@ def process_data_subject_request(self, request_id):
         # Retry the task
         raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
 
-@shared_task
-def cleanup_expired_data():
-    """Cleanup expired data - runs daily"""
+@shared_task(bind=True)
+@idempotent(lambda: 'cleanup_expired_data', remember=False)
+def cleanup_expired_data(self):
+    """Cleanup expired data - runs daily, skipped while a previous run is still going"""
     from django.core.management import call_command
-    call_command('cleanup_expired_data')
+    call_command('clean_expired_data')
 
-@shared_task  
-def generate_monthly_compliance_report():
-    """Generate monthly compliance report"""
+@shared_task(bind=True)
+@idempotent(lambda: 'monthly_compliance_report', remember=False)
+def generate_monthly_compliance_report(self):
+    """Generate monthly compliance report from the read replicas"""
     from django.core.management import call_command
     call_command('generate_privacy_report', '--days=30', '--format=json')
+
+@shared_task
+def notify_breach_subjects(breach_id, chunk_size=500):
+    """Fan a breach's pending subjects out to chunk tasks across the workers"""
+    from . import breach
+
+    breach.start_notification(breach_id)
+    chunks = 0
+    for first_id, last_id in breach.plan_chunks(breach_id, chunk_size):
+        send_breach_notification_chunk.delay(breach_id, first_id, last_id)
+        chunks += 1
+    if not chunks:
+        breach.complete_if_done(breach_id)
+    logger.info(f'Queued {chunks} notification chunks for breach {breach_id}')
+    return chunks
+
+@shared_task(bind=True, max_retries=3, acks_late=True)
+def send_breach_notification_chunk(self, breach_id, first_id, last_id):
+    """Send one chunk of breach notifications; already notified subjects are skipped on retry"""
+    from . import breach
+
+    try:
+        sent, failed = breach.send_chunk(breach_id, first_id, last_id)
+    except Exception as exc:
+        logger.error(f'Error notifying breach {breach_id} subjects {first_id}-{last_id}: {exc}')
+        raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
+    breach.complete_if_done(breach_id)
+    return sent, failed
+
+@shared_task(bind=True, max_retries=3, acks_late=True)
+def reconcile_policy_consents(self, policy_id, after=None, chunk_size=1000, alias='default', include_legacy=False):
+    """Migrate or expire one chunk of a shard's consents a new policy version superseded, then queue the next"""
+    from . import policies
+
+    try:
+        count, last_pk = policies.reconcile_chunk(policy_id, after, chunk_size, alias, include_legacy)
+    except Exception as exc:
+        logger.error(f'Error reconciling consents on {alias} for policy {policy_id}: {exc}')
+        raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
+    if last_pk is not None:
+        reconcile_policy_consents.delay(policy_id, str(last_pk), chunk_size, alias, include_legacy)
+    else:
+        logger.info(f'Reconciled consents on {alias} for policy {policy_id}')
+    return count
+
+@shared_task(bind=True)
+@idempotent(lambda: 'compact_orphaned_consents', remember=False)
+def compact_orphaned_consents(self):
+    """Fold anonymous consents of ended sessions into daily tallies - runs hourly, one run at a time"""
+    from .compaction import compact_orphans
+
+    result = compact_orphans()
+    logger.info(
+        f'Compacted {result.compacted} of {result.scanned} anonymous consents, '
+        f'reclaimed {result.reclaimed_bytes} bytes'
+    )
+    return result.compacted
+
+@shared_task(bind=True)
+@idempotent(lambda: 'refresh_consent_snapshot', remember=False)
+def refresh_consent_snapshot(self):
+    """Rebuild the columnar consent snapshot for the analytics API from the read replicas - runs every 15 minutes"""
+    from .analytics import build_snapshot
+
+    path, rows = build_snapshot()
+    logger.info(f'Published consent snapshot of {rows} records to {path}')
+    return rows
+
+@shared_task(bind=True)
+@idempotent(lambda: 'sync_read_replicas', remember=False)
+def sync_read_replicas(self):
+    """Refresh the SQLite read replicas from their primaries - runs every minute when replicas are configured"""
+    from .replicas import sync_replicas
+
+    return sync_replicas()
+
+@shared_task
+def relay_outboxes():
+    """Start a relay for the consent change outbox of every shard - runs every second"""
+    from .sharding import shard_aliases
+
+    for alias in shard_aliases():
+        relay_outbox.delay(alias)
+
+@shared_task(bind=True, max_retries=None, acks_late=True)
+@idempotent(
+    lambda alias='default': f'relay_outbox:{alias}', remember=False,
+    lease=getattr(settings, 'OUTBOX_RELAY_LEASE', 60),
+)
+def relay_outbox(self, alias='default'):
+    """Publish a shard's consent change events downstream, one relay per shard at a time"""
+    from . import outbox
+
+    try:
+        return outbox.relay(alias, seconds=getattr(settings, 'OUTBOX_RELAY_SECONDS', 30))
+    except outbox.Backpressure as exc:
+        logger.warning(f'Outbox relay on {alias} held back: {exc}')
+        raise self.retry(exc=exc, countdown=exc.retry_after)
+    except Exception as exc:
+        logger.error(f'Error relaying the outbox on {alias}: {exc}')
+        raise self.retry(exc=exc, countdown=min(2 ** self.request.retries, 60))
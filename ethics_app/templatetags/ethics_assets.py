@@ -0,0 +1,27 @@
+from django import template
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+PLEX_STYLESHEET = 'vendor/ibm-plex/ibm-plex-sans.css'
+
+# Only the weights style.css and the templates use (see build_assets)
+GOOGLE_FONTS_URL = 'https://fonts.googleapis.com/css2?family=IBM+Plex+Sans:wght@300;400;500;600;700&display=swap'
+
+
+@register.simple_tag
+def plex_stylesheet():
+    """
+    Link the self-hosted IBM Plex Sans subset once ``build_assets --plex`` has
+    produced it, otherwise the equivalent Google Fonts stylesheet.
+    """
+    if finders.find(PLEX_STYLESHEET):
+        return format_html('<link href="{}" rel="stylesheet">', static(PLEX_STYLESHEET))
+    return mark_safe(
+        '<link rel="preconnect" href="https://fonts.googleapis.com">\n'
+        '    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>\n'
+        f'    <link href="{GOOGLE_FONTS_URL}" rel="stylesheet">'
+    )
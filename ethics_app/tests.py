@@ -1,3 +1,1568 @@
-from django.test import TestCase
+import importlib.util
+import io
+import ipaddress
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import urlparse
 
-# Create your tests here.
+from celery.exceptions import Retry
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import DatabaseError, connection, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    analytics, assets, benchmarks, breach, compaction, dsar, idempotency, identity, jurisdiction, outbox, policies,
+    policy_history, reporting, retention, search, warmup,
+)
+from .middleware import (
+    ConsentMiddleware, QueryProfilerMiddleware, RateLimitMiddleware, ReplicaMiddleware, SlowRequestLog,
+    slow_request_log,
+)
+from .models import (
+    BreachSubject, ConsentRecord, ConsentTally, DataBreach, DataPackage, DataProcessingActivity,
+    DataSubjectRequest, OutboxEvent, PrivacyPolicy, Subject, TaskExecution,
+)
+from .replicas import PIN_COOKIE, replica_reads
+from .seeding import Seeder
+from .sharding import ConsentShardRouter, shard_for
+
+SHARDS = ['consent_0', 'consent_1', 'consent_2']
+
+
+def make_consent(**fields):
+    """A stored consent record; ``timestamp`` is written after the insert, as it is auto_now_add."""
+    timestamp = fields.pop('timestamp', None)
+    values = {
+        'ip_address': '192.0.2.1',
+        'consent_type': 'analytics',
+        'consent_given': True,
+        'expiry_date': timezone.now() + timedelta(days=365),
+    }
+    values.update(fields)
+    record = ConsentRecord.objects.create(**values)
+    if timestamp is not None:
+        ConsentRecord.objects.filter(pk=record.pk).update(timestamp=timestamp)
+        record.timestamp = timestamp
+    return record
+
+
+def make_policy(version, language='en', content=None, days_ago=0, **fields):
+    return PrivacyPolicy.objects.create(
+        version=version,
+        language=language,
+        content=content if content is not None else f'<p>Policy {version}</p>\n',
+        effective_date=timezone.now() - timedelta(days=days_ago),
+        **fields,
+    )
+
+
+class AppTestCase(TestCase):
+    """Per-process caches outlive the rolled back transaction of each test, so every test starts them empty."""
+
+    def setUp(self):
+        super().setUp()
+        identity.subject_cache.invalidate()
+        policies.current_policies.invalidate()
+
+
+class SlowRequestLogTests(SimpleTestCase):
+
+    def test_keeps_the_slowest_requests_slowest_first(self):
+        log = SlowRequestLog(3)
+        for total_ms in (5, 50, 1, 30, 20, 50):
+            log.add({'total_ms': total_ms})
+        self.assertEqual([entry['total_ms'] for entry in log.entries()], [50, 50, 30])
+        log.clear()
+        self.assertEqual(log.entries(), [])
+
+
+class QueryProfilerTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        slow_request_log.clear()
+        self.addCleanup(slow_request_log.clear)
+
+    @override_settings(PROFILER_ENABLED=True, PROFILER_SAMPLE_RATE=1.0)
+    def test_sampled_requests_record_queries_and_template_time(self):
+        make_policy('1.0', is_active=True)
+        response = self.client.get('/privacy-policy/')
+        self.assertEqual(response.status_code, 200)
+        (profile,) = slow_request_log.entries()
+        self.assertEqual((profile['path'], profile['method'], profile['status']), ('/privacy-policy/', 'GET', 200))
+        self.assertGreater(profile['sql_count'], 0)
+        self.assertGreater(profile['template_ms'], 0)
+        self.assertGreaterEqual(profile['total_ms'], profile['sql_ms'])
+
+    @override_settings(PROFILER_ENABLED=True, PROFILER_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_recorded(self):
+        self.client.get('/privacy-policy/')
+        self.assertEqual(slow_request_log.entries(), [])
+
+    def test_disabled_profiler_leaves_the_chain(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryProfilerMiddleware(lambda request: HttpResponse())
+
+    @override_settings(PROFILER_ENABLED=True, PROFILER_SAMPLE_RATE=1.0)
+    def test_report_is_for_staff_only(self):
+        self.assertEqual(self.client.get('/profiler/').status_code, 302)
+        staff = User.objects.create(username='dpo', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/profiler/')
+        self.assertEqual(response.status_code, 200)
+
+
+class ConsentMiddlewareTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old = make_policy('1.0', days_ago=30)
+        self.new = make_policy('2.0')
+        policies.activate(self.new, reconcile=False)
+        self.user = User.objects.create(username='amira')
+
+    def process(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = SessionStore()
+        ConsentMiddleware(lambda request: HttpResponse()).process_request(request)
+        return request
+
+    def give(self, policy, days_ago):
+        return make_consent(
+            user=self.user, consent_type='functional', policy=policy,
+            timestamp=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_latest_functional_consent_decides(self):
+        self.give(self.old, days_ago=20)
+        self.give(self.new, days_ago=1)
+        request = self.process(self.user)
+        self.assertFalse(request.consent_stale)
+        self.assertFalse(hasattr(request, 'needs_consent'))
+
+    def test_latest_consent_under_a_superseded_policy_is_stale(self):
+        self.give(self.new, days_ago=20)
+        self.give(self.old, days_ago=1)
+        request = self.process(self.user)
+        self.assertTrue(request.consent_stale)
+        self.assertTrue(request.needs_consent)
+
+    def test_visitor_without_consent_is_asked(self):
+        request = self.process(AnonymousUser())
+        self.assertTrue(request.needs_consent)
+        self.assertFalse(hasattr(request, 'consent_stale'))
+
+
+class BenchmarkHarnessTests(SimpleTestCase):
+
+    def test_rounds_run_setup_and_teardown_around_the_timed_calls(self):
+        calls = []
+        case = benchmarks.Benchmark(
+            'case', 'group', lambda: calls.append('run'), iterations=3,
+            setup=lambda: calls.append('setup'), teardown=lambda: calls.append('teardown'),
+        )
+        timings = case.run(2)
+        self.assertEqual(len(timings), 2)
+        self.assertEqual(calls, ['setup', 'run', 'run', 'run', 'teardown'] * 2)
+
+    def test_teardown_runs_when_a_round_fails(self):
+        calls = []
+
+        def fail():
+            raise RuntimeError('broken hot path')
+
+        case = benchmarks.Benchmark('case', 'group', fail, teardown=lambda: calls.append('teardown'))
+        with self.assertRaises(RuntimeError):
+            case.run(3)
+        self.assertEqual(calls, ['teardown'])
+
+    def test_compute_stats(self):
+        stats = benchmarks.compute_stats([0.4, 0.1, 0.2, 0.3], iterations=10)
+        self.assertEqual((stats['min'], stats['max'], stats['rounds']), (0.1, 0.4, 4))
+        self.assertAlmostEqual(stats['mean'], 0.25)
+        self.assertAlmostEqual(stats['median'], 0.25)
+        self.assertAlmostEqual(stats['ops'], 4.0)
+        self.assertAlmostEqual(stats['total'], 10.0)
+        self.assertEqual(benchmarks.compute_stats([0.5], 1)['stddev'], 0.0)
+
+    def test_report_compares_with_a_baseline(self):
+        cases = [
+            benchmarks.Benchmark('steady', 'group', lambda: None),
+            benchmarks.Benchmark('new', 'group', lambda: None),
+        ]
+        report = benchmarks.run_benchmarks(cases, rounds=2, extra_info={'scale': '10k'})
+        self.assertEqual([bench['fullname'] for bench in report['benchmarks']], [
+            'ethics_app::group::steady', 'ethics_app::group::new',
+        ])
+        self.assertEqual(report['benchmarks'][0]['extra_info'], {'scale': '10k'})
+
+        report['benchmarks'][0]['stats']['mean'] = 0.0115
+        baseline = {'benchmarks': [
+            {'name': 'steady', 'stats': {'mean': 0.010}},
+            {'name': 'gone', 'stats': {'mean': 0.010}},
+        ]}
+        (name, old, new, change, regressed), = benchmarks.compare_to_baseline(report, baseline, threshold=10)
+        self.assertEqual((name, old, new), ('steady', 0.010, 0.0115))
+        self.assertAlmostEqual(change, 15.0)
+        self.assertTrue(regressed)
+        self.assertFalse(next(benchmarks.compare_to_baseline(report, baseline, threshold=20))[4])
+
+
+class SeedingTests(AppTestCase):
+
+    def test_generated_dates_survive_without_fast(self):
+        counts = Seeder(seed=1, history_days=365).run(300, requests=40, breaches=5)
+        self.assertEqual(counts['ethics_app.DataSubjectRequest'], 40)
+        week_ago = timezone.now() - timedelta(days=7)
+        for model, field in (
+            (ConsentRecord, 'timestamp'),
+            (DataSubjectRequest, 'created_at'),
+            (DataBreach, 'detection_date'),
+        ):
+            dates = model.objects.values_list(field, flat=True)
+            self.assertLess(min(dates), week_ago, model.__name__)
+            self.assertGreater(max(dates) - min(dates), timedelta(days=7), model.__name__)
+
+    def test_seeding_indexes_subjects(self):
+        Seeder(seed=2).run(60, requests=10, breaches=1)
+        self.assertTrue(Subject.objects.filter(user__username__startswith='seed_').exists())
+
+    def test_consents_are_given_under_the_active_policy_of_their_language(self):
+        english = make_policy('1.0', is_active=True)
+        french = make_policy('1.0', language='fr', is_active=True)
+        make_policy('0.9', language='fr', days_ago=30)
+        Seeder(seed=3).run(600, requests=0, breaches=0)
+        self.assertFalse(ConsentRecord.objects.filter(policy__isnull=True).exists())
+        self.assertEqual(
+            set(ConsentRecord.objects.filter(country='FR').values_list('policy_id', flat=True)), {french.pk}
+        )
+        self.assertEqual(
+            set(ConsentRecord.objects.filter(country='DE').values_list('policy_id', flat=True)), {english.pk}
+        )
+
+    def test_clear_removes_what_refers_to_the_cleared_rows(self):
+        Seeder(seed=4).run(60, requests=10, breaches=2)
+        kept = User.objects.create(username='amira', email='amira@example.com')
+        request = DataSubjectRequest.objects.first()
+        DataPackage.objects.create(request=request, digest='0' * 64, size=1, expires_at=timezone.now())
+        breach.add_subjects(DataBreach.objects.first(), [
+            {'user_id': None, 'email': 'lucas@example.com', 'name': 'Lucas', 'language': 'en'},
+        ])
+
+        call_command('seed_ethics_data', clear=True, consents=30, requests=3, breaches=1, stdout=io.StringIO())
+        self.assertFalse(DataPackage.objects.exists())
+        self.assertFalse(BreachSubject.objects.exists())
+        self.assertEqual(DataSubjectRequest.objects.count(), 3)
+        self.assertFalse(Subject.objects.filter(user__isnull=True, requests__isnull=True).exists())
+        self.assertTrue(Subject.objects.filter(user=kept).exists())
+
+
+class InlinePool:
+    """Stands in for the fork pool: in-memory test databases are not shared with child processes."""
+
+    def __init__(self, processes):
+        self.processes = processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, func, iterable):
+        return [func(item) for item in iterable]
+
+
+class PrivacyReportTests(AppTestCase):
+
+    def test_split_period_cuts_at_utc_midnight(self):
+        start = datetime(2024, 1, 1, 15, tzinfo=dt_timezone.utc)
+        end = datetime(2024, 1, 11, 9, tzinfo=dt_timezone.utc)
+        self.assertEqual(reporting.split_period(start, end, 3), [
+            (start, datetime(2024, 1, 5, tzinfo=dt_timezone.utc)),
+            (datetime(2024, 1, 5, tzinfo=dt_timezone.utc), datetime(2024, 1, 8, tzinfo=dt_timezone.utc)),
+            (datetime(2024, 1, 8, tzinfo=dt_timezone.utc), end),
+        ])
+        self.assertEqual(reporting.split_period(start, end, 1), [(start, end)])
+        self.assertEqual(reporting.split_period(start, start + timedelta(days=2), 3), [(start, start + timedelta(days=2))])
+
+    def test_days_are_utc_days_on_every_backend(self):
+        make_consent(timestamp=datetime(2024, 3, 1, 22, 30, tzinfo=dt_timezone.utc))
+        other_backend = {'default': SimpleNamespace(vendor='postgresql')}
+        with timezone.override('Asia/Tokyo'):
+            (sqlite_day,) = ConsentRecord.objects.values_list(reporting.day_trunc('timestamp'), flat=True)
+            with mock.patch.object(reporting, 'connections', other_backend):
+                (other_day,) = ConsentRecord.objects.values_list(reporting.day_trunc('timestamp'), flat=True)
+        self.assertEqual(str(sqlite_day), '2024-03-01')
+        self.assertEqual(other_day, date(2024, 3, 1))
+
+    def test_shard_series_and_summaries_are_summed(self):
+        shard_a = [
+            {'day': '2024-03-01', 'consent_type': 'analytics', 'total': 2, 'granted': 1, 'cumulative': 2},
+            {'day': '2024-03-02', 'consent_type': 'analytics', 'total': 1, 'granted': 1, 'cumulative': 3},
+        ]
+        shard_b = [
+            {'day': '2024-03-01', 'consent_type': 'analytics', 'total': 3, 'granted': 3, 'cumulative': 3},
+            {'day': '2024-03-01', 'consent_type': 'marketing', 'total': 1, 'granted': 0, 'cumulative': 1},
+        ]
+        merged = list(reporting.merge_series('consent_daily', iter(shard_a), iter(shard_b)))
+        self.assertEqual([(row['day'], row['consent_type'], row['total'], row['cumulative']) for row in merged], [
+            ('2024-03-01', 'analytics', 5, 5),
+            ('2024-03-01', 'marketing', 1, 1),
+            ('2024-03-02', 'analytics', 1, 6),
+        ])
+
+        summaries = reporting.merge_summaries([
+            {'consent_statistics': [{'consent_type': 'analytics', 'total': 3, 'granted': 2}]},
+            {'consent_statistics': [
+                {'consent_type': 'analytics', 'total': 3, 'granted': 3},
+                {'consent_type': 'marketing', 'total': 1, 'granted': 0},
+            ]},
+        ], 'consent_statistics')
+        self.assertEqual(summaries, [
+            {'consent_type': 'analytics', 'total': 6, 'granted': 5},
+            {'consent_type': 'marketing', 'total': 1, 'granted': 0},
+        ])
+
+    def test_split_report_matches_the_whole_period(self):
+        Seeder(seed=5, history_days=30).run(400, requests=40, breaches=6)
+        end = timezone.now() + timedelta(days=1)
+        start = end - timedelta(days=40)
+
+        def compute(workers):
+            report = reporting.PrivacyReport(start, end, workers=workers)
+            return report.summaries(), {name: list(rows) for name, rows in report.series()}
+
+        whole = compute(1)
+        with mock.patch.object(reporting.multiprocessing, 'get_context', return_value=SimpleNamespace(Pool=InlinePool)), \
+                mock.patch.object(reporting.connections, 'close_all'):
+            report = reporting.PrivacyReport(start, end, workers=4)
+            self.assertEqual(len(report._parts), 4)
+            split = compute(4)
+        self.assertEqual(split, whole)
+        self.assertTrue(whole[1]['consent_daily'])
+
+
+@override_settings(DEBUG=False)
+class AssetServingTests(AppTestCase):
+
+    HASHED = 'css/site.0123456789ab.css'
+
+    def setUp(self):
+        super().setUp()
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        self.enterContext(override_settings(STATIC_ROOT=root))
+        (root / 'css').mkdir()
+        for name, data in (
+            (self.HASHED, b'body{color:red}'),
+            (self.HASHED + '.gz', b'gzip bytes'),
+            (self.HASHED + '.br', b'brotli bytes'),
+            ('css/site.css', b'body{color:red}'),
+        ):
+            (root / name).write_bytes(data)
+
+    def get(self, path, encoding=None, **headers):
+        if encoding is not None:
+            headers['HTTP_ACCEPT_ENCODING'] = encoding
+        return self.client.get(f'/static/{path}', **headers)
+
+    def test_best_accepted_precompressed_variant_is_served(self):
+        for accept, encoding, body in (
+            ('gzip, deflate, br', 'br', b'brotli bytes'),
+            ('gzip', 'gzip', b'gzip bytes'),
+            ('br;q=0, gzip', 'gzip', b'gzip bytes'),
+            ('identity', None, b'body{color:red}'),
+        ):
+            with self.subTest(accept=accept):
+                response = self.get(self.HASHED, accept)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertEqual(response['Content-Type'], 'text/css')
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(b''.join(response.streaming_content), body)
+
+    def test_hashed_names_are_immutable(self):
+        self.assertEqual(self.get(self.HASHED)['Cache-Control'], assets.LONG_CACHE)
+        self.assertIn('immutable', assets.LONG_CACHE)
+        self.assertEqual(self.get('css/site.css')['Cache-Control'], assets.SHORT_CACHE)
+
+    def test_unmodified_files_are_not_sent_again(self):
+        last_modified = self.get(self.HASHED)['Last-Modified']
+        response = self.get(self.HASHED, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], assets.LONG_CACHE)
+
+    def test_only_files_under_static_root_are_served(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.get('css/missing.css').status_code, 404)
+        with self.assertLogs('django.security', 'ERROR'):
+            self.assertEqual(self.get('../settings.py').status_code, 400)
+
+
+class CookieConsentAPITests(AppTestCase):
+
+    url = '/api/cookie-consent/'
+
+    def post_json(self, data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def stored(self):
+        session_key = self.client.session.session_key
+        return dict(ConsentRecord.objects.filter(session_key=session_key).values_list('consent_type', 'consent_given'))
+
+    def test_single_decision(self):
+        response = self.post_json({'type': 'analytics', 'consent': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['consents'], {'analytics': True})
+        self.assertEqual(self.stored(), {'analytics': True})
+
+    def test_batch_writes_only_what_changed(self):
+        self.post_json({'consents': {'analytics': True, 'marketing': False}})
+        first = ConsentRecord.objects.get(consent_type='analytics')
+        response = self.post_json({'consents': {'analytics': True, 'marketing': True}})
+        self.assertEqual(response.json()['consents'], {'analytics': True, 'marketing': True})
+        self.assertEqual(self.stored(), {'analytics': True, 'marketing': True})
+        self.assertEqual(ConsentRecord.objects.count(), 2)
+        self.assertEqual(ConsentRecord.objects.get(consent_type='analytics').expiry_date, first.expiry_date)
+
+    def test_beacon_form_field(self):
+        response = self.client.post(self.url, {'consents': json.dumps({'functional': True, 'marketing': False})})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored(), {'functional': True, 'marketing': False})
+
+    @override_settings(CONSENT_API_MAX_BODY=64)
+    def test_oversized_body_is_refused(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.post_json({'consents': {'analytics': True}, 'padding': 'x' * 64})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(ConsentRecord.objects.exists())
+
+    def test_malformed_bodies_are_rejected(self):
+        for body in ('{"consents": ', '[1, 2]', '{"consents": {"tracking": true}}', '{"consents": 3}'):
+            with self.subTest(body=body), self.assertLogs('django.request', 'WARNING'):
+                response = self.client.post(self.url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['status'], 'error')
+        self.assertFalse(ConsentRecord.objects.exists())
+
+
+class IPRangeIndexTests(SimpleTestCase):
+
+    CSV = (
+        'ip_start,ip_end,country\n'
+        '10.0.0.0,10.0.0.255,FR\n'
+        '10.0.1.0,10.0.1.255,fr\n'
+        '167772672,167772927,DE\n'
+        '::ffff:11.0.0.0,::ffff:11.0.0.255,TR\n'
+        '12.0.0.0,12.0.0.255,ZZ\n'
+        '2001:db8::,2001:db8::ffff,US\n'
+        '2001:db8:0:1::,2001:db8:0:1:ffff:ffff:ffff:ffff,GB\n'
+    )
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = Path(directory)
+        path = self.directory / 'ranges.csv'
+        path.write_text(self.CSV)
+        self.index = jurisdiction.IPRangeIndex.from_csv(path)
+
+    def test_csv_rows_and_boundaries(self):
+        for ip, country in (
+            ('10.0.0.0', 'FR'), ('10.0.1.255', 'FR'), ('9.255.255.255', None),
+            ('10.0.2.0', 'DE'), ('10.0.2.255', 'DE'), ('10.0.3.0', None),
+            ('11.0.0.7', 'TR'), ('::ffff:10.0.2.1', 'DE'), ('12.0.0.1', None),
+        ):
+            with self.subTest(ip=ip):
+                self.assertEqual(self.index.lookup(ip), country)
+        # adjacent ranges of one country merge; the header and ZZ rows are skipped
+        self.assertEqual(len(self.index.v4[0]), 3)
+        with self.assertRaises(ValueError):
+            self.index.lookup('not an address')
+
+    def test_ipv6_ranges_collapse_to_their_64_bit_prefix(self):
+        self.assertEqual(self.index.lookup('2001:db8::1'), 'US')
+        # narrower than a /64, so the whole /64 resolves to it
+        self.assertEqual(self.index.lookup('2001:db8::ffff:ffff:ffff:ffff'), 'US')
+        self.assertEqual(self.index.lookup('2001:db8:0:1::9'), 'GB')
+        self.assertIsNone(self.index.lookup('2001:db8:0:2::'))
+
+    def test_saved_index_loads_identically(self):
+        path = self.directory / 'ranges.idx'
+        self.index.save(path)
+        loaded = jurisdiction.load_index(path)
+        self.assertEqual(loaded.countries, self.index.countries)
+        self.assertEqual(loaded.v4, self.index.v4)
+        self.assertEqual(loaded.v6, self.index.v6)
+        self.assertEqual(loaded.lookup('10.0.2.9'), 'DE')
+        (self.directory / 'bad.idx').write_bytes(b'garbage')
+        with self.assertRaises(ValueError):
+            jurisdiction.IPRangeIndex.load(self.directory / 'bad.idx')
+
+
+class ClientAddressTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        index = jurisdiction.IPRangeIndex.from_ranges([
+            (int(ipaddress.ip_address('10.0.0.0')), int(ipaddress.ip_address('10.0.0.255')), 4, 'FR'),
+            (int(ipaddress.ip_address('198.51.100.0')), int(ipaddress.ip_address('198.51.100.255')), 4, 'US'),
+        ])
+        self.enterContext(mock.patch.object(jurisdiction, '_resolver', jurisdiction.JurisdictionResolver(index)))
+
+    def request(self, forwarded_for):
+        return RequestFactory().get('/', REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR=forwarded_for)
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        request = self.request('198.51.100.7')
+        self.assertEqual(jurisdiction.trusted_client_ip(request), '10.0.0.5')
+        self.assertEqual(jurisdiction.for_request(request), ('FR', 'gdpr'))
+
+    @override_settings(NUM_PROXIES=1)
+    def test_only_the_hop_before_our_proxies_is_trusted(self):
+        request = self.request('10.0.0.9, 198.51.100.7')
+        self.assertEqual(jurisdiction.trusted_client_ip(request), '198.51.100.7')
+        self.assertEqual(jurisdiction.for_request(request), ('US', 'ccpa'))
+
+    def test_consents_store_the_trusted_address(self):
+        self.client.post(
+            '/api/cookie-consent/', json.dumps({'type': 'analytics', 'consent': True}),
+            content_type='application/json', REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR='198.51.100.7',
+        )
+        record = ConsentRecord.objects.get()
+        self.assertEqual((record.ip_address, record.country), ('10.0.0.5', 'FR'))
+
+
+class BreachNotificationTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.breach = DataBreach.objects.create(
+            breach_type='confidentiality', severity='high', description='Leaked mailing list', affected_records=2,
+        )
+        breach.add_subjects(self.breach, [
+            {'user_id': None, 'email': 'amira@example.com', 'name': 'Amira', 'language': 'en'},
+            {'user_id': None, 'email': 'lucas@example.com', 'name': 'Lucas', 'language': 'fr'},
+        ])
+
+    def send_all(self, failing=()):
+        def send(message):
+            if message.to[0] in failing:
+                raise ConnectionRefusedError('mail server down')
+            return 1
+
+        totals = [0, 0]
+        with mock.patch.object(EmailMessage, 'send', autospec=True, side_effect=send):
+            for first, last in breach.plan_chunks(self.breach.id):
+                totals = [a + b for a, b in zip(totals, breach.send_chunk(self.breach.id, first, last))]
+        return tuple(totals)
+
+    def test_failed_subjects_keep_the_breach_incomplete(self):
+        self.assertEqual(self.send_all(failing=['lucas@example.com']), (1, 1))
+        self.assertFalse(breach.complete_if_done(self.breach.id))
+        self.breach.refresh_from_db()
+        self.assertFalse(self.breach.subjects_notified)
+        self.assertIsNone(self.breach.notification_completed_at)
+        # the failed subject is no longer pending, so a plain rerun sends nothing
+        self.assertEqual(self.send_all(), (0, 0))
+
+    def test_retry_failed_sends_again_then_completes(self):
+        self.send_all(failing=['lucas@example.com'])
+        self.assertEqual(breach.retry_failed(self.breach.id), 1)
+        self.assertEqual(self.send_all(), (1, 0))
+        self.assertTrue(breach.complete_if_done(self.breach.id))
+        self.breach.refresh_from_db()
+        self.assertTrue(self.breach.subjects_notified)
+        self.assertIsNotNone(self.breach.notification_completed_at)
+        self.assertEqual((self.breach.notifications_sent, self.breach.notifications_failed), (2, 1))
+
+    def test_retry_failed_withdraws_an_earlier_completion(self):
+        self.send_all(failing=['lucas@example.com'])
+        DataBreach.objects.filter(id=self.breach.id).update(
+            notification_completed_at=timezone.now(), subjects_notified=True,
+        )
+        breach.retry_failed(self.breach.id)
+        self.breach.refresh_from_db()
+        self.assertFalse(self.breach.subjects_notified)
+        self.assertIsNone(self.breach.notification_completed_at)
+
+    def test_messages_are_sent_in_the_subjects_language(self):
+        self.send_all()
+        self.assertEqual(BreachSubject.objects.filter(notified_at__isnull=False).count(), 2)
+        self.assertTrue(breach.complete_if_done(self.breach.id))
+        self.assertEqual(breach.retry_failed(self.breach.id), 0)
+
+
+class RetentionTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        DataProcessingActivity.objects.create(
+            name='Analytics', purpose='Usage statistics', legal_basis='Consent',
+            data_categories='Consent records; Sessions; web beacons', retention_period=30,
+        )
+        DataProcessingActivity.objects.create(
+            name='Security', purpose='Fraud detection', legal_basis='consent',
+            data_categories='consent records', retention_period=90,
+        )
+
+    def test_compile_plans(self):
+        plans, unknown = retention.compile_plans()
+        days = {plan.label: plan.days for plan in plans}
+        self.assertEqual(days, {
+            'expired_consents': 0,
+            'data_subject_requests': settings.DATA_RETENTION_DAYS,
+            'consent_records (consent)': 90,
+            'sessions': 30,
+        })
+        self.assertEqual(unknown, {'web_beacons': ['Analytics']})
+        self.assertTrue(all(plan.indexed for plan in plans))
+
+    def test_run_plans_deletes_only_what_is_past_retention(self):
+        expired = make_consent(session_key='a' * 32, expiry_date=self.now - timedelta(days=1))
+        old = make_consent(session_key='b' * 32, timestamp=self.now - timedelta(days=120))
+        contract = make_consent(session_key='c' * 32, timestamp=self.now - timedelta(days=120), legal_basis='contract')
+        recent = make_consent(session_key='d' * 32, timestamp=self.now - timedelta(days=60))
+        requests = {}
+        for status in ('completed', 'pending'):
+            requests[status] = DataSubjectRequest.objects.create(
+                request_type='erasure', email=f'{status}@example.com', full_name='A', description='d', status=status,
+            )
+        DataSubjectRequest.objects.update(created_at=self.now - timedelta(days=400))
+
+        plans, _unknown = retention.compile_plans()
+        estimates = {plan.label: estimate['rows'] for plan, estimate in retention.estimate_plans(plans, self.now)}
+        self.assertEqual(estimates['expired_consents'], 1)
+        deleted = {plan.label: count for plan, count in retention.run_plans(plans, self.now, batch_size=1, workers=2)}
+        self.assertEqual(deleted['expired_consents'], 1)
+        self.assertEqual(deleted['consent_records (consent)'], 1)
+        self.assertEqual(deleted['data_subject_requests'], 1)
+
+        remaining = set(ConsentRecord.objects.values_list('pk', flat=True))
+        self.assertEqual(remaining, {contract.pk, recent.pk})
+        self.assertNotIn(expired.pk, remaining)
+        self.assertNotIn(old.pk, remaining)
+        self.assertEqual(list(DataSubjectRequest.objects.values_list('status', flat=True)), ['pending'])
+
+
+class PolicyReconciliationTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.en_old = make_policy('1.0', days_ago=30)
+        self.en_new = make_policy('2.0')
+        self.fr_old = make_policy('1.0', language='fr', days_ago=30)
+        self.fr_new = make_policy('2.0', language='fr')
+        self.en_consent = make_consent(session_key='a' * 32, policy=self.en_old)
+        self.fr_consent = make_consent(session_key='b' * 32, policy=self.fr_old)
+        self.legacy_consent = make_consent(session_key='c' * 32)
+
+    def assertExpired(self, record, expired=True):
+        record.refresh_from_db()
+        self.assertEqual(record.expiry_date <= timezone.now(), expired)
+
+    def test_activation_only_expires_its_own_language(self):
+        call_command('activate_policy', '2.0', language='fr', now=True, stdout=io.StringIO())
+        self.assertExpired(self.fr_consent)
+        self.assertExpired(self.en_consent, expired=False)
+        self.assertExpired(self.legacy_consent, expired=False)
+
+    def test_legacy_consents_are_reconciled_on_request(self):
+        call_command('activate_policy', '2.0', language='fr', now=True, include_legacy=True, stdout=io.StringIO())
+        self.assertExpired(self.legacy_consent)
+        self.assertExpired(self.en_consent, expired=False)
+
+    def test_carry_over_moves_consents_to_the_new_version(self):
+        call_command('activate_policy', '2.0', carry_over=True, now=True, stdout=io.StringIO())
+        self.en_consent.refresh_from_db()
+        self.assertEqual(self.en_consent.policy_id, self.en_new.pk)
+        self.assertExpired(self.en_consent, expired=False)
+        self.fr_consent.refresh_from_db()
+        self.assertEqual(self.fr_consent.policy_id, self.fr_old.pk)
+
+    def test_reconciliation_walks_in_chunks_and_stops_once_superseded(self):
+        for n in range(4):
+            make_consent(session_key=f'{n:032d}', policy=self.en_old)
+        policies.activate(self.en_new, reconcile=False)
+        count, after = policies.reconcile_chunk(self.en_new.pk, chunk_size=3)
+        self.assertEqual((count, after is not None), (3, True))
+        self.assertEqual(policies.reconcile_chunk(self.en_new.pk, after, chunk_size=3), (2, None))
+
+        newer = make_policy('3.0')
+        policies.activate(newer, reconcile=False)
+        self.assertEqual(policies.reconcile_chunk(self.en_new.pk), (0, None))
+
+    def test_consents_under_an_activated_policy_are_current(self):
+        policies.activate(self.en_new, reconcile=False)
+        self.assertTrue(policies.current_policies.is_current(self.en_new.pk))
+        self.assertFalse(policies.current_policies.is_current(self.en_old.pk))
+        self.assertFalse(policies.current_policies.is_current(None))
+
+
+    def test_consent_is_recorded_under_the_policy_of_the_page_language(self):
+        arabic = make_policy('2.0', language='ar')
+        for policy in (self.en_new, arabic):
+            policies.activate(policy, reconcile=False)
+        self.client.get('/ar/')
+
+        # the consent API is not under the language prefix, so the page says which language it showed
+        self.client.post(
+            '/api/cookie-consent/', json.dumps({'consents': {'analytics': True}, 'language': 'ar'}),
+            content_type='application/json',
+        )
+        self.client.post('/api/cookie-consent/', {'consents': json.dumps({'marketing': True}), 'language': 'ar'})
+        self.client.post(
+            '/api/cookie-consent/', json.dumps({'consents': {'functional': True}, 'language': 'xx'}),
+            content_type='application/json',
+        )
+        given = ConsentRecord.objects.filter(session_key=self.client.session.session_key)
+        self.assertEqual(dict(given.values_list('consent_type', 'policy_id')), {
+            'analytics': arabic.pk, 'marketing': arabic.pk, 'functional': self.en_new.pk,
+        })
+
+        given.delete()
+        self.client.post('/ar/consent/', {'functional_cookies': 'on'})
+        self.assertEqual(set(given.values_list('policy_id', flat=True)), {arabic.pk})
+
+
+class CompactionTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.live = SessionStore()
+        self.live.create()
+        old = self.now - timedelta(days=3)
+        self.orphans = [
+            make_consent(session_key='e' * 32, consent_type=consent_type, timestamp=old, country='FR')
+            for consent_type in ('functional', 'analytics')
+        ]
+        self.kept = [
+            make_consent(session_key=self.live.session_key, timestamp=old),
+            # the session may still be saved again
+            make_consent(session_key='f' * 32, timestamp=self.now - timedelta(hours=2)),
+            make_consent(user=User.objects.create(username='amira'), timestamp=old),
+        ]
+
+    def test_orphans_become_tallies(self):
+        result = compaction.compact_orphans(chunk_size=2)
+        self.assertEqual((result.scanned, result.compacted, result.tallies), (3, 2, 2))
+        self.assertEqual(
+            set(ConsentRecord.objects.values_list('pk', flat=True)), {record.pk for record in self.kept}
+        )
+        tallies = ConsentTally.objects.order_by('consent_type')
+        self.assertEqual(
+            [(t.consent_type, t.country.code, t.count) for t in tallies], [('analytics', 'FR', 1), ('functional', 'FR', 1)]
+        )
+        self.assertEqual(tallies[0].day, self.orphans[0].timestamp.date())
+
+    def test_watermark_resumes_and_counts_accumulate(self):
+        compaction.compact_orphans()
+        self.assertEqual(compaction.compact_orphans().scanned, 0)
+        make_consent(
+            session_key='9' * 32, consent_type='analytics', timestamp=self.orphans[0].timestamp + timedelta(seconds=1),
+            country='FR',
+        )
+        self.assertEqual(compaction.compact_orphans().compacted, 1)
+        counts = ConsentTally.objects.filter(consent_type='analytics').values_list('count', flat=True)
+        self.assertEqual(sum(counts), 2)
+
+    def test_dry_run_changes_nothing(self):
+        result = compaction.compact_orphans(dry_run=True)
+        self.assertEqual(result.compacted, 2)
+        self.assertEqual(ConsentRecord.objects.count(), 5)
+        self.assertFalse(ConsentTally.objects.exists())
+        self.assertIsNone(compaction.get_watermark().timestamp)
+
+
+class ShardRoutingTests(SimpleTestCase):
+
+    def test_unsharded_everything_is_on_default(self):
+        self.assertEqual(shard_for(user_id=1), 'default')
+        self.assertIsNone(ConsentShardRouter().allow_migrate('default', 'ethics_app', 'consentrecord'))
+
+    @override_settings(CONSENT_SHARDS=SHARDS)
+    def test_subjects_hash_to_a_stable_shard(self):
+        self.assertEqual(shard_for(user_id=42), shard_for(user_id=42))
+        self.assertEqual(shard_for(user_id=42, session_key='ignored'), shard_for(user_id=42))
+        used = {shard_for(session_key=f'{n:032x}') for n in range(300)}
+        self.assertEqual(used, set(SHARDS))
+
+    @override_settings(CONSENT_SHARDS=SHARDS)
+    def test_router_follows_the_record_or_user(self):
+        shard_router = ConsentShardRouter()
+        record = ConsentRecord(user_id=42)
+        self.assertEqual(shard_router.db_for_write(ConsentRecord, instance=record), shard_for(user_id=42))
+        self.assertEqual(shard_router.db_for_write(ConsentRecord, instance=User(pk=42)), shard_for(user_id=42))
+        self.assertEqual(shard_router.db_for_read(ConsentRecord, instance=record), shard_for(user_id=42))
+        self.assertEqual(shard_router.db_for_read(PrivacyPolicy, instance=record), 'default')
+        self.assertIsNone(shard_router.db_for_write(ConsentRecord))
+
+    @override_settings(CONSENT_SHARDS=SHARDS)
+    def test_consent_tables_are_migrated_on_the_shards_only(self):
+        allow_migrate = ConsentShardRouter().allow_migrate
+        for model_name in ('consentrecord', 'outboxevent'):
+            self.assertTrue(allow_migrate('consent_1', 'ethics_app', model_name))
+            self.assertFalse(allow_migrate('default', 'ethics_app', model_name))
+        self.assertFalse(allow_migrate('consent_1', 'auth', 'user'))
+        self.assertIsNone(allow_migrate('default', 'auth', 'user'))
+
+
+class ConsentCascadeTests(AppTestCase):
+
+    def test_deleting_a_user_deletes_their_consents(self):
+        amira, lucas = User.objects.create(username='amira'), User.objects.create(username='lucas')
+        make_consent(user=amira)
+        make_consent(user=amira, consent_type='marketing')
+        kept = make_consent(user=lucas)
+        amira.delete()
+        self.assertEqual(list(ConsentRecord.objects.values_list('pk', flat=True)), [kept.pk])
+
+    def test_deleting_a_policy_detaches_its_consents(self):
+        policy = make_policy('1.0')
+        record = make_consent(session_key='a' * 32, policy=policy)
+        policy.delete()
+        record.refresh_from_db()
+        self.assertIsNone(record.policy_id)
+
+
+@override_settings(DATABASE_REPLICAS={'default': 'default_replica'})
+class ReplicaTests(SimpleTestCase):
+
+    def test_requests_read_accounts_and_sessions_from_the_primary(self):
+        with replica_reads():
+            for model in (User, Session, Subject, DataPackage):
+                self.assertEqual(router.db_for_read(model), 'default', model.__name__)
+            self.assertEqual(router.db_for_read(DataSubjectRequest), 'default_replica')
+        self.assertEqual(router.db_for_read(DataSubjectRequest), 'default')
+
+    def test_write_pins_the_client_with_its_time(self):
+        middleware = ReplicaMiddleware(lambda request: HttpResponse())
+        before = time.time()
+        response = middleware(RequestFactory().post('/consent/'))
+        self.assertGreaterEqual(float(response.cookies[PIN_COOKIE].value), before - 0.001)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+    def test_pin_holds_until_the_replicas_are_synced_past_the_write(self):
+        written = time.time()
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = f'{written:.3f}'
+        with mock.patch('ethics_app.replicas.synced_at', return_value=written - 30):
+            self.assertTrue(ReplicaMiddleware.pinned(request))
+        with mock.patch('ethics_app.replicas.synced_at', return_value=written + 30):
+            self.assertFalse(ReplicaMiddleware.pinned(request))
+        # a replica that cannot tell when it was synced keeps the pin until the cookie expires
+        with mock.patch('ethics_app.replicas.synced_at', return_value=None):
+            self.assertTrue(ReplicaMiddleware.pinned(request))
+
+    def test_unpinned_and_malformed_cookies(self):
+        request = RequestFactory().get('/')
+        self.assertFalse(ReplicaMiddleware.pinned(request))
+        request.COOKIES[PIN_COOKIE] = 'garbage'
+        self.assertTrue(ReplicaMiddleware.pinned(request))
+
+
+class IdempotencyTests(AppTestCase):
+
+    def test_claim(self):
+        claimed, execution = idempotency.claim('job:1', 'tasks.job', 'first')
+        self.assertTrue(claimed)
+        self.assertEqual(idempotency.claim('job:1', 'tasks.job', 'second')[0], False)
+        # a retry of the claiming task runs again
+        self.assertTrue(idempotency.claim('job:1', 'tasks.job', 'first')[0])
+
+        idempotency.complete(execution, {'sent': 3})
+        claimed, execution = idempotency.claim('job:1', 'tasks.job', 'first')
+        self.assertFalse(claimed)
+        self.assertEqual(execution.result, {'sent': 3})
+
+    def test_expired_lease_is_taken_over_once(self):
+        _claimed, execution = idempotency.claim('job:2', 'tasks.job', 'dead')
+        TaskExecution.objects.filter(pk=execution.pk).update(
+            started_at=timezone.now() - timedelta(seconds=settings.TASK_IDEMPOTENCY_LEASE + 1)
+        )
+        claimed, execution = idempotency.claim('job:2', 'tasks.job', 'second')
+        self.assertTrue(claimed)
+        self.assertEqual(execution.task_id, 'second')
+        self.assertFalse(idempotency.claim('job:2', 'tasks.job', 'third')[0])
+        self.assertEqual(TaskExecution.objects.get(key='job:2').task_id, 'second')
+
+    def test_takeover_lost_to_another_worker(self):
+        _claimed, stale = idempotency.claim('job:3', 'tasks.job', 'dead')
+        expired = timezone.now() - timedelta(seconds=settings.TASK_IDEMPOTENCY_LEASE + 1)
+        TaskExecution.objects.filter(pk=stale.pk).update(started_at=expired)
+        stale.refresh_from_db()
+        # another worker takes over between our read and our update
+        TaskExecution.objects.filter(pk=stale.pk).update(task_id='other', started_at=timezone.now())
+        with mock.patch.object(TaskExecution.objects, 'get_or_create', return_value=(stale, False)):
+            self.assertFalse(idempotency.claim('job:3', 'tasks.job', 'second')[0])
+        self.assertEqual(TaskExecution.objects.get(key='job:3').task_id, 'other')
+
+    def test_idempotent_task(self):
+        runs = []
+
+        @idempotency.idempotent(lambda n: f'double:{n}')
+        def double(task, n):
+            runs.append(n)
+            return n * 2
+
+        @idempotency.idempotent(lambda: 'recurring', remember=False)
+        def recurring(task):
+            runs.append('recurring')
+
+        task = SimpleNamespace(name='tasks.double', request=SimpleNamespace(id='a'))
+        self.assertEqual(double(task, 2), 4)
+        task.request.id = 'b'
+        self.assertEqual(double(task, 2), 4)
+        recurring(task)
+        recurring(task)
+        self.assertEqual(runs, [2, 'recurring', 'recurring'])
+        self.assertFalse(TaskExecution.objects.filter(key='recurring').exists())
+
+
+
+    def test_failed_single_flight_run_releases_its_claim(self):
+        runs = []
+
+        @idempotency.idempotent(lambda: 'recurring', remember=False)
+        def recurring(task):
+            runs.append(task.request.id)
+            raise ValueError('mail server down')
+
+        task = SimpleNamespace(name='tasks.recurring', request=SimpleNamespace(id='a'))
+        with self.assertRaises(ValueError):
+            recurring(task)
+        self.assertFalse(TaskExecution.objects.filter(key='recurring').exists())
+        task.request.id = 'b'
+        with self.assertRaises(ValueError):
+            recurring(task)
+        self.assertEqual(runs, ['a', 'b'])
+
+    def test_retry_keeps_the_claim_for_the_same_task(self):
+        attempts = []
+
+        @idempotency.idempotent(lambda: 'relay', remember=False)
+        def relay(task):
+            attempts.append(task.request.id)
+            if len(attempts) == 1:
+                raise Retry('backpressure')
+            return 'relayed'
+
+        task = SimpleNamespace(name='tasks.relay', request=SimpleNamespace(id='a'))
+        with self.assertRaises(Retry):
+            relay(task)
+        self.assertTrue(TaskExecution.objects.filter(key='relay', task_id='a').exists())
+        other = SimpleNamespace(name='tasks.relay', request=SimpleNamespace(id='b'))
+        self.assertIsNone(relay(other))
+        self.assertEqual(relay(task), 'relayed')
+        self.assertEqual(attempts, ['a', 'a'])
+        self.assertFalse(TaskExecution.objects.filter(key='relay').exists())
+
+    def test_failed_remembered_task_keeps_its_claim_until_the_lease_runs_out(self):
+        @idempotency.idempotent(lambda: 'once')
+        def once(task):
+            raise ValueError('broken')
+
+        with self.assertRaises(ValueError):
+            once(SimpleNamespace(name='tasks.once', request=SimpleNamespace(id='a')))
+        execution = TaskExecution.objects.get(key='once')
+        self.assertIsNone(execution.completed_at)
+
+    def test_a_short_lease_is_taken_over_sooner(self):
+        _claimed, execution = idempotency.claim('relay:default', 'tasks.relay', 'dead', lease=60)
+        TaskExecution.objects.filter(pk=execution.pk).update(started_at=timezone.now() - timedelta(seconds=61))
+        self.assertFalse(idempotency.claim('relay:default', 'tasks.relay', 'second')[0])
+        self.assertTrue(idempotency.claim('relay:default', 'tasks.relay', 'second', lease=60)[0])
+
+
+class SearchBackendTests:
+    """Run against the backend named by ``backend``; mixed into a TestCase per backend."""
+
+    backend = None
+    ranked = True
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(REQUEST_SEARCH_BACKEND=self.backend))
+        # ascending keys, so that ordering by key alone would list the best match last
+        self.named = self.make_request(1, 'Amira Haddad', 'amira@example.com', 'Please send me my data.', days_ago=2)
+        self.mentioned = self.make_request(2, 'Lucas Martin', 'lucas@example.com', 'My wife Amira asked me to write.')
+        self.unrelated = self.make_request(
+            3, 'Jane Doe', 'jane.doe@example.com', 'Erase my account.', status='completed',
+        )
+
+    def make_request(self, number, full_name, email, description, days_ago=0, **fields):
+        request = DataSubjectRequest.objects.create(
+            id=uuid.UUID(int=number), request_type='access', full_name=full_name, email=email,
+            description=description, **fields,
+        )
+        DataSubjectRequest.objects.filter(pk=request.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return request
+
+    def found(self, query, **filters):
+        return [dsr.pk for dsr in search.search_requests(query, **filters)]
+
+    def test_every_word_must_match_and_the_last_may_be_a_prefix(self):
+        self.assertEqual(self.found('amira hadd'), [self.named.pk])
+        self.assertEqual(self.found('doe'), [self.unrelated.pk])
+        self.assertEqual(self.found('amira zzz'), [])
+        self.assertEqual(self.found('  '), [])
+
+    def test_names_rank_above_descriptions(self):
+        expected = [self.named.pk, self.mentioned.pk] if self.ranked else [self.mentioned.pk, self.named.pk]
+        self.assertEqual(self.found('amira'), expected)
+
+    def test_filters(self):
+        self.assertEqual(self.found('my', status='completed'), [self.unrelated.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        DataSubjectRequest.objects.filter(pk=self.unrelated.pk).update(full_name='Jane Amira Doe')
+        self.assertIn(self.unrelated.pk, self.found('amira'))
+        self.named.delete()
+        self.assertNotIn(self.named.pk, self.found('amira'))
+        self.assertEqual(self.found('haddad'), [])
+        search.backend_for().check()
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 needs SQLite')
+class FTS5SearchTests(SearchBackendTests, AppTestCase):
+    backend = 'ethics_app.search.FTS5Backend'
+
+    def test_index_survives_renumbered_rowids(self):
+        # VACUUM may renumber the rowids of a table without an INTEGER PRIMARY KEY
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {DataSubjectRequest._meta.db_table} SET rowid = rowid + 1000')
+        self.assertEqual(self.found('amira'), [self.named.pk, self.mentioned.pk])
+        search.backend_for().check()
+
+    def test_reindex_numbers_requests_oldest_first(self):
+        self.assertEqual(search.backend_for().reindex(batch_size=2), 3)
+        self.assertEqual(self.found('amira'), [self.named.pk, self.mentioned.pk])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT request_id FROM {search.backend_for().docs} ORDER BY docid')
+            numbered = [DataSubjectRequest._meta.pk.to_python(pk) for pk, in cursor.fetchall()]
+        self.assertEqual(numbered[0], self.named.pk)
+
+    def test_check_finds_requests_missing_from_the_index(self):
+        backend = search.backend_for()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {backend.docs} WHERE request_id = %s', [self.named.pk.hex])
+        with self.assertRaises(DatabaseError):
+            backend.check()
+        backend.reindex()
+        backend.check()
+        self.assertEqual(self.found('haddad'), [self.named.pk])
+
+    def test_admin_lists_matches_best_first(self):
+        self.client.force_login(User.objects.create(username='dpo', is_staff=True, is_superuser=True))
+        url = '/admin/ethics_app/datasubjectrequest/'
+        response = self.client.get(url, {'q': 'amira'})
+        self.assertEqual([dsr.pk for dsr in response.context['cl'].result_list], [self.named.pk, self.mentioned.pk])
+        # sorting on a column replaces the ranking
+        response = self.client.get(url, {'q': 'amira', 'o': '-2'})
+        self.assertEqual([dsr.pk for dsr in response.context['cl'].result_list], [self.mentioned.pk, self.named.pk])
+        response = self.client.get(url, {'q': 'nobody'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL')
+class PostgresSearchTests(SearchBackendTests, AppTestCase):
+    backend = 'ethics_app.search.PostgresBackend'
+
+
+class ScanSearchTests(SearchBackendTests, AppTestCase):
+    backend = 'ethics_app.search.ScanBackend'
+    ranked = False
+
+
+class SubjectIdentityTests(AppTestCase):
+
+    def make_request(self, email, **fields):
+        return DataSubjectRequest.objects.create(
+            request_type='access', email=email, full_name='Amira Haddad', description='My data', **fields,
+        )
+
+    def test_email_addresses_are_normalized_before_hashing(self):
+        self.assertEqual(identity.email_digest(' Amira@Example.COM '), identity.email_digest('amira@example.com'))
+        self.assertNotEqual(identity.email_digest('amira@example.com'), identity.email_digest('lucas@example.com'))
+
+    def test_request_sent_before_signing_up_joins_the_account(self):
+        request = self.make_request('Amira@example.com')
+        other = self.make_request('amira@example.com')
+        self.assertEqual(request.subject_id, other.subject_id)
+        user = User.objects.create(username='amira', email='amira@example.com')
+        subject = identity.resolve(user=user)
+        self.assertEqual(subject.user, user)
+        self.assertEqual(set(subject.requests.values_list('pk', flat=True)), {request.pk, other.pk})
+        self.assertEqual(identity.resolve(email='AMIRA@example.com'), subject)
+
+    def test_two_accounts_sharing_an_address_stay_apart(self):
+        first = User.objects.create(username='amira', email='shared@example.com')
+        second = User.objects.create(username='amira2', email='shared@example.com')
+        first_id, second_id = identity.subject_id_for_user(first), identity.subject_id_for_user(second)
+        self.assertNotEqual(first_id, second_id)
+        self.assertFalse(identity.merge(first_id, second_id))
+        self.assertEqual(Subject.objects.filter(user__isnull=False).count(), 2)
+
+    def test_login_links_the_anonymous_session(self):
+        anonymous = SessionStore()
+        anonymous.create()
+        consent = make_consent(session_key=anonymous.session_key)
+        user = User.objects.create(username='amira', email='amira@example.com')
+
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = anonymous.session_key
+        request.session = SessionStore(anonymous.session_key)
+        login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertNotEqual(request.session.session_key, anonymous.session_key)
+
+        subject = identity.resolve(session_key=anonymous.session_key)
+        self.assertEqual(subject.user, user)
+        self.assertEqual(identity.resolve(session_key=request.session.session_key), subject)
+        consents = [record.pk for queryset in identity.subject_consents(subject) for record in queryset]
+        self.assertEqual(consents, [consent.pk])
+
+    def test_erase_keeps_the_requests(self):
+        user = User.objects.create(username='amira', email='amira@example.com')
+        request = self.make_request('amira@example.com')
+        session = SessionStore()
+        session.create()
+        identity.link(identity.subject_id_for_user(user), 'session', session.session_key)
+        make_consent(user=user)
+        make_consent(session_key=session.session_key, consent_type='marketing')
+        subject = identity.resolve(user=user)
+
+        expected = {'consent records': 2, 'sessions': 1, 'user accounts': 1, 'data packages': 0}
+        self.assertEqual(identity.erase(subject, dry_run=True), expected)
+        self.assertEqual(ConsentRecord.objects.count(), 2)
+        self.assertEqual(identity.erase(subject), expected)
+        self.assertFalse(ConsentRecord.objects.exists())
+        self.assertFalse(Session.objects.filter(session_key=session.session_key).exists())
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        request.refresh_from_db()
+        self.assertEqual(request.subject_id, subject.pk)
+        self.assertEqual(identity.resolve(email='amira@example.com').pk, subject.pk)
+
+    def test_rebuild_indexes_rows_written_without_signals(self):
+        User.objects.bulk_create([User(username='amira', email='amira@example.com'), User(username='nomail')])
+        DataSubjectRequest.objects.bulk_create([
+            DataSubjectRequest(request_type='access', email=email, full_name='A', description='d')
+            for email in ('amira@example.com', 'lucas@example.com', 'lucas@example.com')
+        ])
+        self.assertEqual(identity.rebuild(batch_size=1), (2, 3))
+        self.assertEqual(identity.rebuild(), (0, 0))
+        amira = identity.resolve(user=User.objects.get(username='amira'))
+        self.assertEqual(amira.requests.count(), 1)
+        lucas = identity.resolve(email='lucas@example.com')
+        self.assertIsNone(lucas.user_id)
+        self.assertEqual(lucas.requests.count(), 2)
+
+    def test_cache_evicts_the_least_recent_and_expires(self):
+        cache = identity.SubjectCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        with mock.patch('ethics_app.identity.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+
+
+@override_settings(RATE_LIMITS={'/api/cookie-consent/': {'session': (0.001, 3), 'ip': (0.001, 5)}})
+class RateLimitTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.middleware = RateLimitMiddleware(lambda request: HttpResponse())
+        self.factory = RequestFactory()
+
+    def post(self, path='/api/cookie-consent/', session_key=None, **meta):
+        if session_key is not None:
+            self.factory.cookies[settings.SESSION_COOKIE_NAME] = session_key
+        request = self.factory.post(path, REMOTE_ADDR=meta.pop('remote', '198.51.100.7'), **meta)
+        self.factory.cookies.clear()
+        return self.middleware(request).status_code
+
+    def test_trusted_client_ip(self):
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.9')
+        self.assertEqual(jurisdiction.trusted_client_ip(request), '10.0.0.2')
+        with self.settings(NUM_PROXIES=1):
+            self.assertEqual(jurisdiction.trusted_client_ip(request), '203.0.113.9')
+        with self.settings(NUM_PROXIES=2):
+            self.assertEqual(jurisdiction.trusted_client_ip(request), '6.6.6.6')
+        with self.settings(NUM_PROXIES=5):
+            self.assertEqual(jurisdiction.trusted_client_ip(request), '6.6.6.6')
+
+    def test_forwarded_for_does_not_buy_fresh_buckets(self):
+        statuses = [self.post(HTTP_X_FORWARDED_FOR=f'203.0.113.{n}') for n in range(6)]
+        self.assertEqual(statuses, [200] * 3 + [429] * 3)
+
+    def test_forged_session_cookies_share_the_address_bucket(self):
+        statuses = [self.post(session_key=f'{n:032x}') for n in range(6)]
+        self.assertEqual(statuses, [200] * 3 + [429] * 3)
+
+    def test_real_sessions_have_their_own_buckets_under_the_address_limit(self):
+        first, second = SessionStore(), SessionStore()
+        first.create()
+        second.create()
+        statuses = [self.post(session_key=first.session_key) for _ in range(4)]
+        self.assertEqual(statuses, [200] * 3 + [429])
+        statuses = [self.post(session_key=second.session_key) for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(self.post(remote='198.51.100.8'), 200)
+
+    def test_language_prefixed_paths_are_limited_and_others_are_not(self):
+        statuses = [self.post('/fr/api/cookie-consent/') for _ in range(4)]
+        self.assertEqual(statuses[-1], 429)
+        self.assertEqual(self.post('/consent/'), 200)
+
+
+class WarmupTests(SimpleTestCase):
+
+    def test_a_failing_step_is_reported_and_the_others_still_run(self):
+        calls = []
+        steps = {
+            'first': lambda: calls.append('first'),
+            'broken': mock.Mock(side_effect=OSError('gone')),
+            'last': lambda: calls.append('last'),
+        }
+        with mock.patch.dict(warmup.STEPS, steps, clear=True), self.assertLogs('ethics_app.warmup', 'WARNING'):
+            results = warmup.warm_up()
+        self.assertEqual(calls, ['first', 'last'])
+        self.assertEqual([(name, error) for name, _, error in results],
+                         [('first', None), ('broken', 'OSError: gone'), ('last', None)])
+
+    def test_steps_warm_up_without_errors(self):
+        results = warmup.warm_up(['urls', 'templates', 'crispy', 'forms', 'translations'])
+        self.assertEqual([error for *_, error in results], [None] * 5)
+
+    def test_prefork_warms_up_and_freezes_once(self):
+        with mock.patch.object(warmup, '_prefork_done', False), \
+                mock.patch.object(warmup, 'warm_up') as warm_up, mock.patch.object(warmup.gc, 'freeze') as freeze:
+            warmup.prefork()
+            warmup.prefork()
+        warm_up.assert_called_once_with()
+        freeze.assert_called_once_with()
+
+    def test_wsgi_and_asgi_warm_up_on_import_only_when_asked(self):
+        for name in ('wsgi', 'asgi'):
+            module = importlib.import_module(f'data_ethics_project.{name}')
+            for flag in (False, True):
+                with self.subTest(module=name, flag=flag), self.settings(WARMUP_ON_IMPORT=flag), \
+                        mock.patch.object(warmup, 'prefork') as prefork:
+                    importlib.reload(module)
+                    self.assertEqual(prefork.called, flag)
+
+
+class OutboxTests(AppTestCase):
+
+    def post(self, consents):
+        response = self.client.post(
+            '/api/cookie-consent/', json.dumps({'consents': consents}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_consent_changes_are_relayed_in_order(self):
+        self.post({'analytics': True, 'marketing': False})
+        self.post({'analytics': True, 'marketing': False})
+        self.post({'marketing': True})
+        self.assertEqual(OutboxEvent.objects.count(), 3)
+
+        sink = outbox.MemorySink()
+        self.assertEqual(outbox.relay(sink=sink, batch_size=2), 3)
+        self.assertFalse(OutboxEvent.objects.exists())
+        decisions = [(m['consent_type'], m['consent_given']) for m in sink.messages]
+        self.assertEqual(decisions, [('analytics', True), ('marketing', False), ('marketing', True)])
+
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertEqual({m['subject'] for m in sink.messages}, {outbox.subject_key(session_key=session_key)})
+        self.assertNotIn(session_key, sink.messages[0]['subject'])
+
+    def test_events_stay_when_the_sink_refuses_them(self):
+        self.post({'analytics': True})
+
+        class FullSink(outbox.Sink):
+            def publish(self, messages):
+                raise outbox.Backpressure('full', retry_after=1)
+
+        with self.assertRaises(outbox.Backpressure):
+            outbox.relay(sink=FullSink())
+        self.assertEqual(outbox.backlog()[0], 1)
+
+
+@skipUnless(importlib.util.find_spec('numpy'), 'needs numpy')
+class ConsentAnalyticsTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.enterContext(override_settings(CONSENT_SNAPSHOT_DIR=self.directory))
+        en, fr = make_policy('1.0', 'en'), make_policy('1.0', 'fr')
+        first = datetime(2026, 1, 5, 10, tzinfo=dt_timezone.utc)
+        second = datetime(2026, 1, 6, 9, tzinfo=dt_timezone.utc)
+        make_consent(consent_type='analytics', consent_given=True, policy=en, timestamp=first)
+        make_consent(consent_type='analytics', consent_given=False, policy=fr, timestamp=first)
+        make_consent(consent_type='marketing', consent_given=True, timestamp=first)
+        make_consent(consent_type='analytics', consent_given=True, policy=en, timestamp=second)
+
+    def test_snapshot_rates_and_series(self):
+        path, rows = analytics.build_snapshot()
+        self.assertEqual(rows, 4)
+        snapshot = analytics.current_snapshot()
+        self.assertEqual(snapshot.path, path)
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(analytics.grant_rates(snapshot, by=('type',)), [
+            {'type': 'analytics', 'total': 3, 'granted': 2, 'rate': 0.6667},
+            {'type': 'marketing', 'total': 1, 'granted': 1, 'rate': 1.0},
+        ])
+        self.assertEqual(analytics.grant_rates(snapshot, types=['analytics'], by=('language',)), [
+            {'language': 'en', 'total': 2, 'granted': 2, 'rate': 1.0},
+            {'language': 'fr', 'total': 1, 'granted': 0, 'rate': 0.0},
+        ])
+        # consents without a policy have no language
+        self.assertEqual(
+            [row['language'] for row in analytics.grant_rates(snapshot, types=['marketing'], by=('language',))],
+            [analytics.UNKNOWN_LANGUAGE],
+        )
+        self.assertEqual(analytics.grant_rates(snapshot, start=date(2026, 1, 6), by=()), [
+            {'total': 1, 'granted': 1, 'rate': 1.0},
+        ])
+        self.assertEqual(analytics.time_series(snapshot, by=()), [
+            {'day': '2026-01-05', 'total': 3, 'granted': 2, 'rate': 0.6667},
+            {'day': '2026-01-06', 'total': 1, 'granted': 1, 'rate': 1.0},
+        ])
+        with self.assertRaises(ValueError):
+            analytics.grant_rates(snapshot, types=['cookies'])
+
+    def test_a_newer_snapshot_replaces_the_loaded_one(self):
+        with self.assertRaises(analytics.SnapshotUnavailable):
+            analytics.current_snapshot()
+        analytics.build_snapshot()
+        loaded = analytics.current_snapshot()
+        self.assertIs(analytics.current_snapshot(), loaded)
+
+        make_consent(consent_type='functional')
+        analytics.build_snapshot()
+        analytics.build_snapshot()
+        self.assertEqual(len(analytics.current_snapshot()), 5)
+        self.assertEqual(len([p for p in self.directory.glob('snapshot-*') if p.is_dir()]), 2)
+
+    def test_view(self):
+        url = '/api/analytics/consents/'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create(username='dpo', is_staff=True))
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get(url).status_code, 503)
+
+        analytics.build_snapshot()
+        response = self.client.get(url, {'metric': 'series', 'type': 'analytics', 'by': 'language'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['snapshot']['records'], 4)
+        self.assertEqual([(row['day'], row['language'], row['total']) for row in data['rows']],
+                         [('2026-01-05', 'en', 1), ('2026-01-05', 'fr', 1), ('2026-01-06', 'en', 1)])
+
+        for params in ({'metric': 'median'}, {'type': 'cookies'}, {'start': 'yesterday'}, {'by': 'country'}):
+            with self.subTest(params), self.assertLogs('django.request', 'WARNING'):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class PolicyHistoryTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        base = ''.join(f'<p>Clause {i}: we keep category {i} data for {i} months.</p>\n' for i in range(50))
+        self.texts = [base, base.replace('Clause 7:', 'Clause 7 (amended):'), base + '<p>Clause 50.</p>\n']
+        self.versions = [
+            make_policy(f'{n}.0', content=text, days_ago=10 - n) for n, text in enumerate(self.texts, 1)
+        ]
+
+    def assertTexts(self, versions, texts):
+        self.assertEqual(policy_history.texts_of('en'), {p.pk: t for p, t in zip(versions, texts)})
+        for policy, text in zip(versions, texts):
+            stored = PrivacyPolicy.objects.get(pk=policy.pk)
+            self.assertEqual(stored.content, text)
+            self.assertEqual(policy_history.content_of(stored), text)
+            self.assertEqual(stored.content_hash, policy_history.content_hash(text))
+
+    def assertPacked(self, newest):
+        for policy in PrivacyPolicy.objects.filter(language='en'):
+            if policy.pk == newest.pk:
+                self.assertIsNone(policy.delta)
+            else:
+                self.assertEqual(policy.stored_content, '')
+                self.assertIsNotNone(policy.delta)
+
+    def test_only_the_newest_version_is_stored_in_full(self):
+        self.assertPacked(self.versions[-1])
+        self.assertTexts(self.versions, self.texts)
+        _versions, full, stored = policy_history.storage('en')
+        self.assertLess(stored, full / 2)
+
+    def test_content_is_the_full_text_of_every_version(self):
+        newest = PrivacyPolicy.objects.get(pk=self.versions[-1].pk)
+        make_policy('4.0', content=self.texts[-1] + '<p>Clause 51.</p>\n')
+        self.assertEqual(newest.content, self.texts[-1])
+        self.assertEqual([policy.content for policy in policy_history.versions('en')[:3]], self.texts)
+
+    def test_editing_an_earlier_version_repacks(self):
+        middle = PrivacyPolicy.objects.get(pk=self.versions[1].pk)
+        self.assertEqual(middle.content, self.texts[1])
+        middle.content = self.texts[1].replace('Clause 9:', 'Clause nine:')
+        middle.save()
+        self.texts[1] = middle.content
+        self.assertPacked(self.versions[-1])
+        self.assertTexts(self.versions, self.texts)
+
+    def test_saving_an_earlier_version_unedited_keeps_its_text(self):
+        middle = PrivacyPolicy.objects.get(pk=self.versions[1].pk)
+        middle.is_active = True
+        middle.save()
+        self.assertTexts(self.versions, self.texts)
+
+    def test_editing_the_newest_version_repacks(self):
+        newest = self.versions[-1]
+        newest.content = self.texts[-1] + '<p>Clause 51.</p>\n'
+        newest.save()
+        self.texts[-1] = newest.content
+        self.assertTexts(self.versions, self.texts)
+
+    def test_deleting_versions_repacks(self):
+        self.versions.pop().delete()
+        self.texts.pop()
+        self.assertPacked(self.versions[-1])
+        self.assertTexts(self.versions, self.texts)
+
+        self.versions.pop(0).delete()
+        self.texts.pop(0)
+        self.assertTexts(self.versions, self.texts)
+
+    def test_languages_are_packed_apart(self):
+        french = make_policy('1.0', language='fr', content='<p>Bonjour</p>\n')
+        self.assertEqual(PrivacyPolicy.objects.get(pk=french.pk).content, '<p>Bonjour</p>\n')
+        self.assertTexts(self.versions, self.texts)
+
+
+class ByteRangeTests(SimpleTestCase):
+
+    def test_byte_range(self):
+        cases = {
+            None: None,
+            '': None,
+            'bytes=0-99': (0, 99),
+            'bytes=500-': (500, 999),
+            'bytes=-100': (900, 999),
+            'bytes=-5000': (0, 999),
+            'bytes=990-5000': (990, 999),
+            'bytes=0-1,5-6': None,
+            'bytes=9-3': None,
+            'bytes=-': None,
+            'items=0-1': None,
+        }
+        for header, expected in cases.items():
+            self.assertEqual(dsar.byte_range(header, 1000), expected, header)
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=1000-', 'bytes=1000-1100', 'bytes=-0'):
+            with self.assertRaises(ValueError, msg=header):
+                dsar.byte_range(header, 1000)
+
+    def test_file_range_reads_only_its_span(self):
+        span = dsar.FileRange(io.BytesIO(bytes(range(100))), 10, 19)
+        self.assertEqual(span.read(3), bytes([10, 11, 12]))
+        self.assertEqual(span.tell(), 3)
+        self.assertEqual(span.read(), bytes(range(13, 20)))
+        self.assertEqual(span.read(5), b'')
+        self.assertEqual(span.seek(0), 0)
+        self.assertEqual(span.read(100), bytes(range(10, 20)))
+        span.seek(-2, os.SEEK_END)
+        self.assertEqual(span.read(), bytes([18, 19]))
+        span.seek(-4, os.SEEK_CUR)
+        self.assertEqual(span.read(1), bytes([16]))
+
+
+class DataPackageTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(DSAR_PACKAGE_DIR=directory))
+        self.request = DataSubjectRequest.objects.create(
+            request_type='access', email='amira@example.com', full_name='Amira Haddad', description='My data',
+        )
+        self.package = dsar.build(self.request)
+        self.path = urlparse(dsar.download_url(self.package)).path
+        with open(dsar.path_for(self.package.digest), 'rb') as f:
+            self.data = f.read()
+
+    def get(self, **headers):
+        response = self.client.get(self.path, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_whole_download(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range_download(self):
+        response, body = self.get(HTTP_RANGE='bytes=10-29')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[10:30])
+        self.assertEqual(response['Content-Range'], f'bytes 10-29/{len(self.data)}')
+
+        response, body = self.get(HTTP_RANGE='bytes=-16')
+        self.assertEqual(body, self.data[-16:])
+
+    def test_range_past_the_end(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response, _body = self.get(HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_changed_file_sends_it_all(self):
+        response, body = self.get(HTTP_RANGE='bytes=10-29', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_forged_and_expired_links(self):
+        self.assertEqual(self.client.get(self.path[:-3] + 'xx/').status_code, 404)
+        DataPackage.objects.filter(pk=self.package.pk).update(expires_at=timezone.now())
+        self.assertEqual(self.client.get(self.path).status_code, 410)
+
+    def test_unchanged_data_shares_one_file(self):
+        again = DataSubjectRequest.objects.create(
+            request_type='portability', email='amira@example.com', full_name='Amira Haddad', description='Again',
+        )
+        self.assertEqual(dsar.build(again).digest, self.package.digest)
+        DataPackage.objects.filter(pk=self.package.pk).update(expires_at=timezone.now())
+        self.assertEqual(dsar.purge(grace=0), (1, 0))
+        self.assertTrue(dsar.path_for(self.package.digest).exists())
+        DataPackage.objects.update(expires_at=timezone.now())
+        self.assertEqual(dsar.purge(grace=0), (1, 0))
+        self.assertFalse(dsar.path_for(self.package.digest).exists())
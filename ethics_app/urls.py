@@ -4,7 +4,14 @@ from . import views
 urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('privacy-policy/', views.PrivacyPolicyView.as_view(), name='privacy_policy'),
+    path('privacy-policy/changes/', views.PolicyChangesView.as_view(), name='policy_changes'),
     path('consent/', views.ConsentManagementView.as_view(), name='consent_management'),
     path('data-request/', views.DataRequestView.as_view(), name='data_request'),
+    path('data-request/package/<str:token>/', views.DataPackageView.as_view(), name='data_package'),
     path('api/cookie-consent/', views.CookieConsentAPIView.as_view(), name='cookie_consent_api'),
+    path('api/policies/diff/', views.PolicyDiffAPIView.as_view(), name='policy_diff_api'),
+    path('api/analytics/consents/', views.ConsentAnalyticsView.as_view(), name='consent_analytics_api'),
+    path('api/requests/search/', views.RequestSearchView.as_view(), name='request_search_api'),
+    path('profiler/', views.ProfilerReportView.as_view(), name='profiler_report'),
+    path('rate-limits/', views.RateLimitReportView.as_view(), name='rate_limit_report'),
 ]
@@ -1,15 +1,30 @@
 from django.shortcuts import render, redirect
 from django.views.generic import TemplateView, CreateView
 from django.contrib import messages
-from django.utils.translation import gettext_lazy as _
-from django.http import JsonResponse
+from django.utils.translation import get_supported_language_variant, gettext_lazy as _
+from django.http import Http404, HttpResponseGone, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views import View
 from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
 import json
+import time
+from datetime import date, timedelta
+from django.utils import timezone
+from . import analytics, dsar, policy_history
 from .models import ConsentRecord, DataSubjectRequest, PrivacyPolicy
 from .forms import ConsentForm, DataSubjectRequestForm, CookieSettingsForm
+from .middleware import slow_request_log
+from .jurisdiction import for_request, trusted_client_ip
+from .policies import current_policies
+from .ratelimit import rate_limit_stats
+from . import outbox
+from .replicas import on_replica
+from .search import backend_for, search_requests
+from .sharding import subject_consents
 
 class HomeView(TemplateView):
     template_name = 'ethics_app/index.html'
@@ -33,6 +48,29 @@ class PrivacyPolicyView(TemplateView):
         except PrivacyPolicy.DoesNotExist:
             policy = None
         context['policy'] = policy
+        if policy is not None:
+            context['policy_content'] = policy.content
+            context['has_earlier_versions'] = PrivacyPolicy.objects.filter(
+                language=language, effective_date__lt=policy.effective_date
+            ).exists()
+        return context
+
+class PolicyChangesView(TemplateView):
+    """What changed between two versions of the privacy policy, by default the current one and the one before."""
+    template_name = 'ethics_app/policy_changes.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        language = self.request.LANGUAGE_CODE
+        try:
+            old, new, versions = policy_history.pair(language, self.request.GET.get('from'), self.request.GET.get('to'))
+        except PrivacyPolicy.DoesNotExist:
+            raise Http404('No such privacy policy version')
+        except ValueError:
+            versions = policy_history.versions(language)
+            context.update(versions=versions, old=None, new=versions[0], diff=None)
+            return context
+        context.update(versions=versions, old=old, new=new, diff=policy_history.diff(old, new))
         return context
 
 class ConsentManagementView(TemplateView):
@@ -40,22 +78,27 @@ class ConsentManagementView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        form = ConsentForm()
 
         # Get current consent status
         user_consents = {}
         if self.request.user.is_authenticated:
-            consents = ConsentRecord.objects.filter(user=self.request.user)
+            consents = subject_consents(user=self.request.user)
         else:
-            consents = ConsentRecord.objects.filter(
-                session_key=self.request.session.session_key
-            )
+            consents = subject_consents(session_key=self.request.session.session_key)
 
-        for consent in consents:
+        for consent in on_replica(consents):
             user_consents[consent.consent_type] = consent.consent_given
 
+        # Pre-select stored choices, or the defaults of the visitor's regime
+        jurisdiction = for_request(self.request)
+        choices = {**jurisdiction.defaults, **user_consents}
+        form = ConsentForm(initial={
+            f'{consent_type}_cookies': given for consent_type, given in choices.items()
+        })
+
         context['form'] = form
         context['current_consents'] = user_consents
+        context['jurisdiction'] = jurisdiction
         return context
 
     def post(self, request, *args, **kwargs):
@@ -75,35 +118,32 @@ class ConsentManagementView(TemplateView):
             'marketing_cookies': 'marketing',
         }
 
-        for form_field, consent_type in consent_mapping.items():
-            consent_given = consent_data.get(form_field, False)
+        if self.request.user.is_authenticated:
+            stored = subject_consents(user=self.request.user)
+            subject = {'user': self.request.user}
+        else:
+            stored = subject_consents(session_key=self.request.session.session_key)
+            subject = {'session_key': self.request.session.session_key}
 
-            defaults = {
-                'consent_given': consent_given,
-                'ip_address': self._get_client_ip(),
-                'expiry_date': timezone.now() + timedelta(days=365),
-            }
+        with transaction.atomic(using=stored.db):
+            previous = dict(stored.values_list('consent_type', 'consent_given'))
+            policy_id = current_policies.for_language(self.request.LANGUAGE_CODE)
+            changes = []
+            for form_field, consent_type in consent_mapping.items():
+                consent_given = consent_data.get(form_field, False)
 
-            if self.request.user.is_authenticated:
-                ConsentRecord.objects.update_or_create(
-                    user=self.request.user,
-                    consent_type=consent_type,
-                    defaults=defaults
-                )
-            else:
-                ConsentRecord.objects.update_or_create(
-                    session_key=self.request.session.session_key,
-                    consent_type=consent_type,
-                    defaults=defaults
-                )
+                defaults = {
+                    'consent_given': consent_given,
+                    'ip_address': trusted_client_ip(self.request),
+                    'country': for_request(self.request).country,
+                    'expiry_date': timezone.now() + timedelta(days=365),
+                    'policy_id': policy_id,
+                }
 
-    def _get_client_ip(self):
-        x_forwarded_for = self.request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = self.request.META.get('REMOTE_ADDR')
-        return ip
+                record, _ = stored.update_or_create(consent_type=consent_type, defaults=defaults, **subject)
+                if previous.get(consent_type) != consent_given:
+                    changes.append(record)
+            outbox.record(stored.db, changes)
 
 class DataRequestView(CreateView):
     model = DataSubjectRequest
@@ -129,32 +169,260 @@ class DataRequestView(CreateView):
         )
         return response
 
+class DataPackageView(View):
+    """Download of a data access package, by the signed link sent to the requester."""
+
+    def get(self, request, token):
+        package = dsar.package_for(token)
+        if package is None:
+            raise Http404
+        if package.expires_at <= timezone.now():
+            return HttpResponseGone(_('This download link has expired. Please submit a new request.'))
+        return dsar.package_response(request, package)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CookieConsentAPIView(TemplateView):
+    """
+    Record cookie consent for the current session.
+
+    Accepts a single decision, ``{"type": "analytics", "consent": true}``, or a
+    coalesced batch, ``{"consents": {"analytics": true, "marketing": false}}``.
+    The batch may also arrive as a form field named ``consents`` (as sent by
+    ``navigator.sendBeacon``). The API is not under the language prefix, so
+    the page sends its ``language`` along to record consent under the policy
+    the visitor was shown. Responds with the session's stored state so the
+    client can skip requests that would not change anything.
+    """
+
     def post(self, request, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            consent_type = data.get('type')
-            consent_given = data.get('consent', False)
-
-            # Save consent record
-            ConsentRecord.objects.update_or_create(
-                session_key=request.session.session_key,
-                consent_type=consent_type,
-                defaults={
-                    'consent_given': consent_given,
-                    'ip_address': self._get_client_ip(request),
-                }
-            )
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > getattr(settings, 'CONSENT_API_MAX_BODY', 4096):
+            return JsonResponse({'status': 'error', 'message': 'Request body too large'}, status=413)
+        try:
+            consents, language = self._parse_consents(request)
+        except (ValueError, TypeError, AttributeError) as e:
+            # malformed JSON, or JSON of the wrong shape
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
-            return JsonResponse({'status': 'success'})
-        except Exception as e:
-            return JsonResponse({'status': 'error', 'message': str(e)})
+        if not request.session.session_key:
+            request.session.save()
+        state = self._save_consents(request, consents, self._language(request, language))
 
-    def _get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
+        return JsonResponse({
+            'status': 'success',
+            'consents': state,
+            'expires': request.session.get_expiry_date().isoformat(),
+        })
+
+    def _parse_consents(self, request):
+        if request.content_type == 'application/json':
+            data = json.loads(request.body)
+            if 'consents' in data:
+                consents = data['consents']
+            else:
+                consents = {data.get('type'): data.get('consent', False)}
+            language = data.get('language')
         else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+            consents = json.loads(request.POST.get('consents', '{}'))
+            language = request.POST.get('language')
+
+        valid_types = dict(ConsentRecord.CONSENT_TYPES)
+        for consent_type in consents:
+            if consent_type not in valid_types:
+                raise ValueError(f'Unknown consent type: {consent_type}')
+        return {consent_type: bool(given) for consent_type, given in consents.items()}, language
+
+    def _language(self, request, language):
+        """The page's language if it is one we serve, else the request's."""
+        if isinstance(language, str):
+            try:
+                return get_supported_language_variant(language)
+            except LookupError:
+                pass
+        return request.LANGUAGE_CODE
+
+    def _save_consents(self, request, consents, language):
+        """Write only the decisions that differ from what is stored, in one transaction."""
+        session_key = request.session.session_key
+        expiry_date = timezone.now() + timedelta(days=settings.CONSENT_EXPIRY_DAYS)
+        ip_address = trusted_client_ip(request)
+        country = for_request(request).country
+        policy_id = current_policies.for_language(language)
+
+        stored = subject_consents(session_key=session_key)
+
+        with transaction.atomic(using=stored.db):
+            records = {record.consent_type: record for record in stored}
+            changed, created = [], []
+            for consent_type, consent_given in consents.items():
+                record = records.get(consent_type)
+                if record is None:
+                    record = ConsentRecord(
+                        session_key=session_key,
+                        consent_type=consent_type,
+                        consent_given=consent_given,
+                        ip_address=ip_address,
+                        country=country,
+                        expiry_date=expiry_date,
+                        policy_id=policy_id,
+                    )
+                    created.append(record)
+                    records[consent_type] = record
+                elif record.consent_given != consent_given or record.policy_id != policy_id:
+                    # a repeated decision still re-confirms it under the current policy
+                    record.consent_given = consent_given
+                    record.ip_address = ip_address
+                    record.country = country
+                    record.expiry_date = expiry_date
+                    record.policy_id = policy_id
+                    changed.append(record)
+
+            if changed:
+                stored.bulk_update(
+                    changed, ['consent_given', 'ip_address', 'country', 'expiry_date', 'policy_id']
+                )
+            if created:
+                stored.bulk_create(created)
+            # after the writes, so the events of one subject commit in order
+            outbox.record(stored.db, changed + created)
+
+        return {consent_type: record.consent_given for consent_type, record in records.items()}
+
+class PolicyDiffAPIView(View):
+    """Changes between two privacy policy versions of ?language=, chosen with from and to."""
+
+    def get(self, request, *args, **kwargs):
+        language = request.GET.get('language') or request.LANGUAGE_CODE
+        try:
+            old, new, _ = policy_history.pair(language, request.GET.get('from'), request.GET.get('to'))
+        except PrivacyPolicy.DoesNotExist as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        return JsonResponse({
+            'language': language,
+            'from': {'version': old.version, 'effective_date': old.effective_date.isoformat()},
+            'to': {'version': new.version, 'effective_date': new.effective_date.isoformat()},
+            **policy_history.diff(old, new),
+        })
+
+@method_decorator(staff_member_required, name='dispatch')
+class ProfilerReportView(View):
+    """Slowest sampled requests recorded by QueryProfilerMiddleware."""
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({
+            'enabled': getattr(settings, 'PROFILER_ENABLED', False),
+            'sample_rate': getattr(settings, 'PROFILER_SAMPLE_RATE', 0.1),
+            'requests': slow_request_log.entries(),
+        })
+
+    def delete(self, request, *args, **kwargs):
+        slow_request_log.clear()
+        return JsonResponse({'status': 'success'})
+
+@method_decorator(staff_member_required, name='dispatch')
+class RateLimitReportView(View):
+    """Requests allowed and throttled by RateLimitMiddleware, and the most throttled clients."""
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({
+            'limits': getattr(settings, 'RATE_LIMITS', {}),
+            'shared_cache': getattr(settings, 'RATE_LIMIT_CACHE', None),
+            **rate_limit_stats.report(),
+        })
+
+    def delete(self, request, *args, **kwargs):
+        rate_limit_stats.clear()
+        return JsonResponse({'status': 'success'})
+
+@method_decorator(staff_member_required, name='dispatch')
+class ConsentAnalyticsView(View):
+    """
+    Consent rates from the columnar snapshot (see ethics_app.analytics), for
+    dashboards: ?metric=rates|series|cohorts, sliced with start, end, type,
+    language and by, in periods of ``days`` (series, cohorts).
+    """
+
+    def get(self, request, *args, **kwargs):
+        metric = request.GET.get('metric', 'rates')
+        if metric not in analytics.METRICS:
+            return JsonResponse({'status': 'error', 'message': f"metric must be one of {', '.join(analytics.METRICS)}"}, status=400)
+        try:
+            options = {
+                'start': date.fromisoformat(request.GET['start']) if request.GET.get('start') else None,
+                'end': date.fromisoformat(request.GET['end']) if request.GET.get('end') else None,
+                'types': self._values(request, 'type'),
+                'langs': self._values(request, 'language'),
+            }
+            if metric != 'cohorts':
+                by = self._values(request, 'by')
+                if by is not None:
+                    if set(by) - {'type', 'language'}:
+                        raise ValueError('by takes type and language')
+                    options['by'] = by
+            if metric != 'rates':
+                options['days'] = min(max(int(request.GET.get('days', 1 if metric == 'series' else 7)), 1), 366)
+            if metric == 'cohorts':
+                options['ages'] = min(max(int(request.GET.get('ages', 12)), 1), 104)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+        try:
+            snapshot = analytics.current_snapshot()
+            start = time.perf_counter()
+            rows = analytics.METRICS[metric](snapshot, **options)
+        except (analytics.SnapshotUnavailable, ImportError) as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=503)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        return JsonResponse({
+            'metric': metric,
+            'snapshot': {'built_at': snapshot.built_at.isoformat(), 'records': len(snapshot)},
+            'took_ms': round((time.perf_counter() - start) * 1000, 2),
+            'rows': rows,
+        })
+
+    @staticmethod
+    def _values(request, param):
+        """Repeated or comma-separated values of ``param``, None when absent."""
+        values = [v for value in request.GET.getlist(param) for v in value.split(',') if v]
+        return values or None
+
+@method_decorator(staff_member_required, name='dispatch')
+class RequestSearchView(View):
+    """Data subject requests matching ?q=, best first, for DPO triage."""
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')
+        filters = {
+            field: request.GET[param]
+            for param, field in (('status', 'status'), ('type', 'request_type'))
+            if request.GET.get(param)
+        }
+        try:
+            limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+            offset = max(int(request.GET.get('offset', 0)), 0)
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'limit and offset must be integers'}, status=400)
+
+        start = time.perf_counter()
+        results = search_requests(query, limit, offset, **filters)
+        return JsonResponse({
+            'query': query,
+            'backend': backend_for().name,
+            'took_ms': round((time.perf_counter() - start) * 1000, 2),
+            'results': [{
+                'id': str(dsr.pk),
+                'full_name': dsr.full_name,
+                'email': dsr.email,
+                'request_type': dsr.request_type,
+                'status': dsr.status,
+                'created_at': dsr.created_at.isoformat(),
+                'description': dsr.description[:200],
+                'rank': dsr.search_rank,
+            } for dsr in results],
+        })
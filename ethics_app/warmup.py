@@ -0,0 +1,238 @@
+"""
+Worker warm-up and startup profiling.
+
+A fresh process pays on its first requests for work that is the same in
+every worker: populating the URL resolvers of each language, compiling
+templates (ours, the crispy-forms pack and the form widgets), loading the
+gettext catalogs, reading the static files manifest, loading the IP range
+index and the current policies, and importing the database backends.
+``warm_up`` does it all up front, step by step. ``prefork`` also freezes the objects it created
+out of the garbage collector's reach, so that after a preloading master
+forks (``gunicorn --preload``, the Celery prefork pool) the workers share
+those pages instead of each dirtying its own copy.
+
+Database connections cannot be shared across a fork, so the ``databases``
+step closes what it opened; each worker connects on its first query.
+Steps fail on their own: a missing table or an unreachable database is
+logged and the others still run.
+
+``import_profile`` runs a worker's imports under ``python -X importtime``
+and sums the report per module and per top-level package, to keep an eye on
+startup regressions (``manage.py warmup --importtime``).
+"""
+import gc
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils import formats, translation
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIRS = [Path(__file__).resolve().parent / 'templates']
+
+
+def warm_urls():
+    from . import urls
+    # i18n_patterns keep a reverse dictionary per language
+    for code, _ in settings.LANGUAGES:
+        with translation.override(code):
+            for pattern in urls.urlpatterns:
+                # one reverse() fills the dictionary; patterns taking arguments are skipped
+                if pattern.name and not pattern.pattern.converters:
+                    reverse(pattern.name)
+
+
+def warm_templates():
+    for root in TEMPLATE_DIRS:
+        for path in sorted(root.rglob('*.html')):
+            get_template(path.relative_to(root).as_posix())
+
+
+def warm_crispy():
+    from crispy_forms.templatetags.crispy_forms_filters import uni_form_template, uni_formset_template
+    from crispy_forms.templatetags.crispy_forms_tags import whole_uni_form_template, whole_uni_formset_template
+    from crispy_forms.utils import default_field_template
+
+    pack = getattr(settings, 'CRISPY_TEMPLATE_PACK', 'bootstrap4')
+    for cached in (uni_form_template, uni_formset_template, whole_uni_form_template,
+                   whole_uni_formset_template, default_field_template):
+        cached(pack)
+    for name in ('errors', 'errors_formset', 'display_form', 'inputs', 'layout/baseinput',
+                 'layout/checkboxselectmultiple', 'layout/radioselect', 'layout/help_text_and_errors'):
+        try:
+            get_template(f'{pack}/{name}.html')
+        except TemplateDoesNotExist:
+            pass
+
+
+def warm_forms():
+    # widgets render through the form renderer's own template engine
+    from .forms import ConsentForm, CookieSettingsForm, DataSubjectRequestForm
+    for form_class in (ConsentForm, CookieSettingsForm, DataSubjectRequestForm):
+        form = form_class()
+        for field in form:
+            str(field)
+
+
+def warm_translations():
+    for code, _ in settings.LANGUAGES:
+        with translation.override(code):
+            translation.gettext('Privacy Policy')
+            formats.get_format('DATETIME_FORMAT')
+
+
+def warm_static():
+    from django.contrib.staticfiles.storage import staticfiles_storage
+    # the manifest storage reads staticfiles.json when it is first set up
+    staticfiles_storage.base_location
+
+
+def warm_jurisdiction():
+    from .jurisdiction import get_resolver as get_ip_resolver
+    get_ip_resolver()
+
+
+def warm_databases():
+    from .policies import current_policies
+    try:
+        for alias in connections:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+        current_policies.for_language(settings.LANGUAGE_CODE)
+    finally:
+        connections.close_all()
+
+
+STEPS = {
+    'urls': warm_urls,
+    'templates': warm_templates,
+    'crispy': warm_crispy,
+    'forms': warm_forms,
+    'translations': warm_translations,
+    'static': warm_static,
+    'jurisdiction': warm_jurisdiction,
+    'databases': warm_databases,
+}
+
+
+def warm_up(steps=None):
+    """
+    Run the warm-up steps (all by default). Returns ``(step, seconds,
+    error)`` for each, error being None when the step succeeded.
+    """
+    results = []
+    for name in steps or STEPS:
+        start = time.perf_counter()
+        error = None
+        try:
+            STEPS[name]()
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            logger.warning(f'Warm-up step {name} failed: {error}')
+        results.append((name, time.perf_counter() - start, error))
+    logger.info('Warm-up: ' + ', '.join(f'{name} {seconds * 1000:.0f}ms' for name, seconds, _ in results))
+    return results
+
+
+_prefork_done = False
+
+
+def prefork():
+    """Warm up once per process and freeze the result, before a preloading server forks."""
+    global _prefork_done
+    if _prefork_done:
+        return
+    _prefork_done = True
+    warm_up()
+    gc.freeze()
+
+
+# What a worker imports before its first request
+WORKER_IMPORTS = '''
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler
+WSGIHandler()
+from importlib import import_module
+from django.conf import settings
+import_module(settings.ROOT_URLCONF)
+'''
+
+# "import time:       self [us] |  cumulative | imported package"
+_IMPORTTIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def parse_importtime(output):
+    """``(module, self_us, cumulative_us, depth)`` for every line of ``-X importtime`` output."""
+    rows = []
+    for line in output.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def import_profile(code=WORKER_IMPORTS):
+    """
+    Run ``code`` in a fresh interpreter under ``-X importtime``. Returns the
+    total import time, the modules and the top-level packages, slowest first.
+    """
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'data_ethics_project.settings')}
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+    )
+    rows = parse_importtime(completed.stderr)
+    if completed.returncode:
+        errors = [line for line in completed.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError('\n'.join(errors[-5:]) or f'exit status {completed.returncode}')
+
+    packages = defaultdict(lambda: {'self_ms': 0.0, 'modules': 0})
+    for module, self_us, _, _ in rows:
+        package = packages[module.split('.')[0]]
+        package['self_ms'] += self_us / 1000
+        package['modules'] += 1
+    return {
+        'total_ms': sum(self_us for _, self_us, _, _ in rows) / 1000,
+        'modules': sorted(
+            ({'module': module, 'self_ms': self_us / 1000, 'cumulative_ms': cumulative_us / 1000, 'depth': depth}
+             for module, self_us, cumulative_us, depth in rows),
+            key=lambda row: row['self_ms'], reverse=True,
+        ),
+        'packages': sorted(
+            ({'package': name, **totals} for name, totals in packages.items()),
+            key=lambda row: row['self_ms'], reverse=True,
+        ),
+    }
+
+
+def compare_profiles(profile, baseline, threshold=10.0, min_ms=5.0):
+    """
+    ``(name, old_ms, new_ms, change_pct, regressed)`` for the total and each
+    package taking ``min_ms`` or more in either profile. A regression is a
+    rise of more than ``threshold`` percent and ``min_ms``, so that noise in
+    tiny packages does not count.
+    """
+    def row(name, old, new):
+        change = (new - old) / old * 100 if old else 0.0
+        return name, old, new, change, change > threshold and new - old > min_ms
+
+    old = {row['package']: row['self_ms'] for row in baseline['packages']}
+    new = {row['package']: row['self_ms'] for row in profile['packages']}
+    rows = [row('total', baseline['total_ms'], profile['total_ms'])]
+    for package in sorted(old.keys() | new.keys(), key=lambda name: -new.get(name, 0.0)):
+        if max(old.get(package, 0.0), new.get(package, 0.0)) >= min_ms:
+            rows.append(row(package, old.get(package, 0.0), new.get(package, 0.0)))
+    return rows